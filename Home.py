@@ -15,10 +15,19 @@ import numpy as np
 import matplotlib.pyplot as plt
 import time
 
+from pricing import warmup
+
 #--------------------------------------------------------------------------#
 
 
 
+# Streamlit has no start-up hook, so the warm-up starts with the first run of this entry page: the snapshot,
+# aggregates and derived tables are loaded (or rebuilt, if the input files changed) on a background thread,
+# once per server process, while the page below renders
+warm = warmup.start_warmup()
+
+
+
 st.title("Price Elasticity of Demand & Pricing Optimiser for Walmart Retail Products")
 
 st.caption("FIT3164 DS - Pricing Optimisation and Analysis Project")
@@ -63,4 +72,14 @@ with interpret:
 
 
 
-# st.subheader("Inputs and Outputs")
\ No newline at end of file
+# st.subheader("Inputs and Outputs")
+
+
+
+# Progress of the warm-up, until the modelling pages are ready to open instantly
+if not warm.done:
+    progress = st.progress(warm.fraction, text=f"Preparing the data: {warm.status}")
+    warm.wait(lambda fraction, status: progress.progress(fraction, text=f"Preparing the data: {status}"))
+    progress.empty()
+if warm.error is not None:
+    st.warning(f"The data couldn't be prepared in the background ({warm.error}); the modelling pages will load it when opened.")
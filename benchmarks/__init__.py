@@ -0,0 +1,3 @@
+#------------------------------ Benchmarks ------------------------------#
+
+# Synthetic M5-shaped data and timings of the data path: python -m benchmarks.run
@@ -0,0 +1,187 @@
+#------------------------------ Dependencies ------------------------------#
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from pricing import snapshot
+
+#--------------------------------------------------------------------------#
+
+
+
+# Stores of the M5 data, by state
+STORES = ['CA_1', 'CA_2', 'CA_3', 'CA_4', 'TX_1', 'TX_2', 'TX_3', 'WI_1', 'WI_2', 'WI_3']
+
+# Departments and their item counts in M5 (3,049 items in total, 30,490 series over the 10 stores)
+DEPARTMENTS = {
+    'FOODS_1': 216, 'FOODS_2': 398, 'FOODS_3': 823,
+    'HOBBIES_1': 416, 'HOBBIES_2': 149,
+    'HOUSEHOLD_1': 532, 'HOUSEHOLD_2': 515,
+}
+
+# First day of the M5 calendar, and the 28 days the calendar runs past the last sales column
+FIRST_DATE = '2011-01-29'
+FORECAST_DAYS = 28
+
+# Fixed-date events, as (month, day, name, type)
+EVENTS = [
+    (1, 1, 'NewYear', 'National'),
+    (2, 14, 'ValentinesDay', 'Cultural'),
+    (7, 4, 'IndependenceDay', 'National'),
+    (10, 31, 'Halloween', 'Cultural'),
+    (12, 25, 'Christmas', 'National'),
+]
+
+# Days of the month SNAP benefits are paid out in each state
+SNAP_DAYS = {
+    'CA': range(1, 11),
+    'TX': [1, 3, 5, 6, 7, 9, 11, 12, 15],
+    'WI': [2, 3, 5, 6, 8, 9, 11, 12, 14, 15],
+}
+
+# Multipliers a price change picks from, and the chance a series changes price in any week
+PRICE_STEPS = np.array([0.8, 0.9, 1.0, 1.1])
+PRICE_CHANGE_RATE = 0.05
+
+
+
+# Walmart week ids (1YYWW) for each date: the fiscal year starts on the Saturday after January's last Friday
+def walmart_weeks(dates):
+    dates = pd.DatetimeIndex(dates)
+    years = np.arange(dates.year.min() - 1, dates.year.max() + 1)
+    starts = []
+    for year in years:
+        last_friday = pd.Timestamp(f'{year}-01-31')
+        last_friday -= pd.Timedelta(days=(last_friday.weekday() - 4) % 7)
+        starts.append(last_friday + pd.Timedelta(days=1))
+    starts = pd.DatetimeIndex(starts)
+
+    position = np.searchsorted(starts.values, dates.values, side='right') - 1
+    fiscal_year = years[position]
+    week = (dates.values - starts.values[position]).astype('timedelta64[D]').astype(np.int64) // 7 + 1
+    return 10000 + (fiscal_year % 100) * 100 + week
+
+
+
+# Calendar in the M5 schema, running FORECAST_DAYS past the last sales day
+def make_calendar(n_days=snapshot.N_DAYS):
+    dates = pd.date_range(FIRST_DATE, periods=n_days + FORECAST_DAYS)
+    calendar = pd.DataFrame({
+        'date': dates.strftime('%Y-%m-%d'),
+        'wm_yr_wk': walmart_weeks(dates),
+        'weekday': dates.day_name(),
+        'wday': (dates.weekday + 2) % 7 + 1,
+        'month': dates.month,
+        'year': dates.year,
+        'd': [f'd_{i}' for i in range(1, len(dates) + 1)],
+    })
+
+    names = pd.Series(np.nan, index=range(len(dates)), dtype=object)
+    types = pd.Series(np.nan, index=range(len(dates)), dtype=object)
+    for month, day, name, kind in EVENTS:
+        on = (dates.month == month) & (dates.day == day)
+        names[on], types[on] = name, kind
+    calendar['event_name_1'], calendar['event_type_1'] = names, types
+    calendar['event_name_2'], calendar['event_type_2'] = np.nan, np.nan
+
+    for state, days in SNAP_DAYS.items():
+        calendar[f'snap_{state}'] = dates.day.isin(days).astype(np.int8)
+
+    return calendar
+
+
+
+# Item ids, scaled down from the M5 department sizes (every department keeps at least one item)
+def make_items(n_items):
+    total = sum(DEPARTMENTS.values())
+    items = []
+    for dept, count in DEPARTMENTS.items():
+        items += [f'{dept}_{i:03d}' for i in range(1, max(round(count * n_items / total), 1) + 1)]
+    return items
+
+
+
+# Sales (wide, one d_ column per day) and sell prices (one row per series per week on sale) in the M5 schemas
+# Each series starts selling on a random day, sells a Poisson volume around its own rate and
+# holds its price for weeks at a time, stepping between a few discounts and a small rise
+def make_sales_and_prices(calendar, n_items, stores=STORES, n_days=snapshot.N_DAYS, seed=0):
+    rng = np.random.default_rng(seed)
+    items = make_items(n_items)
+
+    item_id = np.repeat(items, len(stores))
+    store_id = np.tile(stores, len(items))
+    n_series = len(item_id)
+
+    # Daily volumes, zero before each series' first day on sale
+    first_day = rng.integers(0, n_days // 2, n_series)
+    first_day[rng.random(n_series) < 0.5] = 0
+    rate = rng.gamma(0.6, 2.0, n_series)
+    counts = rng.poisson(rate[:, np.newaxis], (n_series, n_days)).astype(np.int16)
+    counts[np.arange(n_days) < first_day[:, np.newaxis]] = 0
+
+    sales = pd.DataFrame(counts, columns=[f'd_{i}' for i in range(1, n_days + 1)])
+    keys = pd.DataFrame({
+        'id': [f'{item}_{store}_evaluation' for item, store in zip(item_id, store_id)],
+        'item_id': item_id,
+        'dept_id': [item.rsplit('_', 1)[0] for item in item_id],
+        'cat_id': [item.split('_')[0] for item in item_id],
+        'store_id': store_id,
+        'state_id': [store[:2] for store in store_id],
+    })
+    sales = pd.concat([keys, sales], axis=1)
+
+    # Weekly prices: a base price per series, changed at random weeks and held until the next change
+    weeks = np.unique(calendar['wm_yr_wk'])
+    day_week = np.searchsorted(weeks, calendar['wm_yr_wk'].to_numpy()[:n_days])
+    first_week = day_week[first_day]
+
+    changes = rng.random((n_series, len(weeks))) < PRICE_CHANGE_RATE
+    changes[:, 0] = True
+    steps = PRICE_STEPS[rng.integers(0, len(PRICE_STEPS), (n_series, len(weeks)))]
+    steps[:, 0] = 1.0
+    last_change = np.maximum.accumulate(np.where(changes, np.arange(len(weeks)), 0), axis=1)
+    multiplier = np.take_along_axis(steps, last_change, axis=1)
+    base = np.round(rng.lognormal(1.0, 0.8, n_series), 2)
+    price = np.round(base[:, np.newaxis] * multiplier, 2)
+
+    series, week = np.nonzero(np.arange(len(weeks)) >= first_week[:, np.newaxis])
+    prices = pd.DataFrame({
+        'store_id': store_id[series],
+        'item_id': item_id[series],
+        'wm_yr_wk': weeks[week],
+        'sell_price': price[series, week],
+    })
+
+    return sales, prices
+
+
+
+# Writes the three M5 CSVs into out_dir
+def generate(out_dir, n_items, seed=0):
+    os.makedirs(out_dir, exist_ok=True)
+    calendar = make_calendar()
+    sales, prices = make_sales_and_prices(calendar, n_items, seed=seed)
+    calendar.to_csv(os.path.join(out_dir, snapshot.CALENDAR_FILE), index=False)
+    sales.to_csv(os.path.join(out_dir, snapshot.SALES_FILE), index=False)
+    prices.to_csv(os.path.join(out_dir, snapshot.PRICES_FILE), index=False)
+    return len(sales), len(prices)
+
+
+
+# python -m benchmarks.generate --items 3049 --out ./benchmarks/data/full
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic sales, prices and calendar CSVs in the M5 schemas.')
+    parser.add_argument('--items', type=int, default=sum(DEPARTMENTS.values()), help='Number of items (each sold in all 10 stores); 3049 is full M5 scale')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--out', required=True, help='Directory to write the CSVs to')
+    args = parser.parse_args()
+
+    n_series, n_prices = generate(args.out, args.items, args.seed)
+    print(f'Wrote {n_series} series x {snapshot.N_DAYS} days and {n_prices} price rows to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#------------------------------ Dependencies ------------------------------#
+
+import argparse
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.generate import generate
+from pricing import aggregation, batch, daily_prices, forecast, snapshot
+from pricing.elasticity import arc_elasticity_table, index_arc_table, regression_elasticity_table
+from pricing.panel import SeriesPanel
+from pricing.seasonal import SeasonalIndex
+
+#--------------------------------------------------------------------------#
+
+
+
+# Number of items (each in all 10 stores) for each named scale; 'full' is the size of the real M5 data
+SCALES = {'small': 100, 'medium': 1000, 'full': 3049}
+
+# Where generated data is kept between runs, and where the stored baselines live
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+BASELINES_FILE = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# A stage regresses when it's this much slower, or peaks this much higher, than its baseline
+TOLERANCE = 0.25
+
+# Absolute slack on top of the tolerance, so millisecond-scale stages don't flag on timer noise
+SLACK = {'seconds': 0.01, 'peak_mb': 1.0}
+
+# Selections replayed through the per-interaction path
+INTERACTIONS = 50
+
+
+
+# Runs fn once under tracemalloc for its peak traced memory, then `repeat` times for the best wall time
+# Returns the last result with {'seconds', 'peak_mb'}
+def measure(fn, repeat=3):
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = []
+    for _ in range(repeat):
+        del result
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+
+    return result, {'seconds': round(min(seconds), 4), 'peak_mb': round(peak / 2**20, 1)}
+
+
+
+# One click on the [S] and [LRM] pages: select a series, look up its optimal price, arc and regression
+# elasticity and base demand, and forecast across the discount curve
+def interaction(panel, arc_table, regression_table, seasonal_index, item_id, state_id):
+    filtered_data = panel.series(item_id, state_id).tail(13)
+    optimal = panel.optimal_prices[13].loc[(item_id, state_id)]
+
+    start_data, end_data = filtered_data.iloc[-2], filtered_data.iloc[-1]
+    arc_pair = arc_table.loc[(item_id, start_data['store_id'], start_data['year_month'])]
+    regression = regression_table.loc[(item_id, state_id)]
+
+    year, month = end_data['year_month'].split('-')
+    base_demand = round(seasonal_index.base_demand(item_id, state_id, year, month), 2)
+    curve = forecast.discount_curve(base_demand, regression['elasticity'], end_data['sell_price'])
+    return optimal, arc_pair, curve
+
+
+
+# Generates (or reuses) the scale's data and times every stage of the data path
+def run(scale, repeat=3, data_dir=DATA_DIR):
+    source = os.path.join(data_dir, scale)
+    if not os.path.exists(os.path.join(source, snapshot.SALES_FILE)):
+        generate(source, SCALES[scale])
+
+    results = {}
+
+    # Loading: the raw CSVs, then a snapshot converted from them
+    (sales, prices, calendar), results['load_csv'] = measure(lambda: snapshot.read_csvs(source), repeat)
+    snapshot_dir = os.path.join(source, 'snapshot')
+    if not snapshot.snapshot_exists(snapshot_dir):
+        snapshot.write_snapshot(sales, prices, calendar, snapshot_dir)
+    _, results['load_snapshot'] = measure(lambda: snapshot.read_snapshot(snapshot_dir), repeat)
+
+    # Monthly aggregation (calculate_monthly_sales_and_prices_optimized on the pages before it moved here)
+    (monthly_sales, monthly_prices), results['aggregate'] = measure(
+        lambda: aggregation.monthly_sales_and_prices(sales, prices, calendar), repeat)
+
+    # Daily price matrix (written into the snapshot, rebuilt by incremental appends) and the day-weighted monthly
+    # prices with exact revenue the Dataset panel is built from
+    price_matrix, results['daily_price_matrix'] = measure(
+        lambda: daily_prices.daily_price_matrix(sales, prices, calendar), repeat)
+    day_prices, results['monthly_day_prices'] = measure(
+        lambda: daily_prices.monthly_day_prices(sales, price_matrix, calendar), repeat)
+
+    # Tables built once per server process, on the day-weighted prices as Dataset.panel does
+    panel, results['panel'] = measure(lambda: SeriesPanel(monthly_sales, day_prices), repeat)
+    arc_table, results['arc_table'] = measure(lambda: index_arc_table(arc_elasticity_table(panel.data)), repeat)
+    regression_table, results['regression_table'] = measure(lambda: regression_elasticity_table(panel.data), repeat)
+    seasonal_index, results['seasonal_index'] = measure(lambda: SeasonalIndex(panel.data), repeat)
+
+    # The per-interaction path, replayed over a fixed sample of series with at least two months
+    rng = np.random.default_rng(0)
+    keys = panel.keys[[panel.series(item, state).shape[0] >= 2 for item, state in zip(panel.keys['item_id'], panel.keys['state_id'])]]
+    sample = keys.iloc[rng.choice(len(keys), min(INTERACTIONS, len(keys)), replace=False)]
+    def interactions():
+        for item_id, state_id in zip(sample['item_id'], sample['state_id']):
+            interaction(panel, arc_table, regression_table, seasonal_index, item_id, state_id)
+    _, results['interaction'] = measure(interactions, repeat)
+    results['interaction']['count'] = len(sample)
+
+    # The catalogue-wide batch report, in-process so the timing doesn't depend on the machine's core count
+    _, results['batch_report'] = measure(lambda: batch.catalogue_report(panel, workers=1), repeat)
+
+    return results
+
+
+
+# Stages which got slower or heavier than their baseline by more than `tolerance`
+def compare(results, baselines, tolerance=TOLERANCE):
+    regressions = []
+    for stage, result in results.items():
+        baseline = baselines.get(stage)
+        if baseline is None:
+            continue
+        for metric in ('seconds', 'peak_mb'):
+            if result[metric] > baseline[metric] * (1 + tolerance) + SLACK[metric]:
+                regressions.append(f'{stage}: {metric} {result[metric]} vs baseline {baseline[metric]}')
+    return regressions
+
+
+
+# Stored baselines, {scale: {stage: {seconds, peak_mb}}}; empty before the first --save-baseline
+def read_baselines(path=BASELINES_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+
+# python -m benchmarks.run --scale small [--save-baseline]
+# Baselines are machine-specific: record them on the machine the comparison will run on
+def main():
+    parser = argparse.ArgumentParser(description='Time the data path on synthetic M5-shaped data and compare against stored baselines.')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='Size of the generated data')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage; the best is kept')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Allowed slowdown or memory growth before a stage counts as a regression')
+    parser.add_argument('--baselines', default=BASELINES_FILE, help='JSON file of baselines, keyed by scale')
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the scale's baseline instead of comparing")
+    args = parser.parse_args()
+
+    results = run(args.scale, args.repeat)
+    baselines = read_baselines(args.baselines)
+    for stage, result in results.items():
+        baseline = baselines.get(args.scale, {}).get(stage, {})
+        print(f"{stage:<18} {result['seconds']:>9.4f}s {result['peak_mb']:>9.1f} MB"
+              f"   (baseline {baseline.get('seconds', '-')}s, {baseline.get('peak_mb', '-')} MB)")
+
+    if args.save_baseline:
+        baselines[args.scale] = {**results, '_machine': platform.platform()}
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'Saved {args.scale} baseline to {args.baselines}')
+        return
+
+    regressions = compare(results, baselines.get(args.scale, {}), args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,74 +18,9 @@ import matplotlib.pyplot as plt
 #import time
 #import math
 
-#--------------------------------------------------------------------------#
-
-
-
-@st.cache_data
-def load_data():
-    # Load only necessary columns from each dataset
-
-    # Sales CSV (in wide format), contains each items' sales record at each day
-    # Take all the wide-format 'd' aka. day columns
-    sales_columns = ['id', 'item_id', 'store_id', 'state_id'] + [f'd_{i}' for i in range(1, 1942)]
-    sales = pd.read_csv('https://storage.googleapis.com/pricing-optimisation-data/original/sales_train_evaluation.csv', usecols=sales_columns)
-
-    # Prices CSV -> Contains an item's Price, at a specific wm_yr_wk (the week)
-    prices_columns = ['item_id', 'store_id', 'wm_yr_wk', 'sell_price']
-    prices = pd.read_csv('https://storage.googleapis.com/pricing-optimisation-data/original/sell_prices.csv', usecols=prices_columns)
-
-    # Events CSV -> Omit events for now
-    calendar_columns = ['d', 'date', 'wm_yr_wk']
-    calendar = pd.read_csv('https://storage.googleapis.com/pricing-optimisation-data/original/calendar.csv', usecols=calendar_columns)
-
-    return sales, prices, calendar
-
-
-
-
-
-
-
-@st.cache_data
-# Aggregates the sales and price data at a MONTHLY level
-def calculate_monthly_sales_and_prices_optimized(sales, prices, calendar):
-
-
-    # convert Date column (string) into date_time type
-    calendar['date'] = pd.to_datetime(calendar['date'])
-
-    # Use .dt.to_period('M') to get yyyy-mm format, and convert back into string
-    calendar['year_month'] = calendar['date'].dt.to_period('M').astype(str)
-
-    # Take only the two needed columns, day and the year-month, this will be used for merging with sales dataset
-    # Now we can map to each day of sales, with its respective year-month that it belongs to
-    calendar_mapping = calendar[['d', 'year_month']]
-
-    # Melt sales CSV from wide format to long format
-    sales_long = pd.melt(sales, id_vars=['item_id', 'store_id', 'state_id'], var_name='d', value_name='sales')
-
-    # Merge calendar with sales, directly mapping each day with its designated year-month
-    sales_long = sales_long.merge(calendar_mapping, on='d', how='left')
-
-    # Group data by month, aggregating sales data by the below columns to obtain monthly sales
-    monthly_sales = sales_long.groupby(['item_id', 'store_id', 'state_id', 'year_month'], as_index=False)['sales'].sum()
-
-    # Aggregate prices to monthly average prices by mapping weeks to months
-    # Use previous calendar dataframe, and map each week identifer to each corresponding monthly period
-    calendar_week_mapping = calendar[['wm_yr_wk', 'year_month']].drop_duplicates()
-
-    # Merge prices with above calendar mapping, so each item's pricing at each corresponding week id (wm_yr_wk) is mapped to a year-month identifier
-    prices = prices.merge(calendar_week_mapping, on='wm_yr_wk', how='left')
-
-    # Aggregate prices by below columns, to obtain monthly average prices (Average each month's prices for the item)
-    monthly_prices = prices.groupby(['item_id', 'store_id', 'year_month'], as_index=False)['sell_price'].mean()
-
-    # Return the aggregated dataframes which will be filtered later
-    return monthly_sales, monthly_prices
-
-
+from pricing import cube, forecast, granularity, instrumentation, rolling, service, warmup
 
+#--------------------------------------------------------------------------#
 
 
 
@@ -101,44 +36,78 @@ def main():
     # ------------------------------------ 1. Load, Prepare and Aggregate Data ------------------------------------ #
 
     # Load data
-    sales, prices, calendar = load_data()
-    monthly_sales, monthly_prices = calculate_monthly_sales_and_prices_optimized(sales, prices, calendar)
+    # Loaded and aggregated once per server process and shared, without copies, by every page and session
+    # (in lazy mode only the key index is loaded here, and the selected series is loaded on its own below)
+    # The server's warm-up (started by the Home page, or here if this page is opened first) is waited on with a
+    # progress bar; lazy mode only needs it to have checked the snapshot against the input files
+    warm = warmup.start_warmup()
+    if not warm.done:
+        progress = st.progress(warm.fraction, text=f"Preparing the data: {warm.status}")
+        warm.wait(lambda fraction, status: progress.progress(fraction, text=f"Preparing the data: {status}"), snapshot_only=service.LAZY)
+        progress.empty()
+    catalogue = service.get_catalogue()
 
 
     # ------------------------------------ 2.a Take user INPUT for Item and State ---------------------------------- #
 
+    # Select the level of the hierarchy to analyse: an item summed over a state's stores by default (one row per
+    # period), its individual stores, or a roll-up of departments or categories, looked up from the cube
+    product_level = st.selectbox("Select a Product Level", options=cube.PRODUCT_LEVELS)
+    location_level = st.selectbox("Select a Location Level", options=cube.LOCATION_LEVELS, index=cube.LOCATION_LEVELS.index('state'))
+    level = catalogue.at_level(product_level, location_level)
+
     # Select an item and state
-    item_selected = st.selectbox("Select an Item", options=monthly_sales['item_id'].unique())
-    print(f"ITEM User Input: {item_selected}")
-    state_selected = st.selectbox("Select a State", options=monthly_sales['state_id'].unique())
-    print(f"STATE User Input: {state_selected}")
+    item_selected = st.selectbox("Select an Item", options=level.items)
+    state_selected = st.selectbox("Select a State", options=level.states)
+    instrumentation.event('selection', page='S', item_id=item_selected, state_id=state_selected,
+                          product_level=product_level, location_level=location_level)
+
+    dataset = level.for_series(item_selected, state_selected)
+
+    # Select the time buckets to aggregate to (re-bucketed from the cached daily data, nothing is reloaded)
+    granularity_selected = st.selectbox("Select a Granularity", options=dataset.granularities,
+                                        index=dataset.granularities.index('month'))
+    units = granularity.GRANULARITY_UNITS[granularity_selected]
+
+    view = dataset.at_granularity(item_selected, state_selected, granularity_selected)
+    series_panel = view.panel
+    arc_table = view.arc_table
+    # Base demand comes from the seasonal (per month of the year) index whatever the granularity, taken pro rata
+    # for the days of a period (see granularity.period_base_demand)
+    seasonal_index = dataset.seasonal_index
 
                     # ------------ Filter dataset based on INPUT Item and State ------------ #
 
-    # Merge the monthly-aggregated sales and prices dataframes
-    data = monthly_sales.merge(monthly_prices, on=['item_id', 'store_id', 'year_month'], how='left')
-    # Take the 13 most recent months, filtered by user's input of Item and State
-    filtered_data = data[(data['item_id'] == item_selected) & (data['state_id'] == state_selected)].tail(13)
-    filtered_data_w_revenue = data[(data['item_id'] == item_selected) & (data['state_id'] == state_selected)].tail(13)
+    # Look up the user's Item and State in the pre-merged panel (no full-frame scan)
+    selection = series_panel.series(item_selected, state_selected)
+    # Take the 13 most recent periods, filtered by user's input of Item and State
+    filtered_data = selection.tail(13)
+    filtered_data_w_revenue = selection.tail(13).copy()
+    instrumentation.lap('select', rows=len(selection))
 
 
                     # -------------------- OUTPUT Filtered Dataframe --------------------- #
 
     
 
-    filtered_data_w_revenue['monthly_revenue'] = filtered_data_w_revenue['sales'] * filtered_data_w_revenue['sell_price']
-
-    # Step 2: Aggregate total revenue by price
-    total_revenue_by_price = filtered_data_w_revenue.groupby('sell_price')['monthly_revenue'].sum()
+    # Exact revenue (each day's sales at that day's price) where the panel has it, else sales at the average price
+    if 'revenue' in filtered_data_w_revenue:
+        filtered_data_w_revenue['monthly_revenue'] = filtered_data_w_revenue['revenue']
+    else:
+        filtered_data_w_revenue['monthly_revenue'] = filtered_data_w_revenue['sales'] * filtered_data_w_revenue['sell_price']
 
-    max_revenue_price = total_revenue_by_price.idxmax()
-    max_revenue = total_revenue_by_price.max()
+    # Step 2: Price with the highest total revenue over these 13 periods,
+    # precomputed for every item and state when the panel was built
+    optimal = series_panel.optimal_prices[13].loc[(item_selected, state_selected)]
+    max_revenue_price = optimal['optimal_price']
+    max_revenue = optimal['optimal_revenue']
 
 
 
     st.info(f"Historic Optimal Price: {max_revenue_price:.2f}, with a total revenue of {max_revenue:.2f}")
-    st.write("Past 13 months' sales volume and average price:")
+    st.write(f"Past 13 {units}' sales volume and average price:")
     st.dataframe(filtered_data_w_revenue[['year_month', 'item_id', 'state_id', 'sales', 'sell_price', 'monthly_revenue']].tail(13))
+    instrumentation.lap('optimal_price', rows=len(filtered_data_w_revenue))
 
     
 
@@ -147,7 +116,7 @@ def main():
 
     # Select two adjacent months to calculate elasticity
     months = filtered_data['year_month'].astype(str).tolist()
-    selected_months = st.radio("Select two adjacent months to calculate price elasticity", 
+    selected_months = st.radio(f"Select two adjacent {units} to calculate price elasticity", 
                                options=list(zip(months[:-1], months[1:])))
     start_month, end_month = selected_months
 
@@ -175,47 +144,29 @@ def main():
 
 
     # Pre-examines the selected pair of months, and if inelastic, display specific reason why
-    
-    # state elasticty status as elastic first, then change according to conditional statements validated after
+    # The checks themselves were already run for every pair in the catalogue (see pricing/elasticity.py),
+    # so just read this pair's row from the cached table
+    arc_pair = arc_table.loc[(item_selected, start_data['store_id'], start_month)]
+    special_case = bool(arc_pair['special_case'])
+    premium_case = bool(arc_pair['premium_case'])
+    instrumentation.lap('arc_elasticity', rows=1)
+
+    inelastic_explanations = {
+        'zero_sales_same_price': zero_sales_same_price,
+        'numerator_zero': numerator_zero,
+        'numerator_and_denominator_same': numerator_and_denominator_same,
+        'denominator_zero': denominator_zero,
+    }
+
+    # state elasticty status as elastic first, then change if the pair was ruled inelastic
     elasticity_status = "Elastic"
 
-    # if sales volume is zero, and sell price stayed the same
-    if start_data['sales'] == 0 and end_data['sales'] == 0 and round(end_data['sell_price'],2) - round(start_data['sell_price'],2) == 0:
-        elasticity_status = "Inelastic"
-        st.error(f"The selected item is {elasticity_status} in {state_selected} during {start_month} and {end_month} \n")
-        show_explanation = st.expander("Why is this the case and what does this mean?")
-        with show_explanation:
-            st.warning(zero_sales_same_price)
-    # if sales volume stayed the same, but sell price changed
-    elif end_data['sales'] - start_data['sales'] == 0 and round(end_data['sell_price'],2) - round(start_data['sell_price'],2) != 0:
-        elasticity_status = "Inelastic"
-        st.error(f"The selected item is {elasticity_status} in {state_selected} during {start_month} and {end_month} \n")
-        show_explanation = st.expander("Why is this the case and what does this mean?")
-        with show_explanation:
-            st.warning(numerator_zero)
-    
-    # if sales volume stayed the same, and sales price stayed the same
-    elif end_data['sales'] - start_data['sales'] == 0 and round(end_data['sell_price'],2) == round(start_data['sell_price'],2): # end_data['sell_price'] - start_data['sell_price'] == 0:
-        elasticity_status = "Inelastic"
-        st.error(f"The selected item is {elasticity_status} in {state_selected} during {start_month} and {end_month} \n")
-        show_explanation = st.expander("Why is this the case and what does this mean?")
-        with show_explanation:
-            st.warning(numerator_and_denominator_same)
-
-    # if sales volume changed, and sales price stayed the same
-    elif end_data['sales'] - start_data['sales'] != 0 and round(end_data['sell_price'],2) == round(start_data['sell_price'],2): #end_data['sell_price'] - start_data['sell_price'] == 0:
+    if arc_pair['inelastic_reason'] in inelastic_explanations:
         elasticity_status = "Inelastic"
         st.error(f"The selected item is {elasticity_status} in {state_selected} during {start_month} and {end_month} \n")
         show_explanation = st.expander("Why is this the case and what does this mean?")
         with show_explanation:
-            st.warning(denominator_zero)
-    elif start_data['sales'] == 0: # round(end_data['sell_price'],2) == round(start_data['sell_price'],2) or :
-        elasticity_status = "Elastic"
-        special_case = True
-    elif end_data['sales'] > start_data['sales'] and round(end_data['sell_price'],2) > round(start_data['sell_price'],2):
-        elasticity_status = "Elastic"
-        special_case = True
-        premium_case = True
+            st.warning(inelastic_explanations[arc_pair['inelastic_reason']])
 
 
 
@@ -228,11 +179,9 @@ def main():
     if elasticity_status == "Elastic":
         # Proceed with calculating price elasticty IF it's not a special case, or if it's a premium case
         if special_case == False or (special_case == True and premium_case == True):
-            # Calculate price elasticity using the formula and previously calculated values
-            pct_change_sales = (end_data['sales'] - start_data['sales']) / start_data['sales']
-            pct_change_price = (end_data['sell_price'] - start_data['sell_price']) / start_data['sell_price']
-
-            elasticity = pct_change_sales / pct_change_price
+            # Price elasticity from the formula, precalculated in the arc table:
+            # ((end sales - start sales) / start sales) / ((end price - start price) / start price)
+            elasticity = arc_pair['elasticity']
 
 
             # ------------------------------------ Messages for Special Cases ------------------------------------ #
@@ -256,6 +205,30 @@ def main():
             st.success(f"The selected item is {elasticity_status}.  \n\nHowever, as the sales volume in {start_month} was Zero, elasticity cannot be calculated as dividing by zero is undefined. \n\nThis may potentially suggest that the item is highly elastic as there was a signicant change in sales volume when price was changed.")
 
 
+    # No elasticity could be calculated for this pair (ruled Inelastic up front, or no sales in the first month):
+    # offer the regression elasticity of the most similar items instead, from the precomputed neighbour index
+    if pd.isna(arc_pair['elasticity']):
+        neighbour_index = level.neighbour_index
+        borrowed = neighbour_index.borrowed_elasticity(item_selected, state_selected) if neighbour_index is not None else None
+        if borrowed is not None:
+            borrowed_elasticity, neighbours = borrowed
+            show_borrowed = st.expander("Estimate borrowed from similar items")
+            with show_borrowed:
+                st.info(f"The {len(neighbours)} items most similar to this one in {state_selected} (same department or category, similar monthly sales and prices) have an average Price elasticity of {borrowed_elasticity:.2f}")
+                st.dataframe(neighbours, hide_index=True)
+        instrumentation.lap('neighbours')
+
+    # The month pair above is a single snapshot; the timeline shows the item's regression elasticity over a moving
+    # window ending at each period, computed all at once from running sums (see pricing/rolling.py)
+    show_timeline = st.expander("Elasticity over time")
+    with show_timeline:
+        window = st.selectbox("Select a Rolling Window", options=rolling.WINDOWS, index=rolling.WINDOWS.index(12),
+                              format_func=lambda length: f"{length} {units}" if length else "Expanding (all history so far)")
+        timeline = rolling.rolling_elasticity(selection, window)
+        st.line_chart(timeline)
+    instrumentation.lap('rolling_elasticity', rows=len(timeline))
+
+
 
 
     # ------------------------------------ 4. Select Discount Percentage ------------------------------------ #
@@ -269,7 +242,8 @@ def main():
             st.info(f"This means that for this item, changes in price will yield a significant change in demand. \n More specifically, a 1% decrease in price will result in a {abs(round(elasticity,2))}% increase in quantity demanded.")
         
         discount_percentage = st.slider("Select a discount percentage", 0.0, 100.0, 5.0)
-        print(f"Discount Percentage Selected: {discount_percentage}")
+        instrumentation.event('discount', page='S', item_id=item_selected, state_id=state_selected, discount_percentage=discount_percentage)
+        instrumentation.lap('elasticity_status')
 
 
 
@@ -277,29 +251,24 @@ def main():
 
 
         # Calculate Base demand 
-        # Take the selected month (that we're predicting for)
-        selected_date = end_data['year_month'].split("-")
-        selected_year = selected_date[0]
-        selected_month = selected_date[1]
-
-        # Construct strings for the years prior, at that month
-        required_past_years_dates = []
-        for year in range(2011,int(selected_year) + 1):
-            required_past_years_dates.append(str(year) + "-" + selected_month)
-
-        # Find the sales volumes of the prior years, at that month
-        past_selected_volumes = []
-        for date in required_past_years_dates:
-            sales = data[(data['item_id'] == item_selected) & (data['state_id'] == state_selected) & (data['year_month'] == date)]['sales'].mean()
-            past_selected_volumes.append(sales)
-        
+        # Take the selected period (that we're predicting for)
+        selected_period = end_data['year_month']
+
         # Let our base demand be the average of the prior years' volumes at that month
-        base_demand = round(np.mean(past_selected_volumes),2)
+        # (read from the precomputed seasonal index rather than filtering the data once per year;
+        # a day, week or quarter takes its share of each month it overlaps, so it's in the elasticity's units)
+        base_demand = round(granularity.period_base_demand(seasonal_index, item_selected, state_selected, selected_period,
+                                                           granularity_selected, dataset.calendar), 2)
+        instrumentation.lap('base_demand', rows=1)
 
 
         
         # base_demand = filtered_data.tail(1)['sales'].mean() ## * 14
-        st.write(f"Average Base Demand for this item during the {selected_month}'th month of the year, across the past 5 years: {base_demand}")
+        if granularity_selected == 'month':
+            selected_month = selected_period.split("-")[1]
+            st.write(f"Average Base Demand for this item during the {selected_month}'th month of the year, across the past 5 years: {base_demand}")
+        else:
+            st.write(f"Average Base Demand for this item during the {units[:-1]} {selected_period}, from the same months across the past 5 years: {base_demand}")
 
 
         # ------------------------- 5. Forecast Sales Volume & Display as OUTPUT -------------------------- #
@@ -313,5 +282,18 @@ def main():
         with show_calculation:
             st.info(f"Elasticity: {elasticity:.2f} \n\n Base demand (Average daily sales volume in the most recent month): {base_demand} \n\n Discount Percentage selected: {discount_percentage}% \n\n Calculation: \n\n Elasticty * -1(Discount Percentage) = Predicted Change \n\n {elasticity:.2f} * -1({discount_percentage}%) = {round(predicted_change,2)} \n\n Base Demand * 1 + Predicted Change = Predicted Sales Volume \n\n {base_demand} * 1 + {round(predicted_change,2)} = {round(forecasted_sales_volume,2)} \n\n Take the absolute value.")
 
+        # Evaluate every discount from 0% to 100% at once, so the full curve shows without dragging the slider
+        curve = forecast.discount_curve(base_demand, elasticity, end_data['sell_price'], absolute=True)
+        best = curve.loc[curve['revenue'].idxmax()] if curve['revenue'].notna().any() else None
+        show_curve = st.expander("Forecast across all discounts")
+        with show_curve:
+            st.line_chart(curve.set_index('discount')[['volume', 'revenue']])
+            if best is not None:
+                st.info(f"Revenue-maximising discount: {best['discount']}% ({best['volume']:.0f} units, revenue of {best['revenue']:.2f} at a price of {end_data['sell_price']:.2f})")
+        instrumentation.lap('forecast', rows=len(curve))
+
 if __name__ == "__main__":
+    # Time every step of this run, then show them in the sidebar if diagnostics are switched on
+    instrumentation.start_trace()
     main()
+    instrumentation.diagnostics_panel(st.sidebar)
@@ -15,84 +15,17 @@ add_logo("assets/team_logo.png", height=0)
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import statistics
 #import time
 #import math
-import statsmodels.api as sm
 
 # from statsmodels.regression.linear_model import OLS
 # import statsmodels.regression.linear_model as lm
 
 # from statsmodels.tools.tools import add_constant
 
-#--------------------------------------------------------------------------#
-
-
-
-@st.cache_data
-def load_data():
-    # Load only necessary columns from each dataset
-
-    # Sales CSV (in wide format), contains each items' sales record at each day
-    # Take all the wide-format 'd' aka. day columns
-    sales_columns = ['id', 'item_id', 'store_id', 'state_id'] + [f'd_{i}' for i in range(1, 1942)]
-    sales = pd.read_csv('./sales_train_evaluation.csv', usecols=sales_columns)
-
-    # Prices CSV -> Contains an item's Price, at a specific wm_yr_wk (the week)
-    prices_columns = ['item_id', 'store_id', 'wm_yr_wk', 'sell_price']
-    prices = pd.read_csv('./sell_prices.csv', usecols=prices_columns)
-
-    # Events CSV -> Omit events for now
-    calendar_columns = ['d', 'date', 'wm_yr_wk']
-    calendar = pd.read_csv('./calendar.csv', usecols=calendar_columns)
-
-    return sales, prices, calendar
-
-
-
-
-
-
-
-@st.cache_data
-# Aggregates the sales and price data at a MONTHLY level
-def calculate_monthly_sales_and_prices_optimized(sales, prices, calendar):
-
-
-    # convert Date column (string) into date_time type
-    calendar['date'] = pd.to_datetime(calendar['date'])
-
-    # Use .dt.to_period('M') to get yyyy-mm format, and convert back into string
-    calendar['year_month'] = calendar['date'].dt.to_period('M').astype(str)
-
-    # Take only the two needed columns, day and the year-month, this will be used for merging with sales dataset
-    # Now we can map to each day of sales, with its respective year-month that it belongs to
-    calendar_mapping = calendar[['d', 'year_month']]
-
-    # Melt sales CSV from wide format to long format
-    sales_long = pd.melt(sales, id_vars=['item_id', 'store_id', 'state_id'], var_name='d', value_name='sales')
-
-    # Merge calendar with sales, directly mapping each day with its designated year-month
-    sales_long = sales_long.merge(calendar_mapping, on='d', how='left')
-
-    # Group data by month, aggregating sales data by the below columns to obtain monthly sales
-    monthly_sales = sales_long.groupby(['item_id', 'store_id', 'state_id', 'year_month'], as_index=False)['sales'].sum()
-
-    # Aggregate prices to monthly average prices by mapping weeks to months
-    # Use previous calendar dataframe, and map each week identifer to each corresponding monthly period
-    calendar_week_mapping = calendar[['wm_yr_wk', 'year_month']].drop_duplicates()
-
-    # Merge prices with above calendar mapping, so each item's pricing at each corresponding week id (wm_yr_wk) is mapped to a year-month identifier
-    prices = prices.merge(calendar_week_mapping, on='wm_yr_wk', how='left')
-
-    # Aggregate prices by below columns, to obtain monthly average prices (Average each month's prices for the item)
-    monthly_prices = prices.groupby(['item_id', 'store_id', 'year_month'], as_index=False)['sell_price'].mean()
-
-    # Return the aggregated dataframes which will be filtered later
-    return monthly_sales, monthly_prices
-
-
+from pricing import bootstrap, cube, forecast, granularity, instrumentation, rolling, service, warmup
 
+#--------------------------------------------------------------------------#
 
 
 
@@ -100,44 +33,106 @@ def main():
     st.title("Price Elasticity Modeling Tool")
 
     # Load data
-    sales, prices, calendar = load_data()
-    monthly_sales, monthly_prices = calculate_monthly_sales_and_prices_optimized(sales, prices, calendar)
+    # Loaded and aggregated once per server process and shared, without copies, by every page and session
+    # (in lazy mode only the key index is loaded here, and the selected series is loaded on its own below)
+    # The server's warm-up (started by the Home page, or here if this page is opened first) is waited on with a
+    # progress bar; lazy mode only needs it to have checked the snapshot against the input files
+    warm = warmup.start_warmup()
+    if not warm.done:
+        progress = st.progress(warm.fraction, text=f"Preparing the data: {warm.status}")
+        warm.wait(lambda fraction, status: progress.progress(fraction, text=f"Preparing the data: {status}"), snapshot_only=service.LAZY)
+        progress.empty()
+    catalogue = service.get_catalogue()
+
+    # Select the level of the hierarchy to analyse: an item summed over a state's stores by default (one row per
+    # period), its individual stores, or a roll-up of departments or categories, looked up from the cube
+    product_level = st.selectbox("Select a Product Level", options=cube.PRODUCT_LEVELS)
+    location_level = st.selectbox("Select a Location Level", options=cube.LOCATION_LEVELS, index=cube.LOCATION_LEVELS.index('state'))
+    level = catalogue.at_level(product_level, location_level)
 
     # Select an item and state
-    item_selected = st.selectbox("Select an Item", options=monthly_sales['item_id'].unique())
-    state_selected = st.selectbox("Select a State", options=monthly_sales['state_id'].unique())
+    item_selected = st.selectbox("Select an Item", options=level.items)
+    state_selected = st.selectbox("Select a State", options=level.states)
+    instrumentation.event('selection', page='LRM', item_id=item_selected, state_id=state_selected,
+                          product_level=product_level, location_level=location_level)
+
+    dataset = level.for_series(item_selected, state_selected)
+
+    # Select the time buckets to fit the regression on (re-bucketed from the cached daily data, nothing is reloaded)
+    granularity_selected = st.selectbox("Select a Granularity", options=dataset.granularities,
+                                        index=dataset.granularities.index('month'))
+    units = granularity.GRANULARITY_UNITS[granularity_selected]
+
+    # Optionally separate the price effect from holidays and SNAP days: the regression adds the share of each
+    # period's days with an event / SNAP as controls, and base demand comes from event-adjusted monthly sales
+    # (both precomputed, see pricing/events.py)
+    control_events = st.checkbox("Control for events and SNAP days", value=False)
+
+    view = dataset.at_granularity(item_selected, state_selected, granularity_selected)
+    series_panel = view.panel
+    regression_table = view.controlled_regression_table if control_events else view.regression_table
+    # Base demand comes from the seasonal (per month of the year) index whatever the granularity, taken pro rata
+    # for the days of a period (see granularity.period_base_demand)
+    adjusted = dataset.event_adjusted if control_events else None
+    seasonal_index = adjusted.seasonal_index if adjusted is not None else dataset.seasonal_index
 
-    # Merge sales and prices for the selected item and state
-    data = monthly_sales.merge(monthly_prices, on=['item_id', 'store_id', 'year_month'], how='left')
-    filtered_data = data[(data['item_id'] == item_selected) & (data['state_id'] == state_selected)]
+    # Look up the selected item and state in the pre-merged panel (no full-frame scan)
+    selection = series_panel.series(item_selected, state_selected)
+    filtered_data = selection
 
 
-    st.write("Past 13 months' sales volume and average price:")
+    st.write(f"Past 13 {units}' sales volume and average price:")
     st.write(filtered_data[['year_month', 'sales', 'sell_price']].tail(13))
+    instrumentation.lap('select', rows=len(selection))
 
-    # Remove rows with zero sales or zero prices
-    filtered_data = filtered_data[(filtered_data['sales'] > 0) & (filtered_data['sell_price'] > 0)]
+    # The regression was already fitted for every series (see pricing/elasticity.py):
+    # rows with zero sales or zero prices removed, then sales ~ constant + sell_price
+    key = (item_selected, state_selected)
 
     # Ensure there is price variability
-    if filtered_data['sell_price'].nunique() < 2:
+    if key not in regression_table.index or not regression_table.loc[key, 'price_variability']:
         st.write("Not enough price variability to perform regression analysis.")
-        return
 
+        # Offer the elasticity of the most similar items instead: same department (or category) and state, closest
+        # monthly sales and price profile, looked up in the precomputed neighbour index (see pricing/neighbours.py)
+        neighbour_index = level.neighbour_index
+        borrowed = neighbour_index.borrowed_elasticity(item_selected, state_selected) if neighbour_index is not None else None
+        instrumentation.lap('neighbours')
+        if borrowed is None:
+            return
+        elasticity, neighbours = borrowed
+        st.info(f"Borrowed estimate from the {len(neighbours)} most similar items: Price elasticity {elasticity:.2f}")
+        show_neighbours = st.expander("Which items was this borrowed from?")
+        with show_neighbours:
+            st.dataframe(neighbours, hide_index=True)
 
-    # Fit linear regression model
-    x = filtered_data['sell_price']
-    x = sm.add_constant(x)  # Add a constant term for the intercept
-    y = filtered_data['sales']
-    result = sm.OLS(y, x).fit()
-
-    # Get elasticity from the regression model
-    intercept, slope = result.params
-
-    elasticity = slope * (np.mean(x['sell_price']) / np.mean(y))
-    if elasticity < 0:
-        st.success(f"This item is Elastic. Price elasticity: {elasticity:.2f}")
     else:
-        st.warning(f"This item is Inelastic. Price elasticity: {elasticity:.2f}")
+        # Get elasticity from the regression model
+        fit = regression_table.loc[key]
+        intercept, slope = fit['intercept'], fit['slope']
+        instrumentation.lap('regression_elasticity', rows=int(fit['n_obs']))
+
+        elasticity = fit['elasticity']
+        if elasticity < 0:
+            st.success(f"This item is Elastic. Price elasticity: {elasticity:.2f}")
+        else:
+            st.warning(f"This item is Inelastic. Price elasticity: {elasticity:.2f}")
+
+        # How noisy the estimate is: the fit is redone on 1000 resamples of its months at once (see pricing/bootstrap.py)
+        ci_low, ci_high = bootstrap.bootstrap_interval(selection)
+        fit_name = " of the price-only fit" if control_events else ""
+        st.caption(f"{bootstrap.CONFIDENCE:.0%} bootstrap confidence interval{fit_name}: {ci_low:.2f} to {ci_high:.2f} ({bootstrap.RESAMPLES} resamples)")
+        instrumentation.lap('bootstrap', rows=bootstrap.RESAMPLES)
+
+        # How the elasticity has drifted: the regression refitted over a moving window ending at each period, all at once
+        # from running sums (see pricing/rolling.py)
+        show_timeline = st.expander("Elasticity over time")
+        with show_timeline:
+            window = st.selectbox("Select a Rolling Window", options=rolling.WINDOWS, index=rolling.WINDOWS.index(12),
+                                  format_func=lambda length: f"{length} {units}" if length else "Expanding (all history so far)")
+            timeline = rolling.rolling_elasticity(selection, window)
+            st.line_chart(timeline)
+        instrumentation.lap('rolling_elasticity', rows=len(timeline))
 
     show_explanation = st.expander("What does this mean?")
     with show_explanation:
@@ -148,26 +143,19 @@ def main():
 
 
     # Calculate Base demand 
-    # Take the selected month (that we're predicting for)
-    selected_date = "2016-05".split("-")
-    selected_year = selected_date[0]
-    selected_month = selected_date[1]
-
-    # Construct strings for the years prior, at that month
-    required_past_years_dates = []
-    for year in range(2011,int(selected_year) + 1):
-        required_past_years_dates.append(str(year) + "-" + selected_month)
-
-    # Find the sales volumes of the prior years, at that month
-    past_selected_volumes = []
-    for date in required_past_years_dates:
-        sales = data[(data['item_id'] == item_selected) & (data['state_id'] == state_selected) & (data['year_month'] == date)]['sales'].mean()
-        past_selected_volumes.append(sales)
-    
+    # Take the selected period (that we're predicting for): the latest month, or the latest period of the view
+    # at another granularity, so base demand is in the same units as the elasticity's sales
+    selected_period = "2016-05" if granularity_selected == 'month' else selection['year_month'].iloc[-1]
+
     # Let our base demand be the average of the prior years' volumes at that month
-    base_demand = round(statistics.mean(past_selected_volumes),2)
+    # (read from the precomputed seasonal index rather than filtering the data once per year;
+    # a day, week or quarter takes its share of each month it overlaps)
+    base_demand = round(granularity.period_base_demand(seasonal_index, item_selected, state_selected, selected_period,
+                                                       granularity_selected, dataset.calendar), 2)
+    instrumentation.lap('base_demand', rows=1)
 
-    st.write(f"Average Base Demand for this item during the latest month, across the past 5 years: {base_demand}")
+    unit = units[:-1]
+    st.write(f"Average Base Demand for this item during the latest {unit}, across the past 5 years: {base_demand}")
 
 
     # Forecast sales volume based on price elasticity and discount
@@ -175,7 +163,24 @@ def main():
     forecasted_sales_volume = base_demand * (1 + predicted_change)
     st.write(f"Predicted sales volume with a {discount_percentage}% discount: {forecasted_sales_volume:.0f} units")
 
+    # Evaluate every discount from 0% to 100% at once, so the full curve shows without dragging the slider
+    # The shelf price on the latest day (from the daily price matrix), or the latest average price without it
+    latest_price = dataset.latest_price(item_selected, state_selected)
+    if latest_price is None:
+        latest_price = selection['sell_price'].dropna().iloc[-1]
+    curve = forecast.discount_curve(base_demand, elasticity, latest_price)
+    show_curve = st.expander("Forecast across all discounts")
+    with show_curve:
+        st.line_chart(curve.set_index('discount')[['volume', 'revenue']])
+        if curve['revenue'].notna().any():
+            best = curve.loc[curve['revenue'].idxmax()]
+            st.info(f"Revenue-maximising discount: {best['discount']}% ({best['volume']:.0f} units, revenue of {best['revenue']:.2f} at a price of {latest_price:.2f})")
+    instrumentation.lap('forecast', rows=len(curve))
+
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Time every step of this run, then show them in the sidebar if diagnostics are switched on
+    instrumentation.start_trace()
+    main()
+    instrumentation.diagnostics_panel(st.sidebar)
\ No newline at end of file
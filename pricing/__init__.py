@@ -0,0 +1,4 @@
+#------------------------------ pricing ------------------------------#
+
+# Shared data and modelling code used by the Streamlit pages.
+# Nothing in this package calls st.* directly, so it can also be used from scripts.
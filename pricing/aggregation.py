@@ -0,0 +1,191 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing.instrumentation import stage
+
+#--------------------------------------------------------------------------#
+
+
+
+# Key columns of the monthly outputs, in the order the original groupby sorted them
+SALES_KEYS = ['item_id', 'store_id', 'state_id']
+PRICES_KEYS = ['item_id', 'store_id']
+
+# Decimals mean prices are rounded to: cent prices averaged over a handful of weeks or days are exact well within
+# this, while the last-bit noise of the summation order is rounded away (so a constant price stays constant)
+PRICE_DECIMALS = 6
+
+
+
+# Labels every calendar day with its 'YYYY-MM' month, the same way the pages always have
+def calendar_months(calendar):
+    return pd.to_datetime(calendar['date']).dt.to_period('M').astype(str).to_numpy()
+
+
+
+# Gives every day column an index into the sorted list of months it falls in
+# Day columns missing from the calendar get -1 and are ignored, as the left merge + groupby used to do
+def day_month_index(day_columns, calendar):
+    months = calendar_months(calendar)
+    month_labels = np.unique(months)
+    month_of_d = dict(zip(calendar['d'], np.searchsorted(month_labels, months)))
+    day_index = np.array([month_of_d.get(d, -1) for d in day_columns], dtype=np.int64)
+    return day_index, month_labels
+
+
+
+# Sums a (series x day) matrix into a (series x month) matrix using the day -> month index
+# Days are normally already in calendar order, so each month is one contiguous run of columns and a
+# single np.add.reduceat pass does the segment sums without ever building a long table
+def sum_by_month(counts, day_index, n_months):
+
+    keep = day_index >= 0
+    if not keep.all():
+        counts, day_index = counts[:, keep], day_index[keep]
+
+    if np.any(np.diff(day_index) < 0):
+        order = np.argsort(day_index, kind='stable')
+        counts, day_index = counts[:, order], day_index[order]
+
+    monthly = np.zeros((counts.shape[0], n_months), dtype=np.int64 if counts.dtype.kind in 'iub' else np.float64)
+    if day_index.size == 0:
+        return monthly
+
+    starts = np.flatnonzero(np.r_[True, np.diff(day_index) != 0])
+    monthly[:, day_index[starts]] = np.add.reduceat(counts, starts, axis=1, dtype=monthly.dtype)
+    return monthly
+
+
+
+# Factorizes one or more key columns into a single sorted group id per row
+# Returns the group id of each row (-1 where any key is missing) and a frame with one row of keys per group
+def group_keys(frame, columns):
+
+    codes, uniques = [], []
+    for column in columns:
+        column_codes, column_uniques = pd.factorize(frame[column], sort=True)
+        codes.append(column_codes)
+        uniques.append(column_uniques)
+
+    combined = np.zeros(len(frame), dtype=np.int64)
+    missing = np.zeros(len(frame), dtype=bool)
+    for column_codes, column_uniques in zip(codes, uniques):
+        combined = combined * len(column_uniques) + column_codes
+        missing |= column_codes < 0
+
+    group_ids = np.full(len(frame), -1, dtype=np.int64)
+    combined_keys, group_ids[~missing] = np.unique(combined[~missing], return_inverse=True)
+
+    # Decode each group's combined key back into its original column values
+    keys = {}
+    remainder = combined_keys
+    for column, column_uniques in reversed(list(zip(columns, uniques))):
+        keys[column] = column_uniques.take(remainder % len(column_uniques))
+        remainder = remainder // len(column_uniques)
+
+    return group_ids, pd.DataFrame({column: keys[column] for column in columns})
+
+
+
+# Aggregates the (series x day) sales matrix to one row per (item, store, state) with a column per month
+def monthly_sales_matrix(sales, calendar):
+
+    day_columns = [c for c in sales.columns if c.startswith('d_')]
+    day_index, month_labels = day_month_index(day_columns, calendar)
+
+    monthly = sum_by_month(sales[day_columns].to_numpy(), day_index, len(month_labels))
+
+    # Keep only the months which actually have sales days, as the merge + groupby did
+    observed = np.unique(day_index[day_index >= 0])
+    monthly, month_labels = monthly[:, observed], month_labels[observed]
+
+    keys, grouped = group_series(sales, monthly)
+    return keys, grouped, month_labels
+
+
+
+# Sums the rows of a per-series matrix that share the same (item, store, state) keys, exactly like the groupby
+def group_series(series_keys, matrix):
+    group_ids, keys = group_keys(series_keys, SALES_KEYS)
+    valid = group_ids >= 0
+    grouped = np.zeros((len(keys),) + matrix.shape[1:], dtype=matrix.dtype)
+    np.add.at(grouped, group_ids[valid], matrix[valid])
+    return keys, grouped
+
+
+
+# Aggregates weekly price rows to a monthly mean per (item, store)
+# A week straddling two months counts towards both, as the drop_duplicates week -> month mapping did
+def monthly_price_sums(prices, calendar):
+
+    months = calendar_months(calendar)
+    month_labels = np.unique(months)
+    month_codes = np.searchsorted(month_labels, months)
+
+    # Every distinct (week, month) pair, i.e. one row for most weeks and two for straddling weeks
+    week_month = np.unique(np.stack([calendar['wm_yr_wk'].to_numpy(np.int64), month_codes]), axis=1)
+    weeks, week_months = week_month
+
+    group_ids, keys = group_keys(prices, PRICES_KEYS)
+
+    # float32 snapshot prices are restored to whole cents, which is how the M5 CSV stores them
+    sell_price = prices['sell_price'].to_numpy()
+    if sell_price.dtype == np.float32:
+        sell_price = np.round(sell_price.astype(np.float64), 2)
+
+    # Pair each price row with every month its week falls in (weeks are sorted, so use searchsorted ranges)
+    price_weeks = prices['wm_yr_wk'].to_numpy(np.int64)
+    first = np.searchsorted(weeks, price_weeks, side='left')
+    last = np.searchsorted(weeks, price_weeks, side='right')
+    repeats = np.where(group_ids >= 0, last - first, 0)
+    rows = np.repeat(np.arange(len(prices)), repeats)
+    pair = np.repeat(first, repeats) + (np.arange(len(rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats))
+
+    flat = group_ids[rows] * len(month_labels) + week_months[pair]
+    size = len(keys) * len(month_labels)
+    price_sum = np.bincount(flat, weights=sell_price[rows], minlength=size).reshape(len(keys), -1)
+    price_count = np.bincount(flat, minlength=size).reshape(len(keys), -1)
+
+    return keys, price_sum, price_count, month_labels
+
+
+
+# Mean price per cell from price sums and counts, NaN where there was no price
+def mean_prices(price_sum, price_count):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.round(price_sum / price_count, PRICE_DECIMALS)
+
+
+
+# Expands a (group x month) matrix into the long one-row-per-group-per-month layout the pages use
+def to_long(keys, matrix, month_labels, value_name, mask=None):
+    if mask is None:
+        mask = np.ones(matrix.shape, dtype=bool)
+    group_rows, month_columns = np.nonzero(mask)
+    long = keys.iloc[group_rows].reset_index(drop=True)
+    long['year_month'] = month_labels[month_columns]
+    long[value_name] = matrix[group_rows, month_columns]
+    return long
+
+
+
+# Turns the (group x month) sales matrix and price sums into the long monthly_sales / monthly_prices frames
+def monthly_frames(keys, monthly, month_labels, price_keys, price_sum, price_count, price_months):
+
+    monthly_sales = to_long(keys, monthly, month_labels, 'sales')
+
+    monthly_prices = to_long(price_keys, mean_prices(price_sum, price_count), price_months, 'sell_price', mask=price_count > 0)
+
+    return monthly_sales, monthly_prices
+
+
+
+# Aggregates the sales and price data at a MONTHLY level, without melting or merging
+# Returns the same monthly_sales / monthly_prices frames as the original melt + merge + groupby
+def monthly_sales_and_prices(sales, prices, calendar):
+    with stage('aggregate', rows=len(sales) + len(prices)):
+        keys, monthly, month_labels = monthly_sales_matrix(sales, calendar)
+        price_keys, price_sum, price_count, price_months = monthly_price_sums(prices, calendar)
+        return monthly_frames(keys, monthly, month_labels, price_keys, price_sum, price_count, price_months)
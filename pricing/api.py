@@ -0,0 +1,427 @@
+#------------------------------ Dependencies ------------------------------#
+
+import argparse
+import collections
+import json
+import math
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from pricing import bootstrap, forecast, granularity, service, snapshot, warmup
+from pricing.instrumentation import logger, stage
+from pricing.neighbours import NEIGHBOURS
+
+#--------------------------------------------------------------------------#
+
+
+
+# Where the API listens by default (local only; put a proxy in front to expose it)
+HOST = os.environ.get('PRICING_API_HOST', '127.0.0.1')
+PORT = int(os.environ.get('PRICING_API_PORT', 8502))
+
+# Responses kept in the LRU response cache
+CACHE_SIZE = int(os.environ.get('PRICING_API_CACHE_SIZE', 4096))
+
+# Most sub-requests a single /batch call may carry
+MAX_BATCH = 1000
+
+# Largest bootstrap a regression query may ask for
+MAX_RESAMPLES = 10000
+
+# Most neighbours a neighbour query may ask for
+MAX_NEIGHBOURS = 100
+
+
+
+# A query which can't be answered, with the HTTP status it maps to
+class QueryError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+
+# Makes a result JSON-safe: NumPy scalars become Python numbers and NaN / infinity become null
+def _clean(value):
+    if isinstance(value, dict):
+        return {str(k): _clean(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_clean(v) for v in value]
+    if isinstance(value, (np.integer, np.bool_)):
+        return value.item()
+    if isinstance(value, (float, np.floating)):
+        return float(value) if math.isfinite(value) else None
+    if value is pd.NA or value is pd.NaT:
+        return None
+    return value
+
+
+
+def _required(params, name):
+    if not params.get(name):
+        raise QueryError(400, f"Missing required parameter '{name}'")
+    return params[name]
+
+
+
+def _number(params, name, default):
+    try:
+        return float(params.get(name, default))
+    except ValueError:
+        raise QueryError(400, f"Parameter '{name}' must be a number")
+
+
+
+# A count parameter: a whole number of at least `least`, and at most `most` if given
+# (NaN, infinities, fractions and anything out of range answer 400)
+def _count(params, name, default, least=1, most=None):
+    value = _number(params, name, default)
+    if not (math.isfinite(value) and value.is_integer() and least <= value <= (most or value)):
+        expected = f'from {least} to {most}' if most else f'of at least {least}'
+        raise QueryError(400, f"Parameter '{name}' must be a whole number {expected}")
+    return int(value)
+
+
+
+# The monthly Dataset holding the requested series at the requested hierarchy level, and its view at the
+# requested granularity (the same objects the pages read)
+def _datasets(catalogue, params):
+    item_id, state_id = _required(params, 'item_id'), _required(params, 'state_id')
+    try:
+        level = catalogue.at_level(params.get('product_level', 'item'), params.get('location_level', 'store'))
+        dataset = level.for_series(item_id, state_id)
+        granularity_name = params.get('granularity', 'month')
+        if granularity_name not in dataset.granularities:
+            raise QueryError(400, f"Granularity must be one of {list(dataset.granularities)}")
+        view = dataset.at_granularity(item_id, state_id, granularity_name)
+    except (KeyError, ValueError) as error:
+        raise QueryError(404 if isinstance(error, KeyError) else 400, f'Unknown series or level: {error}')
+    if (item_id, state_id) not in view.panel:
+        raise QueryError(404, f'No series for item {item_id!r} in state {state_id!r}')
+    return dataset, view, item_id, state_id, granularity_name
+
+
+
+# GET /series - the series' rows (year_month is the period label at the requested granularity)
+def series(catalogue, params):
+    _, view, item_id, state_id, _ = _datasets(catalogue, params)
+    rows = view.panel.series(item_id, state_id)
+    if 'last' in params:
+        rows = rows.tail(_count(params, 'last', 13))
+    columns = ['item_id', 'store_id', 'state_id', 'year_month', 'sales', 'sell_price']
+    return {'item_id': item_id, 'state_id': state_id, 'rows': rows[columns].astype(object).to_dict('records')}
+
+
+
+# The arc elasticity row of one adjacent pair: start_month (defaults to the latest pair) for store_id
+# (defaults to the store the series ends on, as the [S] page's table does)
+def _arc_pair(view, item_id, state_id, params):
+    rows = view.panel.series(item_id, state_id)
+    store_id = params.get('store_id') or rows['store_id'].iloc[-1]
+    store_rows = rows[rows['store_id'] == store_id]
+    if len(store_rows) < 2:
+        raise QueryError(404, f'Store {store_id!r} has fewer than two periods for this series')
+    start_month = params.get('start_month') or store_rows['year_month'].iloc[-2]
+    try:
+        return view.arc_table.loc[(item_id, store_id, start_month)], store_id, start_month
+    except KeyError:
+        raise QueryError(404, f'No adjacent pair starting {start_month!r} for store {store_id!r}')
+
+
+
+# GET /elasticity/arc
+def arc_elasticity(catalogue, params):
+    _, view, item_id, state_id, _ = _datasets(catalogue, params)
+    pair, store_id, start_month = _arc_pair(view, item_id, state_id, params)
+    return {'item_id': item_id, 'state_id': state_id, 'store_id': store_id, 'start_month': start_month, **pair.to_dict()}
+
+
+
+# GET /elasticity/regression
+#   resamples=N adds a bootstrap confidence interval (ci_low, ci_high) at the given confidence (default 0.95)
+#   controlled=1 fits sales on price plus the event and SNAP day shares of each period (see pricing/events.py)
+def regression_elasticity(catalogue, params):
+    _, view, item_id, state_id, _ = _datasets(catalogue, params)
+    table = view.controlled_regression_table if params.get('controlled') not in (None, '', '0') else view.regression_table
+    if (item_id, state_id) not in table.index:
+        raise QueryError(404, f'No regression for item {item_id!r} in state {state_id!r}')
+    result = {'item_id': item_id, 'state_id': state_id, **table.loc[(item_id, state_id)].to_dict()}
+
+    if params.get('resamples'):
+        resamples = _count(params, 'resamples', bootstrap.RESAMPLES, least=2, most=MAX_RESAMPLES)
+        confidence = _number(params, 'confidence', bootstrap.CONFIDENCE)
+        if not 0 < confidence < 1:
+            raise QueryError(400, "Parameter 'confidence' must be between 0 and 1")
+        result['ci_low'], result['ci_high'] = bootstrap.bootstrap_interval(view.panel.series(item_id, state_id), resamples, confidence)
+        result['resamples'], result['confidence'] = resamples, confidence
+    return result
+
+
+
+# GET /elasticity/neighbours - the k (default NEIGHBOURS) most similar series with a usable regression elasticity, and
+# their similarity-weighted mean as a borrowed estimate
+def neighbour_elasticity(catalogue, params):
+    _, _, item_id, state_id, _ = _datasets(catalogue, params)
+    level = catalogue.at_level(params.get('product_level', 'item'), params.get('location_level', 'store'))
+    index = level.neighbour_index
+    if index is None:
+        raise QueryError(503, 'The neighbour index is still being built')
+    k = _count(params, 'k', NEIGHBOURS, most=MAX_NEIGHBOURS)
+    borrowed = index.borrowed_elasticity(item_id, state_id, k)
+    if borrowed is None:
+        raise QueryError(404, f'No comparable series for item {item_id!r} in state {state_id!r}')
+    elasticity, neighbours = borrowed
+    return {'item_id': item_id, 'state_id': state_id, 'elasticity': elasticity, 'neighbours': neighbours.to_dict('records')}
+
+
+
+# Seasonal base demand for a period label at the requested granularity ('YYYY-MM' at month, as /series labels
+# them otherwise), in the same units as that granularity's sales (see granularity.period_base_demand)
+def _base_demand(dataset, item_id, state_id, period, granularity_name):
+    if granularity_name == 'month':
+        match = re.fullmatch(r'(\d{4})-(\d{2})', period)
+        if match is None or not 1 <= int(match.group(2)) <= 12:
+            raise QueryError(400, f"Parameter 'year_month' must be a month as 'YYYY-MM', got {period!r}")
+    elif period not in granularity.calendar_buckets(dataset.calendar, granularity_name):
+        raise QueryError(400, f"Parameter 'year_month' must be a {granularity_name} in the calendar, got {period!r}")
+    demand = granularity.period_base_demand(dataset.seasonal_index, item_id, state_id, period, granularity_name, dataset.calendar)
+    return round(demand, 2)
+
+
+
+# GET /base_demand - for year_month (the series' latest period by default) at the requested granularity
+def base_demand(catalogue, params):
+    dataset, view, item_id, state_id, granularity_name = _datasets(catalogue, params)
+    year_month = params.get('year_month') or view.panel.series(item_id, state_id)['year_month'].iloc[-1]
+    return {'item_id': item_id, 'state_id': state_id, 'year_month': year_month,
+            'base_demand': _base_demand(dataset, item_id, state_id, year_month, granularity_name)}
+
+
+
+# GET /forecast - volume at a discount, calculated the way each page does
+#   method=regression (default): regression elasticity, the latest shelf price, base demand for year_month (latest period)
+#   method=arc: the arc pair's elasticity and end price, base demand for the pair's end period, absolute volume
+# Base demand is for a period of the requested granularity, so it's in the same units as the elasticity's sales
+def discount_forecast(catalogue, params):
+    dataset, view, item_id, state_id, granularity_name = _datasets(catalogue, params)
+    discount = _number(params, 'discount', 5.0)
+    method = params.get('method', 'regression')
+
+    if method == 'regression':
+        elasticity = regression_elasticity(catalogue, params)['elasticity']
+        price = dataset.latest_price(item_id, state_id)
+        if price is None:
+            price = view.panel.series(item_id, state_id)['sell_price'].dropna().iloc[-1]
+        year_month = params.get('year_month') or view.panel.series(item_id, state_id)['year_month'].iloc[-1]
+        absolute = False
+    elif method == 'arc':
+        pair, _, _ = _arc_pair(view, item_id, state_id, params)
+        elasticity, price = pair['elasticity'], pair['end_price']
+        year_month = params.get('year_month') or pair['end_month']
+        absolute = True
+    else:
+        raise QueryError(400, "Parameter 'method' must be 'regression' or 'arc'")
+
+    demand = _base_demand(dataset, item_id, state_id, year_month, granularity_name)
+    curve = forecast.discount_curve(demand, elasticity, price, absolute=absolute)
+    best = curve.loc[curve['revenue'].idxmax()] if curve['revenue'].notna().any() else None
+    return {
+        'item_id': item_id, 'state_id': state_id, 'method': method, 'year_month': year_month,
+        'base_demand': demand, 'elasticity': elasticity, 'price': price, 'discount': discount,
+        'volume': forecast.forecast_volume(demand, elasticity, discount, absolute=absolute),
+        'optimal_discount': None if best is None else best['discount'],
+        'optimal_volume': None if best is None else best['volume'],
+        'optimal_revenue': None if best is None else best['revenue'],
+    }
+
+
+
+ROUTES = {
+    '/series': series,
+    '/elasticity/arc': arc_elasticity,
+    '/elasticity/regression': regression_elasticity,
+    '/elasticity/neighbours': neighbour_elasticity,
+    '/base_demand': base_demand,
+    '/forecast': discount_forecast,
+}
+
+
+
+# LRU of answered queries keyed by (data generation, source, path, params); after service.reload() the data is a
+# new generation, so reloaded data never hits old entries
+class ResponseCache:
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+
+# The catalogue the queries read; a failure to load it answers 503 rather than 500, as it's the data that's unavailable
+def _catalogue(source, snapshot_dir):
+    try:
+        return service.get_catalogue(source, snapshot_dir)
+    except Exception as error:
+        logger.exception('api could not load the data')
+        raise QueryError(503, f'The data could not be loaded: {type(error).__name__}')
+
+
+
+# Answers one query as (status, JSON-safe body), through the response cache
+# An unexpected error answers 500 (and isn't cached) rather than dropping the connection; a 503 (still building)
+# isn't cached either, so the same query is answered once the data is ready; nor is a failure to load the data
+def answer(path, params, cache, source=None, snapshot_dir=snapshot.SNAPSHOT_DIR):
+    if path not in ROUTES:
+        return 404, {'error': f'Unknown endpoint {path!r}', 'endpoints': sorted(ROUTES) + ['/batch', '/health']}
+
+    # The generation is read before the data is fetched, so an answer is never filed under a newer one than it used
+    key = (service.generation(), source, snapshot_dir, path, tuple(sorted(params.items())))
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        catalogue = _catalogue(source, snapshot_dir)
+        result = 200, _clean(ROUTES[path](catalogue, params))
+    except QueryError as error:
+        result = error.status, {'error': str(error)}
+    except Exception as error:
+        logger.exception('api %s failed', path)
+        return 500, {'error': f'Internal error: {type(error).__name__}'}
+    if result[0] != 503:
+        cache.put(key, result)
+    return result
+
+
+
+# POST /batch with {"requests": [{"path": "/forecast", "params": {...}}, ...]} answers every query in one round trip
+def answer_batch(body, cache, source=None, snapshot_dir=snapshot.SNAPSHOT_DIR):
+    requests = body.get('requests') if isinstance(body, dict) else None
+    if not isinstance(requests, list):
+        return 400, {'error': "Expected a JSON object with a 'requests' list"}
+    if len(requests) > MAX_BATCH:
+        return 400, {'error': f'At most {MAX_BATCH} requests per batch'}
+
+    responses = []
+    for request in requests:
+        if not isinstance(request, dict) or not isinstance(request.get('params', {}), (dict, type(None))):
+            responses.append({'status': 400, 'body': {'error': "Each request must be an object with a 'path' and a 'params' object"}})
+            continue
+        params = {str(k): str(v) for k, v in (request.get('params') or {}).items()}
+        status, result = answer(str(request.get('path', '')), params, cache, source, snapshot_dir)
+        responses.append({'status': status, 'body': result})
+    return 200, {'responses': responses}
+
+
+
+# HTTP front end; every request shares the process-wide dataset and the server's response cache
+class Handler(BaseHTTPRequestHandler):
+
+    server_version = 'PricingAPI/1.0'
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        with stage('api.get', path=url.path) as record:
+            if url.path == '/health':
+                try:
+                    catalogue = _catalogue(self.server.source, self.server.snapshot_dir)
+                    status, body = 200, {'status': 'ok', 'ready': getattr(catalogue, 'ready', True),
+                                         'cache_hits': self.server.cache.hits, 'cache_misses': self.server.cache.misses}
+                except QueryError as error:
+                    status, body = error.status, {'status': 'unavailable', 'error': str(error)}
+            else:
+                status, body = answer(url.path, dict(parse_qsl(url.query)), self.server.cache,
+                                      self.server.source, self.server.snapshot_dir)
+            record['status'] = status
+        self._send(status, body)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/batch':
+            self._send(404, {'error': 'Only /batch accepts POST'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self._send(400, {'error': 'Request body is not valid JSON'})
+            return
+        with stage('api.batch', rows=len(body.get('requests', [])) if isinstance(body, dict) else None) as record:
+            status, result = answer_batch(body, self.server.cache, self.server.source, self.server.snapshot_dir)
+            record['status'] = status
+        self._send(status, result)
+
+    # Access lines go to the pricing logger rather than straight to stderr
+    def log_message(self, format, *args):
+        logger.debug('api %s', format % args)
+
+
+
+# Builds (without starting) a threaded server over the given data
+def make_server(host=HOST, port=PORT, source=None, snapshot_dir=snapshot.SNAPSHOT_DIR, cache_size=CACHE_SIZE):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.source = source
+    server.snapshot_dir = snapshot_dir
+    server.cache = ResponseCache(cache_size)
+    return server
+
+
+
+# python -m pricing.api --port 8502, then e.g. GET /forecast?item_id=FOODS_3_090&state_id=CA&discount=10
+def main():
+    parser = argparse.ArgumentParser(description='Serve elasticity and forecast queries as JSON over HTTP.')
+    parser.add_argument('--host', default=HOST, help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='Port to listen on')
+    parser.add_argument('--source', default=None, help='Directory or URL prefix holding the M5 CSV files')
+    parser.add_argument('--snapshot', default=snapshot.SNAPSHOT_DIR, help='Snapshot directory to read, if it exists')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='Responses kept in the LRU cache')
+    args = parser.parse_args()
+
+    # Load (or rebuild) the snapshot and derived tables before accepting connections, so the first queries don't wait on them
+    warmup.start_warmup(args.source, args.snapshot).wait()
+
+    server = make_server(args.host, args.port, args.source, args.snapshot, args.cache_size)
+    print(f'Serving on http://{args.host}:{args.port} ({", ".join(sorted(ROUTES))}, /batch, /health)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#------------------------------ Dependencies ------------------------------#
+
+import argparse
+import fnmatch
+import os
+
+import numpy as np
+import pandas as pd
+
+from pricing import forecast, parallel, service, snapshot
+from pricing.panel import PANEL_KEYS
+from pricing.seasonal import SeasonalIndex
+
+#--------------------------------------------------------------------------#
+
+
+
+# Discount the report forecasts volume at, the pages' slider default
+DISCOUNT_PERCENTAGE = 5.0
+
+# Columns kept from the regression and latest arc elasticity tables, renamed for the report
+REGRESSION_COLUMNS = {
+    'n_obs': 'regression_n_obs',
+    'r_squared': 'regression_r_squared',
+    'elasticity': 'regression_elasticity',
+    'elasticity_se': 'regression_elasticity_se',
+}
+ARC_COLUMNS = {
+    'store_id': 'arc_store_id',
+    'start_month': 'arc_start_month',
+    'end_month': 'arc_end_month',
+    'start_price': 'arc_start_price',
+    'end_price': 'arc_end_price',
+    'elasticity_status': 'arc_elasticity_status',
+    'inelastic_reason': 'arc_inelastic_reason',
+    'elasticity': 'arc_elasticity',
+}
+
+
+
+# Loads the Dataset the pages would use, aggregating the raw CSVs across `workers` processes if there's no snapshot
+def load_dataset(source, snapshot_dir, workers=None):
+    if snapshot.snapshot_exists(snapshot_dir):
+        return service.get_dataset(source, snapshot_dir)
+    sales, prices, calendar = snapshot.read_csvs(source)
+    return service.Dataset(sales, prices, calendar, parallel.monthly_sales_and_prices(sales, prices, calendar, workers))
+
+
+
+# Rows of the merged panel whose item matches any of the glob `items` patterns and whose state is in `states`
+def select_series(data, items=None, states=None):
+    keep = np.ones(len(data), dtype=bool)
+    if items:
+        names = pd.unique(data['item_id'].dropna())
+        matched = [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in items)]
+        keep &= data['item_id'].isin(matched).to_numpy()
+    if states:
+        keep &= data['state_id'].isin(states).to_numpy()
+    return data[keep]
+
+
+
+# Revenue-maximising discount for one elasticity column, as <prefix>optimal_discount/_volume/_revenue
+def _optimal_discounts(report, elasticity, prefix, absolute=False):
+    found = forecast.catalogue_discounts(report, absolute=absolute, elasticity=elasticity, price='latest_price')
+    found = found[['optimal_discount', 'forecast_volume', 'forecast_revenue']]
+    return found.set_axis([f'{prefix}optimal_discount', f'{prefix}optimal_volume', f'{prefix}optimal_revenue'], axis=1)
+
+
+
+# One row per (item, state) with everything the pages show for it:
+# regression elasticity (LRM page), the latest month pair's arc elasticity (S page), seasonal base demand,
+# historic optimal prices, the forecast at `discount_percentage` and the revenue-maximising discount
+def catalogue_report(panel, items=None, states=None, year_month=None, discount_percentage=DISCOUNT_PERCENTAGE, workers=None):
+
+    data = select_series(panel.data, items, states)
+    year_month = year_month or data['year_month'].max()
+    year, month = year_month.split('-')
+
+    report = data[PANEL_KEYS].drop_duplicates(ignore_index=True)
+
+    # Regression elasticity over each (item, state)'s full history
+    regression = parallel.regression_table(data, workers)
+    regression = regression[list(REGRESSION_COLUMNS)].rename(columns=REGRESSION_COLUMNS).reset_index()
+    report = report.merge(regression, on=PANEL_KEYS, how='left')
+
+    # Arc elasticity of the latest month pair, for the last store of each state as the S page's table ends on
+    arc = parallel.arc_table(data, workers)
+    arc = arc.groupby(PANEL_KEYS, observed=True, sort=False).tail(1)
+    arc = arc[PANEL_KEYS + list(ARC_COLUMNS)].rename(columns=ARC_COLUMNS)
+    report = report.merge(arc, on=PANEL_KEYS, how='left')
+
+    # Base demand for the reported month and the most recent price of each series
+    base_demand = SeasonalIndex(data).base_demand_table(year, month).round(2).reset_index()
+    report = report.merge(base_demand, on=PANEL_KEYS, how='left')
+    latest_price = data.groupby(PANEL_KEYS, observed=True)['sell_price'].last().rename('latest_price').reset_index()
+    report = report.merge(latest_price, on=PANEL_KEYS, how='left')
+
+    # Historic optimal price over the last 13 months and over the full history
+    for window, suffix in [(13, '13m'), (None, 'all')]:
+        optimal = panel.optimal_prices[window].add_suffix(f'_{suffix}').reset_index()
+        report = report.merge(optimal, on=PANEL_KEYS, how='left')
+
+    # Forecasts at the chosen discount, each the way its page calculates it (the S page takes the absolute value)
+    report['year_month'] = year_month
+    report['discount_percentage'] = discount_percentage
+    report['regression_forecast_volume'] = forecast.forecast_volume(
+        report['base_demand'], report['regression_elasticity'], discount_percentage)
+    report['arc_forecast_volume'] = forecast.forecast_volume(
+        report['base_demand'], report['arc_elasticity'], discount_percentage, absolute=True)
+
+    return pd.concat([
+        report,
+        _optimal_discounts(report, 'regression_elasticity', 'regression_'),
+        _optimal_discounts(report, 'arc_elasticity', 'arc_', absolute=True),
+    ], axis=1)
+
+
+
+# Writes the report in the format the file extension asks for (parquet and feather need pyarrow, listed in requirements.txt)
+def write_report(report, path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        report.to_csv(path, index=False)
+    elif extension == '.feather':
+        report.to_feather(path)
+    else:
+        report.to_parquet(path, index=False)
+
+
+
+# Nightly precompute: python -m pricing.batch --out elasticity_report.parquet [--items 'FOODS_*'] [--states CA TX]
+def main():
+    parser = argparse.ArgumentParser(description='Compute elasticities and discount forecasts for the whole catalogue without the app.')
+    parser.add_argument('--source', default=service.DATA_SOURCE, help='Directory or URL prefix holding the M5 CSV files')
+    parser.add_argument('--snapshot', default=snapshot.SNAPSHOT_DIR, help='Snapshot directory to read instead of the CSVs, if it exists')
+    parser.add_argument('--items', nargs='*', help="Item ids or glob patterns to include (e.g. 'FOODS_3_*'); all items by default")
+    parser.add_argument('--states', nargs='*', help='State ids to include; all states by default')
+    parser.add_argument('--level', default='item:store', help="Hierarchy level as PRODUCT:LOCATION, e.g. 'dept:state' or 'cat:all' (item/dept/cat x store/state/all)")
+    parser.add_argument('--month', help="Month to forecast base demand for, as 'YYYY-MM'; the latest month by default")
+    parser.add_argument('--discount', type=float, default=DISCOUNT_PERCENTAGE, help='Discount percentage to forecast volume at')
+    parser.add_argument('--workers', type=int, default=parallel.WORKERS, help='Worker processes to spread the work over')
+    parser.add_argument('--out', default='elasticity_report.parquet', help='Output file (.parquet, .feather or .csv)')
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.source, args.snapshot, args.workers)
+    product_level, location_level = args.level.split(':')
+    panel = dataset.at_level(product_level, location_level).panel
+    report = catalogue_report(panel, args.items, args.states, args.month, args.discount, args.workers)
+    write_report(report, args.out)
+    print(f'Wrote {len(report)} series to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing.aggregation import group_keys
+from pricing.elasticity import price_varies
+
+#--------------------------------------------------------------------------#
+
+
+
+# Resamples drawn per series, and the confidence level of the reported interval
+RESAMPLES = 1000
+CONFIDENCE = 0.95
+
+# Upper bound on (series x resamples x observations) elements drawn at once, which bounds the temporary
+# arrays of a catalogue-wide run to a few tens of MB each
+BATCH_ELEMENTS = 2**22
+
+
+
+# Regression elasticity of every bootstrap resample of every series, as a (series x resamples) array
+# g, x, y are the observations (group id, price, sales) sorted by group; n_groups the number of groups
+# A resample is the series' rows weighted by how often each was drawn, so a batch of series is resampled as one
+# (series x resamples x rows) array of draw counts, and the sums behind the closed-form OLS slope of sales ~ price
+# come out of a single batched matrix product, instead of one statsmodels fit per resample
+# A resample that drew a single distinct price has no slope and comes back NaN
+def _resampled_elasticities(g, x, y, n_groups, resamples, rng):
+
+    n = np.bincount(g, minlength=n_groups)
+    starts = np.r_[0, np.cumsum(n)[:-1]].astype(np.int64)
+    estimates = np.full((n_groups, resamples), np.nan)
+
+    # Terms (x, y, x^2, xy) of every observation, centred on its series' means so the raw sums below stay well
+    # conditioned; the extra zero row at the end is what padding (past a shorter series' length) reads
+    with np.errstate(invalid='ignore'):
+        shift_x = np.bincount(g, weights=x, minlength=n_groups) / n
+        shift_y = np.bincount(g, weights=y, minlength=n_groups) / n
+    cx, cy = x - shift_x[g], y - shift_y[g]
+    terms = np.vstack([np.column_stack([cx, cy, cx * cx, cx * cy]), np.zeros((1, 4))])
+    padding = len(g)
+
+    # Series of similar length are batched together (shortest first), so little of a batch is padding; each
+    # batch takes as many series as fit in BATCH_ELEMENTS at the length of its longest one
+    by_length = np.argsort(n, kind='stable')
+    sorted_n = n[by_length]
+    lo = 0
+    while lo < n_groups:
+        cost = np.arange(1, n_groups - lo + 1) * (sorted_n[lo:] + 1) * resamples
+        groups = by_length[lo:lo + max(1, int(np.searchsorted(cost, BATCH_ELEMENTS, side='right')))]
+        counts = n[groups]
+        n_max = max(int(counts.max()), 1)
+        size = len(groups)
+        lo += size
+
+        # Each series' own rows, then the rows drawn uniformly (with replacement) from them, tallied per resample
+        columns = np.arange(n_max)
+        rows = np.where(columns < counts[:, None], starts[groups, None] + columns, padding)
+        draws = (rng.random((size, resamples, n_max), dtype=np.float32) * counts[:, None, None]).astype(np.int64)
+        draws = np.where(columns < counts[:, None, None], draws, n_max)
+        slots = draws + (np.arange(size * resamples, dtype=np.int64) * (n_max + 1)).reshape(size, resamples, 1)
+        weights = np.bincount(slots.ravel(), minlength=size * resamples * (n_max + 1)).reshape(size, resamples, n_max + 1)
+
+        batch_terms = terms[np.column_stack([rows, np.full(size, padding)])]
+        sum_x, sum_y, sum_xx, sum_xy = np.moveaxis(weights.astype(np.float64) @ batch_terms, -1, 0)
+
+        total = counts[:, None].astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sxx = sum_xx - sum_x * sum_x / total
+            sxy = sum_xy - sum_x * sum_y / total
+            shift = shift_x[groups, None]
+            slope = np.where(price_varies(sxx, sum_xx + shift * (2 * sum_x + total * shift)), sxy / sxx, np.nan)
+            mean_x = shift + sum_x / total
+            mean_y = shift_y[groups, None] + sum_y / total
+            estimates[groups] = slope * (mean_x / mean_y)
+
+    return estimates
+
+
+
+# Percentile interval, standard error and number of usable resamples of each row of estimates
+def _summarise(estimates, confidence):
+    tail = (1.0 - confidence) / 2.0 * 100.0
+    valid = np.isfinite(estimates)
+    usable = valid.sum(axis=1)
+    low = np.full(len(estimates), np.nan)
+    high = np.full(len(estimates), np.nan)
+    se = np.full(len(estimates), np.nan)
+    if usable.any():
+        rows = usable > 0
+        low[rows], high[rows] = np.nanpercentile(estimates[rows], [tail, 100.0 - tail], axis=1)
+        se[rows] = np.nanstd(estimates[rows], axis=1, ddof=1) if estimates.shape[1] > 1 else np.nan
+    return low, high, se, usable
+
+
+
+# Bootstrap confidence interval of the regression elasticity of EVERY (item, state) series, in batches
+# Uses the same observations as regression_elasticity_table (months with zero sales or zero price dropped) and
+# resamples only series with at least two distinct prices; the others get NaN
+# A fixed seed keeps the intervals the same from one page rerun to the next
+def bootstrap_elasticity_table(data, keys=('item_id', 'state_id'), resamples=RESAMPLES, confidence=CONFIDENCE, seed=0):
+
+    group_ids, table = group_keys(data, list(keys))
+    n_groups = len(table)
+
+    sales = data['sales'].to_numpy(np.float64)
+    price = data['sell_price'].to_numpy(np.float64)
+    keep = (sales > 0) & (price > 0) & (group_ids >= 0)
+    g, x, y = group_ids[keep], price[keep], sales[keep]
+
+    order = np.argsort(g, kind='stable')
+    g, x, y = g[order], x[order], y[order]
+
+    # Series without two distinct prices have no regression to resample
+    highest = np.full(n_groups, -np.inf)
+    lowest = np.full(n_groups, np.inf)
+    np.maximum.at(highest, g, x)
+    np.minimum.at(lowest, g, x)
+    variable = highest > lowest
+    fitted = variable[g]
+
+    estimates = np.full((n_groups, resamples), np.nan)
+    rng = np.random.default_rng(seed)
+    codes = np.cumsum(variable) - 1
+    estimates[variable] = _resampled_elasticities(codes[g[fitted]], x[fitted], y[fitted], int(variable.sum()), resamples, rng)
+
+    low, high, se, usable = _summarise(estimates, confidence)
+    table['ci_low'] = low
+    table['ci_high'] = high
+    table['bootstrap_se'] = se
+    table['resamples'] = usable
+
+    return table.set_index(list(keys))
+
+
+
+# Bootstrap interval of one series' regression elasticity, from its panel rows (sales and sell_price columns)
+# Returns (low, high) or (nan, nan) when the series can't be fitted
+def bootstrap_interval(series, resamples=RESAMPLES, confidence=CONFIDENCE, seed=0):
+    rows = pd.DataFrame({'key': 0, 'sales': series['sales'].to_numpy(), 'sell_price': series['sell_price'].to_numpy()})
+    table = bootstrap_elasticity_table(rows, keys=('key',), resamples=resamples, confidence=confidence, seed=seed)
+    if table.empty:
+        return np.nan, np.nan
+    return table['ci_low'].iloc[0], table['ci_high'].iloc[0]
@@ -0,0 +1,103 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing.aggregation import group_keys
+
+#--------------------------------------------------------------------------#
+
+
+
+# Levels of the M5 hierarchy: item -> department -> category, and store -> state -> all stores
+PRODUCT_LEVELS = ('item', 'dept', 'cat')
+LOCATION_LEVELS = ('store', 'state', 'all')
+
+# Id used for the single location of the 'all' level
+ALL_LOCATIONS = 'all'
+
+
+
+# Maps item ids onto their department or category: 'FOODS_3_090' -> 'FOODS_3' -> 'FOODS'
+def product_ids(item_ids, level):
+    if level == 'item':
+        return item_ids
+    if level == 'dept':
+        return np.array([item.rsplit('_', 1)[0] for item in item_ids], dtype=object)
+    if level == 'cat':
+        return np.array([item.split('_')[0] for item in item_ids], dtype=object)
+    raise ValueError(f'Unknown product level {level!r}; expected one of {PRODUCT_LEVELS}')
+
+
+
+# Monthly sales and prices rolled up to any (product level, location level) of the hierarchy
+# frames(product, location) returns monthly_sales / monthly_prices frames in the usual layout, so a Dataset, its
+# panel and the elasticity tables work on them as they do on the base data:
+#   item_id  - the item, department or category id
+#   store_id - the store ('store' level), or the state / 'all' when stores are summed together
+#   state_id - the state, or 'all'
+# Sales are summed; the price is the sales-weighted mean price (revenue / units) of the members on sale,
+# or their plain mean price in months nothing sold
+# Each level is built once, with grouped sums over the monthly panel, and then served by direct lookup
+class RollupCube:
+
+    def __init__(self, data):
+        self.data = data
+        self._levels = {}
+
+    def frames(self, product_level='item', location_level='store'):
+        key = (product_level, location_level)
+        if key not in self._levels:
+            self._levels[key] = self._build(product_level, location_level)
+        return self._levels[key]
+
+    def _build(self, product_level, location_level):
+
+        if location_level not in LOCATION_LEVELS:
+            raise ValueError(f'Unknown location level {location_level!r}; expected one of {LOCATION_LEVELS}')
+        data = self.data
+
+        # Relabel every row with the ids of the level it rolls up to (mapping the few distinct items, not every row)
+        item_codes, items = pd.factorize(data['item_id'])
+        product = np.asarray(product_ids(np.asarray(items, dtype=object), product_level), dtype=object)[item_codes]
+        state = data['state_id'].to_numpy(dtype=object)
+        if location_level == 'store':
+            store = data['store_id'].to_numpy(dtype=object)
+        elif location_level == 'state':
+            store = state
+        else:
+            store = state = np.full(len(data), ALL_LOCATIONS, dtype=object)
+
+        labelled = pd.DataFrame({'item_id': product, 'store_id': store, 'state_id': state, 'year_month': data['year_month'].to_numpy()})
+        group_ids, keys = group_keys(labelled, ['item_id', 'store_id', 'state_id', 'year_month'])
+        valid = group_ids >= 0
+        g = group_ids[valid]
+
+        sales = data['sales'].to_numpy(np.float64)[valid]
+        price = data['sell_price'].to_numpy(np.float64)[valid]
+        priced = ~np.isnan(price)
+        # Exact revenue where the panel has it (day-weighted prices), otherwise sales at the month's price
+        row_revenue = data['revenue'].to_numpy(np.float64)[valid] if 'revenue' in data else sales * price
+        size = len(keys)
+
+        def total(weights):
+            return np.bincount(g, weights=weights, minlength=size)
+
+        sales_sum = total(sales)
+        revenue = total(np.where(priced, row_revenue, 0.0))
+        priced_sales = total(np.where(priced, sales, 0.0))
+        price_sum = total(np.where(priced, price, 0.0))
+        price_count = total(priced.astype(np.float64))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sell_price = np.where(priced_sales > 0, revenue / priced_sales, price_sum / price_count)
+
+        monthly_sales = keys.copy()
+        monthly_sales['sales'] = sales_sum.astype(data['sales'].dtype) if data['sales'].dtype.kind in 'iu' else sales_sum
+
+        monthly_prices = keys.loc[price_count > 0, ['item_id', 'store_id', 'year_month']].reset_index(drop=True)
+        monthly_prices['sell_price'] = sell_price[price_count > 0]
+        if 'revenue' in data:
+            monthly_prices['revenue'] = revenue[price_count > 0]
+
+        return monthly_sales, monthly_prices
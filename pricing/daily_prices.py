@@ -0,0 +1,131 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing import aggregation
+from pricing.aggregation import PRICES_KEYS, group_keys, group_series, mean_prices, sum_by_month, to_long
+
+#--------------------------------------------------------------------------#
+
+
+
+# Series converted per block when reducing the price matrix, so the float64 temporaries stay a few MB
+BLOCK_ROWS = 4096
+
+
+
+# Price of every series on every day: a dense (series x day) float32 matrix with the rows and day columns of the
+# sales matrix, so counts * prices is each day's revenue
+# Each day takes its week's sell_prices row; weeks without a row are forward-filled from the last priced week, and
+# days before a series' first price stay NaN (not on sale yet)
+def daily_price_matrix(sales, prices, calendar):
+
+    day_columns = [c for c in sales.columns if c.startswith('d_')]
+
+    # Week of every day column (the extra last week, all NaN, for days the calendar doesn't have)
+    weeks = np.unique(calendar['wm_yr_wk'].to_numpy(np.int64))
+    week_of_d = dict(zip(calendar['d'], np.searchsorted(weeks, calendar['wm_yr_wk'].to_numpy(np.int64))))
+    day_week = np.array([week_of_d.get(d, len(weeks)) for d in day_columns], dtype=np.int64)
+
+    # (item, store) x week prices (the extra last row, all NaN, for series that never had a price)
+    price_ids, price_keys = group_keys(prices, PRICES_KEYS)
+    price_weeks = prices['wm_yr_wk'].to_numpy(np.int64)
+    week_pos = np.searchsorted(weeks, price_weeks).clip(max=max(len(weeks) - 1, 0))
+    valid = (price_ids >= 0) & (weeks[week_pos] == price_weeks) if len(weeks) else np.zeros(len(prices), dtype=bool)
+    weekly = np.full((len(price_keys) + 1, len(weeks) + 1), np.nan, dtype=np.float32)
+    weekly[price_ids[valid], week_pos[valid]] = prices['sell_price'].to_numpy(np.float32)[valid]
+
+    # Price row of every series
+    price_index = pd.MultiIndex.from_arrays([price_keys[column].astype(str) for column in PRICES_KEYS])
+    series_row = price_index.get_indexer(pd.MultiIndex.from_arrays([sales[column].astype(str) for column in PRICES_KEYS]))
+    series_row[series_row < 0] = len(price_keys)
+
+    matrix = weekly[series_row][:, day_week]
+
+    # Forward fill along the days: each day reads the latest priced day at or before it
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        block = matrix[start:start + BLOCK_ROWS]
+        latest = np.where(np.isnan(block), 0, np.arange(block.shape[1]))
+        np.maximum.accumulate(latest, axis=1, out=latest)
+        block[:] = np.take_along_axis(block, latest, axis=1)
+
+    return matrix
+
+
+
+# Revenue, price sum and priced-day count of every series per bucket, from the (series x day) counts and prices
+# Prices are restored to whole cents, which is how the M5 CSV stores them
+def bucket_sums(counts, prices, day_index, n_buckets):
+
+    revenue = np.zeros((len(counts), n_buckets))
+    price_sum = np.zeros((len(counts), n_buckets))
+    price_days = np.zeros((len(counts), n_buckets), dtype=np.int64)
+
+    for start in range(0, len(counts), BLOCK_ROWS):
+        block = slice(start, start + BLOCK_ROWS)
+        price = np.round(np.asarray(prices[block], dtype=np.float64), 2)
+        priced = ~np.isnan(price)
+        price = np.where(priced, price, 0.0)
+        revenue[block] = sum_by_month(np.asarray(counts[block]) * price, day_index, n_buckets)
+        price_sum[block] = sum_by_month(price, day_index, n_buckets)
+        price_days[block] = sum_by_month(priced, day_index, n_buckets)
+
+    return revenue, price_sum, price_days
+
+
+
+# Long price frame (item_id, store_id, year_month, sell_price, revenue) in the layout of monthly_prices, for the
+# buckets each series had a price in
+#   sell_price - mean price over the bucket's priced days, so a week straddling two months counts towards each
+#                by the days it has in it (rounded like the weekly means, so a constant price stays constant)
+#   revenue    - each day's sales times that day's price, summed
+def day_price_frame(keys, revenue, price_sum, price_days, labels):
+    frame = to_long(keys[PRICES_KEYS], mean_prices(price_sum, price_days), labels, 'sell_price', mask=price_days > 0)
+    frame['revenue'] = revenue[price_days > 0]
+    return frame
+
+
+
+# Day-weighted monthly prices and exact monthly revenue per (item, store), over the months that have sales days
+# Used in place of monthly_prices when the daily data is at hand (see Dataset.panel)
+def monthly_day_prices(sales, prices, calendar):
+
+    day_columns = [c for c in sales.columns if c.startswith('d_')]
+    day_index, month_labels = aggregation.day_month_index(day_columns, calendar)
+    observed = np.unique(day_index[day_index >= 0])
+
+    revenue, price_sum, price_days = bucket_sums(sales[day_columns].to_numpy(), prices, day_index, len(month_labels))
+    keys, grouped = group_series(sales, np.stack([revenue, price_sum, price_days], axis=-1)[:, observed])
+    return day_price_frame(keys, grouped[..., 0], grouped[..., 1], grouped[..., 2], month_labels[observed])
+
+
+
+# The (series x day) price matrix of a Dataset with the row positions of every (item, state) indexed up front
+class DailyPrices:
+
+    def __init__(self, keys, matrix):
+        self.matrix = matrix
+
+        group_ids, groups = group_keys(keys, ['item_id', 'state_id'])
+        order = np.argsort(group_ids, kind='stable')
+        bounds = np.searchsorted(group_ids[order], np.arange(len(groups) + 1))
+        self._rows = {
+            key: order[bounds[g]:bounds[g + 1]]
+            for g, key in enumerate(zip(groups['item_id'], groups['state_id']))
+        }
+
+    # Day prices of the stores of one item in one state, one row per store
+    def series(self, item_id, state_id):
+        return np.asarray(self.matrix[self._rows.get((item_id, state_id), np.zeros(0, dtype=np.int64))])
+
+    # The shelf price on the latest day, averaged over the state's stores (each store's latest priced day);
+    # None if the item never had a price there
+    def latest_price(self, item_id, state_id):
+        prices = self.series(item_id, state_id)
+        priced = ~np.isnan(prices)
+        has_price = priced.any(axis=1)
+        if not has_price.any():
+            return None
+        last = prices.shape[1] - 1 - np.argmax(priced[:, ::-1], axis=1)
+        return float(np.round(prices[np.flatnonzero(has_price), last[has_price]].astype(np.float64), 2).mean())
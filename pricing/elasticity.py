@@ -0,0 +1,233 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+
+from pricing.aggregation import group_keys
+
+#--------------------------------------------------------------------------#
+
+
+
+# Why a month pair was ruled Inelastic before any elasticity was calculated, in the [S] page's order of checks
+INELASTIC_REASONS = ['zero_sales_same_price', 'numerator_zero', 'numerator_and_denominator_same', 'denominator_zero']
+
+# Relative size of a series' price spread (sxx against its raw sum of squared prices) below which the prices are
+# taken as the same price up to rounding, so no slope is fitted
+PRICE_VARIABILITY_TOLERANCE = 1e-12
+
+
+
+# Arc (two-month) price elasticity for EVERY adjacent month pair of every (item, store) series at once
+# Reproduces the [S] page's if/elif chain with array operations, so each pair gets the same
+# Inelastic reason, special_case / premium_case flags, elasticity value and final Elastic/Inelastic status
+def arc_elasticity_table(data):
+
+    # Pair every row with the next row of the same series (rows are already in month order)
+    series_ids, _ = group_keys(data, ['item_id', 'store_id', 'state_id'])
+    start = np.flatnonzero((series_ids[:-1] == series_ids[1:]) & (series_ids[:-1] >= 0))
+    end = start + 1
+
+    sales = data['sales'].to_numpy(np.float64)
+    price = data['sell_price'].to_numpy(np.float64)
+    start_sales, end_sales = sales[start], sales[end]
+    start_price, end_price = price[start], price[end]
+    start_rounded, end_rounded = np.round(start_price, 2), np.round(end_price, 2)
+
+    # ------------------------------------ Pre-Validate Potential to be Inelastic ------------------------------------ #
+
+    # Same conditions, in the same order, as the page's if/elif chain (the first match wins)
+    conditions = [
+        # if sales volume is zero, and sell price stayed the same
+        (start_sales == 0) & (end_sales == 0) & (end_rounded - start_rounded == 0),
+        # if sales volume stayed the same, but sell price changed
+        (end_sales - start_sales == 0) & (end_rounded - start_rounded != 0),
+        # if sales volume stayed the same, and sales price stayed the same
+        (end_sales - start_sales == 0) & (end_rounded == start_rounded),
+        # if sales volume changed, and sales price stayed the same
+        (end_sales - start_sales != 0) & (end_rounded == start_rounded),
+        # zero sales in the first month -> elastic, but can't be calculated
+        start_sales == 0,
+        # sales and price both went up -> elastic "premium" case
+        (end_sales > start_sales) & (end_rounded > start_rounded),
+    ]
+    outcome = np.select(conditions, np.arange(len(conditions)), default=len(conditions))
+
+    inelastic = outcome < len(INELASTIC_REASONS)
+    special_case = (outcome == 4) | (outcome == 5)
+    premium_case = outcome == 5
+
+    # ------------------------------------ Calculate Price elasticity ------------------------------------ #
+
+    # Only calculated when the pair is elastic and either not special, or special because it's a premium case
+    calculated = ~inelastic & (~special_case | premium_case)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_change_sales = (end_sales - start_sales) / start_sales
+        pct_change_price = (end_price - start_price) / start_price
+        elasticity = np.where(calculated, pct_change_sales / pct_change_price, np.nan)
+
+    # Final status after the page's fallback checks: a calculated, non-premium elasticity above -1 is Inelastic
+    status = np.where(inelastic | (calculated & ~premium_case & (elasticity > -1)), 'Inelastic', 'Elastic')
+
+    reason = np.full(len(start), None, dtype=object)
+    reason[inelastic] = np.array(INELASTIC_REASONS, dtype=object)[outcome[inelastic]]
+
+    first = data.iloc[start].reset_index(drop=True)
+    second = data.iloc[end].reset_index(drop=True)
+
+    table = first[['item_id', 'store_id', 'state_id']].copy()
+    table['start_month'] = first['year_month']
+    table['end_month'] = second['year_month']
+    table['start_sales'] = first['sales']
+    table['end_sales'] = second['sales']
+    table['start_price'] = start_price
+    table['end_price'] = end_price
+    table['elasticity_status'] = status
+    table['inelastic_reason'] = reason
+    table['special_case'] = special_case
+    table['premium_case'] = premium_case
+    table['elasticity'] = elasticity
+    # Whether the page goes on to offer a discount forecast for this pair
+    table['forecastable'] = (status == 'Elastic') & (~special_case | premium_case)
+
+    return table
+
+
+
+# The price variability guard every regression estimator applies: centred sum of squares sxx against the raw sum
+# of squared prices sum_x2 over the same observations, so prices a few ulps apart don't pass as a price change
+def price_varies(sxx, sum_x2):
+    return sxx > PRICE_VARIABILITY_TOLERANCE * sum_x2
+
+
+
+# Indexes the arc table by (item_id, store_id, start_month) so the page can read a pair with .loc
+def index_arc_table(table):
+    return table.set_index(['item_id', 'store_id', 'start_month']).sort_index()
+
+
+
+# Least-squares fit of sales = intercept + slope * sell_price for EVERY (item, state) series in one pass
+# Uses the [LRM] page's rules: months with zero sales or zero price are dropped, and a series needs at least
+# two distinct prices (see price_varies). Closed-form grouped sums give the same slope / intercept / standard errors as sm.OLS
+def regression_elasticity_table(data, keys=('item_id', 'state_id')):
+
+    group_ids, table = group_keys(data, list(keys))
+    n_groups = len(table)
+
+    sales = data['sales'].to_numpy(np.float64)
+    price = data['sell_price'].to_numpy(np.float64)
+
+    # Remove rows with zero sales or zero prices (missing prices are dropped too)
+    keep = (sales > 0) & (price > 0) & (group_ids >= 0)
+    g, x, y = group_ids[keep], price[keep], sales[keep]
+
+    # Distinct prices per series, for the price variability guard
+    order = np.lexsort((x, g))
+    sorted_g, sorted_x = g[order], x[order]
+    distinct = np.r_[True, (sorted_g[1:] != sorted_g[:-1]) | (sorted_x[1:] != sorted_x[:-1])] if len(order) else np.zeros(0, dtype=bool)
+    n_prices = np.bincount(sorted_g[distinct], minlength=n_groups)
+
+    # Two passes (means, then centred sums) to keep the sums well conditioned
+    n = np.bincount(g, minlength=n_groups).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_price = np.bincount(g, weights=x, minlength=n_groups) / n
+        mean_sales = np.bincount(g, weights=y, minlength=n_groups) / n
+        dx, dy = x - mean_price[g], y - mean_sales[g]
+        sxx = np.bincount(g, weights=dx * dx, minlength=n_groups)
+        sxy = np.bincount(g, weights=dx * dy, minlength=n_groups)
+        syy = np.bincount(g, weights=dy * dy, minlength=n_groups)
+
+        price_variability = (n_prices >= 2) & price_varies(sxx, np.bincount(g, weights=x * x, minlength=n_groups))
+        slope = np.where(price_variability, sxy / sxx, np.nan)
+        intercept = mean_sales - slope * mean_price
+
+        # Residual variance on n - 2 degrees of freedom, as in the OLS summary
+        ssr = np.maximum(syy - slope * sxy, 0.0)
+        residual_variance = ssr / (n - 2)
+        se_slope = np.sqrt(residual_variance / sxx)
+        se_intercept = np.sqrt(residual_variance * (1.0 / n + mean_price ** 2 / sxx))
+        r_squared = 1.0 - ssr / syy
+
+        # Get elasticity from the regression model
+        elasticity = slope * (mean_price / mean_sales)
+        elasticity_se = se_slope * (mean_price / mean_sales)
+
+    table['n_obs'] = n.astype(np.int64)
+    table['n_prices'] = n_prices
+    table['price_variability'] = price_variability
+    table['mean_price'] = mean_price
+    table['mean_sales'] = mean_sales
+    table['intercept'] = intercept
+    table['slope'] = slope
+    table['se_intercept'] = se_intercept
+    table['se_slope'] = se_slope
+    table['r_squared'] = r_squared
+    table['elasticity'] = elasticity
+    table['elasticity_se'] = elasticity_se
+
+    return table.set_index(list(keys))
+
+
+
+# Regression of sales on sell_price plus control columns (e.g. the event / SNAP day shares of pricing.events)
+# for EVERY (item, state) series in one pass, with the same rows and price variability rule as
+# regression_elasticity_table; the elasticity is the price coefficient at the series' mean price and sales
+# The per-series normal equations are built from grouped sums of the centred columns and solved as one stack
+# of small systems (a pseudo-inverse, so a control that never varies within a series simply drops out)
+def controlled_regression_table(data, controls, keys=('item_id', 'state_id')):
+
+    group_ids, table = group_keys(data, list(keys))
+    n_groups = len(table)
+
+    sales = data['sales'].to_numpy(np.float64)
+    price = data['sell_price'].to_numpy(np.float64)
+    keep = (sales > 0) & (price > 0) & (group_ids >= 0)
+    g, y = group_ids[keep], sales[keep]
+    columns = np.column_stack([price[keep]] + [data[control].to_numpy(np.float64)[keep] for control in controls])
+
+    # Distinct prices per series, for the price variability guard
+    order = np.lexsort((columns[:, 0], g))
+    sorted_g, sorted_x = g[order], columns[order, 0]
+    distinct = np.r_[True, (sorted_g[1:] != sorted_g[:-1]) | (sorted_x[1:] != sorted_x[:-1])] if len(order) else np.zeros(0, dtype=bool)
+    n_prices = np.bincount(sorted_g[distinct], minlength=n_groups)
+
+    n = np.bincount(g, minlength=n_groups).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.column_stack([np.bincount(g, weights=column, minlength=n_groups) / n for column in columns.T])
+        mean_sales = np.bincount(g, weights=y, minlength=n_groups) / n
+    centred = columns - means[g]
+    dy = y - mean_sales[g]
+
+    # X'X and X'y of every series from grouped sums of the centred products
+    k = columns.shape[1]
+    xtx = np.zeros((n_groups, k, k))
+    for i in range(k):
+        for j in range(i, k):
+            xtx[:, i, j] = xtx[:, j, i] = np.bincount(g, weights=centred[:, i] * centred[:, j], minlength=n_groups)
+    xty = np.column_stack([np.bincount(g, weights=centred[:, i] * dy, minlength=n_groups) for i in range(k)])
+    syy = np.bincount(g, weights=dy * dy, minlength=n_groups)
+
+    price_variability = (n_prices >= 2) & price_varies(xtx[:, 0, 0], np.bincount(g, weights=columns[:, 0] ** 2, minlength=n_groups))
+    coefficients = np.full((n_groups, k), np.nan)
+    if price_variability.any():
+        coefficients[price_variability] = (np.linalg.pinv(xtx[price_variability]) @ xty[price_variability][..., None])[..., 0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ssr = np.maximum(syy - (coefficients * xty).sum(axis=1), 0.0)
+        r_squared = 1.0 - ssr / syy
+        intercept = mean_sales - (coefficients * means).sum(axis=1)
+        elasticity = coefficients[:, 0] * (means[:, 0] / mean_sales)
+
+    table['n_obs'] = n.astype(np.int64)
+    table['n_prices'] = n_prices
+    table['price_variability'] = price_variability
+    table['mean_price'] = means[:, 0]
+    table['mean_sales'] = mean_sales
+    table['intercept'] = intercept
+    table['slope'] = coefficients[:, 0]
+    for position, control in enumerate(controls, start=1):
+        table[f'{control}_coefficient'] = coefficients[:, position]
+    table['r_squared'] = r_squared
+    table['elasticity'] = elasticity
+
+    return table.set_index(list(keys))
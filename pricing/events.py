@@ -0,0 +1,135 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing import aggregation, granularity
+
+#--------------------------------------------------------------------------#
+
+
+
+# Event types of the M5 calendar, and the states with their own SNAP (food stamp) days
+EVENT_TYPES = ('Cultural', 'National', 'Religious', 'Sporting')
+SNAP_STATES = ('CA', 'TX', 'WI')
+
+# Day features kept on the calendar as int8 0/1 columns, in the order of the (day x feature) matrix
+#   event          - any event that day
+#   event_<type>   - an event of that type
+#   snap_<state>   - a SNAP day in that state
+FEATURES = ['event'] + [f'event_{event_type.lower()}' for event_type in EVENT_TYPES] + [f'snap_{state}' for state in SNAP_STATES]
+
+# Raw calendar.csv columns the features are derived from (older calendars without them get all-zero features)
+CALENDAR_COLUMNS = ['event_name_1', 'event_type_1', 'event_name_2', 'event_type_2'] + [f'snap_{state}' for state in SNAP_STATES]
+
+# Controls the event-aware regression adds next to price: the share of a period's days with an event, and
+# the share which were SNAP days in the series' state
+CONTROLS = ['event_share', 'snap_share']
+
+
+
+# (day x feature) int8 matrix of a calendar, in calendar row order
+# Reads the feature columns if the calendar already carries them, otherwise derives them from the raw event columns
+def feature_matrix(calendar):
+
+    if all(feature in calendar for feature in FEATURES):
+        return calendar[FEATURES].to_numpy(np.int8)
+
+    missing = pd.Series(np.nan, index=calendar.index, dtype=object)
+    types = [calendar[column] if column in calendar else missing for column in ('event_type_1', 'event_type_2')]
+
+    columns = {'event': types[0].notna() | types[1].notna()}
+    for event_type in EVENT_TYPES:
+        columns[f'event_{event_type.lower()}'] = types[0].eq(event_type) | types[1].eq(event_type)
+    for state in SNAP_STATES:
+        column = f'snap_{state}'
+        columns[column] = calendar[column].fillna(0).ne(0) if column in calendar else np.zeros(len(calendar), dtype=bool)
+
+    return np.column_stack([np.asarray(columns[feature], dtype=np.int8) for feature in FEATURES])
+
+
+
+# The calendar frame the app works with: d, date and wm_yr_wk plus the int8 feature columns
+def with_features(calendar):
+    frame = calendar[['d', 'date', 'wm_yr_wk']].reset_index(drop=True)
+    return pd.concat([frame, pd.DataFrame(feature_matrix(calendar), columns=FEATURES)], axis=1)
+
+
+
+# The (day x feature) matrix lined up with the columns of the (series x day) sales matrix, so column j of the
+# sales and row j of the features are the same day; days the calendar doesn't have are all zero
+def day_features(calendar, day_columns):
+    position = dict(zip(calendar['d'], range(len(calendar))))
+    rows = np.array([position.get(d, -1) for d in day_columns], dtype=np.int64)
+    matrix = np.zeros((len(day_columns), len(FEATURES)), dtype=np.int8)
+    matrix[rows >= 0] = feature_matrix(calendar)[rows[rows >= 0]]
+    return matrix
+
+
+
+# Days with no event and no SNAP in the given state (a state without SNAP days only excludes events)
+def ordinary_days(features, state):
+    ordinary = features[:, FEATURES.index('event')] == 0
+    if f'snap_{state}' in FEATURES:
+        ordinary &= features[:, FEATURES.index(f'snap_{state}')] == 0
+    return ordinary
+
+
+
+# Event-adjusted monthly sales per (item, store, state), in the same long layout (and row order) as monthly_sales
+# Each month's sales on ordinary days (no event, no SNAP in the series' state) are scaled up to the month's full
+# length, i.e. what the month would have sold without its holidays and SNAP days; a month with no ordinary
+# days keeps its raw total
+def adjusted_monthly_sales(sales, calendar):
+
+    day_columns = [c for c in sales.columns if c.startswith('d_')]
+    day_index, month_labels = aggregation.day_month_index(day_columns, calendar)
+    features = day_features(calendar, day_columns)
+    counts = sales[day_columns].to_numpy()
+    n_months = len(month_labels)
+
+    in_calendar = day_index >= 0
+    days_in_month = np.bincount(day_index[in_calendar], minlength=n_months)
+    adjusted = np.zeros((len(sales), n_months))
+    states = sales['state_id'].to_numpy(dtype=object)
+
+    for state in pd.unique(states):
+        rows = np.flatnonzero(states == state)
+        ordinary = ordinary_days(features, state)
+        raw = aggregation.sum_by_month(counts[rows], day_index, n_months)
+        ordinary_sales = aggregation.sum_by_month(counts[rows], np.where(ordinary, day_index, -1), n_months)
+        ordinary_count = np.bincount(day_index[in_calendar & ordinary], minlength=n_months)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            adjusted[rows] = np.where(ordinary_count > 0, ordinary_sales * (days_in_month / ordinary_count), raw)
+
+    observed = np.unique(day_index[in_calendar])
+    keys, grouped = aggregation.group_series(sales, adjusted[:, observed])
+    return aggregation.to_long(keys, grouped, month_labels[observed], 'sales')
+
+
+
+# Share of each period's days with each feature, indexed by the period label of the granularity
+def period_shares(calendar, granularity_name='month'):
+    labels = granularity.calendar_buckets(calendar, granularity_name)
+    return pd.DataFrame(feature_matrix(calendar).astype(np.float64), columns=FEATURES).groupby(labels).mean()
+
+
+
+# Adds the CONTROLS columns to a panel: the event share of each row's period, and the SNAP share of its state
+# (the mean over the SNAP states for a roll-up to 'all' stores)
+def with_controls(data, calendar, granularity_name='month'):
+
+    shares = period_shares(calendar, granularity_name)
+    position = shares.index.get_indexer(data['year_month'].astype(str))
+    found = position >= 0
+
+    event_share = np.where(found, shares['event'].to_numpy()[position], 0.0)
+
+    snap = shares[[f'snap_{state}' for state in SNAP_STATES]].to_numpy()
+    snap = np.column_stack([snap, snap.mean(axis=1)])
+    states = data['state_id'].astype(str).to_numpy()
+    state_column = np.array([SNAP_STATES.index(state) if state in SNAP_STATES else len(SNAP_STATES) for state in pd.unique(states)])
+    state_codes = state_column[pd.factorize(states)[0]]
+    snap_share = np.where(found, snap[position, state_codes], 0.0)
+
+    return data.assign(event_share=event_share, snap_share=snap_share)
@@ -0,0 +1,69 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+#--------------------------------------------------------------------------#
+
+
+
+# Discounts evaluated by a sweep: 0% to 100% in 0.5% steps
+DISCOUNT_GRID = np.arange(0.0, 100.5, 0.5)
+
+
+
+# Forecast sales volume based on price elasticity and discount, as the pages do
+# Base Demand * (1 + Elasticity * -Discount%); the [S] page takes the absolute value
+def forecast_volume(base_demand, elasticity, discount_percentage, absolute=False):
+    predicted_change = elasticity * (-np.asarray(discount_percentage) / 100)
+    volume = base_demand * (1 + predicted_change)
+    return np.abs(volume) if absolute else volume
+
+
+
+# Evaluates every discount in the grid at once for one or many series
+# Inputs broadcast against each other; the discount grid becomes the last axis of the (volume, revenue) results
+def sweep(base_demand, elasticity, price, discounts=DISCOUNT_GRID, absolute=False):
+    base_demand = np.asarray(base_demand, dtype=np.float64)[..., np.newaxis]
+    elasticity = np.asarray(elasticity, dtype=np.float64)[..., np.newaxis]
+    price = np.asarray(price, dtype=np.float64)[..., np.newaxis]
+    discounts = np.asarray(discounts, dtype=np.float64)
+
+    volume = forecast_volume(base_demand, elasticity, discounts, absolute)
+    revenue = volume * price * (1 - discounts / 100)
+    return volume, revenue
+
+
+
+# Index of the revenue-maximising discount along the last axis (-1 where no discount has a finite revenue)
+def _best(revenue):
+    finite = np.isfinite(revenue)
+    best = np.argmax(np.where(finite, revenue, -np.inf), axis=-1)
+    return np.where(finite.any(axis=-1), best, -1)
+
+
+
+# Full discount curve for one selection, for charting on the pages
+def discount_curve(base_demand, elasticity, price, discounts=DISCOUNT_GRID, absolute=False):
+    volume, revenue = sweep(base_demand, elasticity, price, discounts, absolute)
+    return pd.DataFrame({'discount': discounts, 'volume': volume, 'revenue': revenue})
+
+
+
+# Revenue-maximising discount of every series in a table with base_demand, elasticity and price columns
+# Adds optimal_discount, forecast_volume and forecast_revenue (NaN where nothing could be forecast)
+def catalogue_discounts(table, discounts=DISCOUNT_GRID, absolute=False,
+                        base_demand='base_demand', elasticity='elasticity', price='price'):
+    volume, revenue = sweep(table[base_demand].to_numpy(), table[elasticity].to_numpy(), table[price].to_numpy(),
+                            discounts, absolute)
+
+    best = _best(revenue)
+    found = best >= 0
+    rows = np.arange(len(table))
+    picked = np.where(found, best, 0)
+
+    result = table.copy()
+    result['optimal_discount'] = np.where(found, np.asarray(discounts, dtype=np.float64)[picked], np.nan)
+    result['forecast_volume'] = np.where(found, volume[rows, picked], np.nan)
+    result['forecast_revenue'] = np.where(found, revenue[rows, picked], np.nan)
+    return result
@@ -0,0 +1,150 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing import aggregation, daily_prices
+from pricing.aggregation import PRICES_KEYS, SALES_KEYS, group_keys, group_series, monthly_frames, sum_by_month
+
+#--------------------------------------------------------------------------#
+
+
+
+# Time buckets the pages can aggregate to; 'week' is the Walmart wm_yr_wk week prices are set by
+GRANULARITIES = ('day', 'week', 'month', 'quarter')
+
+# How each granularity reads in a sentence ("Past 13 months' sales")
+GRANULARITY_UNITS = {'day': 'days', 'week': 'weeks', 'month': 'months', 'quarter': 'quarters'}
+
+
+
+# Labels every calendar day with its bucket; the labels sort chronologically as strings
+#   day '2016-05-22', week '11617', month '2016-05', quarter '2016Q2'
+def calendar_buckets(calendar, granularity):
+    if granularity == 'day':
+        return calendar['date'].astype(str).to_numpy()
+    if granularity == 'week':
+        return calendar['wm_yr_wk'].astype(str).to_numpy()
+    if granularity == 'month':
+        return aggregation.calendar_months(calendar)
+    if granularity == 'quarter':
+        return pd.to_datetime(calendar['date']).dt.to_period('Q').astype(str).to_numpy()
+    raise ValueError(f'Unknown granularity {granularity!r}; expected one of {GRANULARITIES}')
+
+
+
+# Seasonal base demand of one period at any granularity, in the same units as that granularity's sales
+# At 'month' it is the seasonal index's base demand; a day, week or quarter takes each month it overlaps pro rata,
+# i.e. that month's base demand times the share of the month's days falling in the period (NaN for an unknown period)
+def period_base_demand(seasonal_index, item_id, state_id, label, granularity, calendar):
+    if granularity == 'month':
+        year, month = label.split('-')
+        return seasonal_index.base_demand(item_id, state_id, year, month)
+    months = aggregation.calendar_months(calendar)[calendar_buckets(calendar, granularity) == label]
+    if len(months) == 0:
+        return np.nan
+    total = 0.0
+    for year_month, days in zip(*np.unique(months, return_counts=True)):
+        year, month = year_month.split('-')
+        total += seasonal_index.base_demand(item_id, state_id, year, month) * days / pd.Period(year_month).days_in_month
+    return total
+
+
+
+# The daily sales matrix and a weekly price matrix, kept once per Dataset so any granularity is a cheap re-bucketing
+# series_frames(item, state, granularity) gives the same monthly_sales / monthly_prices frames the monthly
+# aggregation does (identical values at 'month'), restricted to one item in one state
+# Given the (series x day) price matrix, bucket prices are day-weighted and come with the exact revenue instead,
+# as Dataset.monthly_day_prices are at 'month'
+class SeriesMatrices:
+
+    def __init__(self, sales, prices, calendar, price_matrix=None):
+
+        self.calendar = calendar
+        self.price_matrix = price_matrix
+
+        # (series x day) counts; a snapshot's memory-mapped matrix is used as is
+        self.day_columns = [c for c in sales.columns if c.startswith('d_')]
+        self.counts = sales[self.day_columns].to_numpy()
+        self.keys = sales[SALES_KEYS].reset_index(drop=True)
+
+        group_ids, keys = group_keys(self.keys, ['item_id', 'state_id'])
+        self._series_rows = self._rows_by_group(group_ids, keys)
+
+        # Weekly prices are only needed when there are no daily prices
+        self.weeks = np.unique(calendar['wm_yr_wk'].to_numpy(np.int64))
+        if price_matrix is None:
+            self._weekly_prices(prices)
+
+        self._buckets = {}
+
+    # (item, store) x week price matrix, NaN where the item wasn't on sale; whole cents like the M5 CSV
+    def _weekly_prices(self, prices):
+        price_ids, self.price_keys = group_keys(prices, PRICES_KEYS)
+        sell_price = prices['sell_price'].to_numpy()
+        if sell_price.dtype == np.float32:
+            sell_price = np.round(sell_price.astype(np.float64), 2)
+        price_weeks = prices['wm_yr_wk'].to_numpy(np.int64)
+        week_pos = np.searchsorted(self.weeks, price_weeks).clip(max=len(self.weeks) - 1)
+        valid = (price_ids >= 0) & (self.weeks[week_pos] == price_weeks)
+        self.weekly_prices = np.full((len(self.price_keys), len(self.weeks)), np.nan)
+        self.weekly_prices[price_ids[valid], week_pos[valid]] = sell_price[valid]
+        self._price_rows = {key: row for row, key in enumerate(zip(self.price_keys['item_id'], self.price_keys['store_id']))}
+
+    # Row positions of every (item, state), from one stable sort rather than a scan per group
+    @staticmethod
+    def _rows_by_group(group_ids, keys):
+        order = np.argsort(group_ids, kind='stable')
+        bounds = np.searchsorted(group_ids[order], np.arange(len(keys) + 1))
+        return {
+            key: order[bounds[g]:bounds[g + 1]]
+            for g, key in enumerate(zip(keys['item_id'], keys['state_id']))
+        }
+
+    # Day -> bucket index of every day column, the sorted bucket labels, and a (week x bucket) incidence matrix
+    # (a week straddling two buckets counts towards both, as the monthly price mean always has)
+    def buckets(self, granularity):
+        if granularity not in self._buckets:
+            labels_of_day = calendar_buckets(self.calendar, granularity)
+            labels = np.unique(labels_of_day)
+            day_codes = np.searchsorted(labels, labels_of_day)
+
+            bucket_of_d = dict(zip(self.calendar['d'], day_codes))
+            day_index = np.array([bucket_of_d.get(d, -1) for d in self.day_columns], dtype=np.int64)
+
+            week_of_day = np.searchsorted(self.weeks, self.calendar['wm_yr_wk'].to_numpy(np.int64))
+            incidence = np.zeros((len(self.weeks), len(labels)))
+            incidence[week_of_day, day_codes] = 1.0
+
+            self._buckets[granularity] = (day_index, labels, incidence)
+        return self._buckets[granularity]
+
+    # Long sales and price frames (item_id, store_id, state_id, year_month, sales / sell_price) of one
+    # (item, state) at the given granularity; the bucket label goes in the 'year_month' column whatever the
+    # granularity, so SeriesPanel and the elasticity tables work on them unchanged
+    def series_frames(self, item_id, state_id, granularity='month'):
+
+        day_index, labels, incidence = self.buckets(granularity)
+        rows = self._series_rows.get((item_id, state_id), np.zeros(0, dtype=np.int64))
+
+        # Sales summed per bucket, keeping only the buckets which have sales days
+        bucketed = sum_by_month(np.asarray(self.counts[rows]), day_index, len(labels))
+        observed = np.unique(day_index[day_index >= 0])
+        keys, grouped = group_series(self.keys.iloc[rows], bucketed[:, observed])
+
+        # Day-weighted price and exact revenue per bucket, from the daily prices of the same rows
+        if self.price_matrix is not None:
+            sums = daily_prices.bucket_sums(self.counts[rows], self.price_matrix[rows], day_index, len(labels))
+            _, sums = group_series(self.keys.iloc[rows], np.stack(sums, axis=-1)[:, observed])
+            monthly_sales = aggregation.to_long(keys, grouped, labels[observed], 'sales')
+            return monthly_sales, daily_prices.day_price_frame(keys, sums[..., 0], sums[..., 1], sums[..., 2], labels[observed])
+
+        # Mean weekly price per bucket over the weeks the item was on sale
+        price_rows = [self._price_rows[key] for key in zip(keys['item_id'], keys['store_id']) if key in self._price_rows]
+        prices = self.weekly_prices[price_rows]
+        on_sale = ~np.isnan(prices)
+        price_sum = np.where(on_sale, prices, 0.0) @ incidence
+        price_count = on_sale.astype(np.float64) @ incidence
+        price_keys = self.price_keys.iloc[price_rows].reset_index(drop=True)
+
+        return monthly_frames(keys, grouped, labels[observed], price_keys, price_sum, price_count, labels)
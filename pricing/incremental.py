@@ -0,0 +1,294 @@
+#------------------------------ Dependencies ------------------------------#
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from pricing import aggregation, daily_prices, events, snapshot
+from pricing.instrumentation import stage
+
+#--------------------------------------------------------------------------#
+
+
+
+# The monthly aggregates are persisted next to the snapshot as (group x month) matrices:
+#   monthly.sales        summed sales per (item, store, state) and month
+#   monthly.price_sum    summed weekly prices per (item, store) and month
+#   monthly.price_count  number of weekly price rows behind each sum (so means can be updated exactly)
+# Group keys are stored as integer codes into the snapshot's category lists
+
+
+
+# True if the snapshot already holds monthly aggregates
+def aggregates_exist(snapshot_dir=snapshot.SNAPSHOT_DIR):
+    return snapshot.snapshot_exists(snapshot_dir) and 'aggregates' in snapshot.read_meta(snapshot_dir)
+
+
+
+# Encodes a keys frame as one code array per column, against the snapshot's categories
+def _key_codes(keys, columns, categories):
+    return [pd.Categorical(keys[column], categories=categories[column]).codes.astype(np.int64) for column in columns]
+
+
+
+# Decodes stored key codes back into a frame of categoricals
+def _key_frame(codes, columns, categories):
+    return pd.DataFrame({
+        column: pd.Categorical.from_codes(column_codes, categories=categories[column])
+        for column, column_codes in zip(columns, codes)
+    })
+
+
+
+def _save_aggregates(meta, snapshot_dir, keys, monthly, month_labels, price_keys, price_sum, price_count, price_months):
+    categories = meta['categories']
+    for column, codes in zip(aggregation.SALES_KEYS, _key_codes(keys, aggregation.SALES_KEYS, categories)):
+        snapshot.save_array(f'monthly.sales_{column}', snapshot.smallest_int(codes), snapshot_dir)
+    for column, codes in zip(aggregation.PRICES_KEYS, _key_codes(price_keys, aggregation.PRICES_KEYS, categories)):
+        snapshot.save_array(f'monthly.price_{column}', snapshot.smallest_int(codes), snapshot_dir)
+    snapshot.save_array('monthly.sales', monthly, snapshot_dir)
+    snapshot.save_array('monthly.price_sum', price_sum, snapshot_dir)
+    snapshot.save_array('monthly.price_count', price_count, snapshot_dir)
+
+    # The revision counts every rewrite, so tables derived from the aggregates know when they've gone stale
+    revision = meta.get('aggregates', {}).get('revision', 0) + 1
+    meta['aggregates'] = {'sales_months': list(month_labels), 'price_months': list(price_months), 'revision': revision}
+    snapshot.write_meta(meta, snapshot_dir)
+
+
+
+def _load_aggregates(snapshot_dir):
+    meta = snapshot.read_meta(snapshot_dir)
+    categories = meta['categories']
+
+    def codes(prefix, columns):
+        return [np.asarray(snapshot.open_array(f'{prefix}_{column}', snapshot_dir), dtype=np.int64) for column in columns]
+
+    keys = _key_frame(codes('monthly.sales', aggregation.SALES_KEYS), aggregation.SALES_KEYS, categories)
+    price_keys = _key_frame(codes('monthly.price', aggregation.PRICES_KEYS), aggregation.PRICES_KEYS, categories)
+
+    return (
+        keys,
+        np.array(snapshot.open_array('monthly.sales', snapshot_dir)),
+        np.array(meta['aggregates']['sales_months'], dtype=object),
+        price_keys,
+        np.array(snapshot.open_array('monthly.price_sum', snapshot_dir)),
+        np.array(snapshot.open_array('monthly.price_count', snapshot_dir)),
+        np.array(meta['aggregates']['price_months'], dtype=object),
+    )
+
+
+
+# Full build of the monthly aggregates from the snapshot's tables, persisted for later incremental updates
+def write_aggregates(sales, prices, calendar, snapshot_dir=snapshot.SNAPSHOT_DIR):
+    keys, monthly, month_labels = aggregation.monthly_sales_matrix(sales, calendar)
+    price_keys, price_sum, price_count, price_months = aggregation.monthly_price_sums(prices, calendar)
+    _save_aggregates(snapshot.read_meta(snapshot_dir), snapshot_dir,
+                     keys, monthly, month_labels, price_keys, price_sum, price_count, price_months)
+
+
+
+# Reads the persisted aggregates as the usual monthly_sales / monthly_prices frames
+def read_aggregates(snapshot_dir=snapshot.SNAPSHOT_DIR):
+    with stage('load.aggregates', source=snapshot_dir) as record:
+        monthly_sales, monthly_prices = aggregation.monthly_frames(*_load_aggregates(snapshot_dir))
+        record['rows'] = len(monthly_sales) + len(monthly_prices)
+    return monthly_sales, monthly_prices
+
+
+
+# Places a (group x month) matrix onto a wider set of month labels, leaving new months at zero
+def _widen(matrix, labels, all_labels):
+    widened = np.zeros((matrix.shape[0], len(all_labels)), dtype=matrix.dtype)
+    widened[:, np.searchsorted(all_labels, labels)] = matrix
+    return widened
+
+
+
+# Appends new sales days, calendar days and price rows to the snapshot, then recomputes ONLY the
+# monthly aggregates of the months they touch (usually just the latest one) and persists everything
+#   new_sales    - 'id' plus the new 'd_' columns (series left out of the delta get zero sales)
+#   new_prices   - item_id, store_id, wm_yr_wk, sell_price rows; rows for an existing (item, store, week) replace it
+#   new_calendar - d, date, wm_yr_wk (and event / SNAP) rows for days the calendar doesn't have yet
+def append_days(new_sales=None, new_prices=None, new_calendar=None, snapshot_dir=snapshot.SNAPSHOT_DIR):
+
+    if not snapshot.snapshot_exists(snapshot_dir):
+        raise FileNotFoundError(f'No snapshot at {snapshot_dir}; build one with python -m pricing.snapshot first')
+
+    sales, prices, calendar = snapshot.read_snapshot(snapshot_dir)
+    if not aggregates_exist(snapshot_dir):
+        write_aggregates(sales, prices, calendar, snapshot_dir)
+
+    meta = snapshot.read_meta(snapshot_dir)
+    categories = meta['categories']
+    changed_weeks = set()
+
+    # ------------------------------------ Calendar ------------------------------------ #
+
+    new_days_in_calendar = []
+    if new_calendar is not None:
+        new_calendar = new_calendar[~new_calendar['d'].isin(meta['calendar_d'])]
+        new_days_in_calendar = new_calendar['d'].tolist()
+        dates = np.concatenate([
+            np.asarray(snapshot.open_array('calendar.date', snapshot_dir)),
+            pd.to_datetime(new_calendar['date']).to_numpy().astype('datetime64[D]'),
+        ])
+        weeks = np.concatenate([
+            np.asarray(snapshot.open_array('calendar.wm_yr_wk', snapshot_dir)),
+            new_calendar['wm_yr_wk'].to_numpy(np.int32),
+        ])
+        features = np.concatenate([
+            np.asarray(snapshot.open_array('calendar.features', snapshot_dir)),
+            events.feature_matrix(new_calendar),
+        ])
+        snapshot.save_array('calendar.date', dates, snapshot_dir)
+        snapshot.save_array('calendar.wm_yr_wk', weeks, snapshot_dir)
+        snapshot.save_array('calendar.features', features, snapshot_dir)
+        meta['calendar_d'] = meta['calendar_d'] + new_days_in_calendar
+        changed_weeks.update(new_calendar['wm_yr_wk'].tolist())
+
+    # ------------------------------------ Sales days ------------------------------------ #
+
+    new_days = []
+    if new_sales is not None:
+        known_days = set(meta['day_columns'])
+        new_days = sorted((c for c in new_sales.columns if c.startswith('d_') and c not in known_days), key=lambda d: int(d[2:]))
+
+        id_codes = pd.Categorical(new_sales['id'], categories=categories['id']).codes
+        if (id_codes < 0).any():
+            raise ValueError('new_sales contains series ids that are not in the snapshot')
+
+        # Row of the snapshot's sales matrix holding each series id
+        row_of_id = np.empty(len(categories['id']), dtype=np.int64)
+        row_of_id[np.asarray(snapshot.open_array('sales.id', snapshot_dir))] = np.arange(len(sales))
+
+        counts = snapshot.open_array('sales.counts', snapshot_dir)
+        block_values = new_sales[new_days].to_numpy()
+        dtype = np.result_type(counts.dtype, snapshot.smallest_int(block_values, floor=np.int16).dtype)
+        block = np.zeros((len(sales), len(new_days)), dtype=dtype)
+        block[row_of_id[id_codes]] = block_values
+
+        snapshot.save_array('sales.counts', np.concatenate([counts, block], axis=1), snapshot_dir)
+        meta['day_columns'] = meta['day_columns'] + new_days
+
+    # ------------------------------------ Price weeks ------------------------------------ #
+
+    if new_prices is not None and len(new_prices):
+        for column in snapshot.PRICES_KEYS:
+            if not new_prices[column].isin(categories[column]).all():
+                raise ValueError(f'new_prices contains {column} values that are not in the snapshot')
+
+        new_codes = _key_codes(new_prices, snapshot.PRICES_KEYS, categories)
+        new_weeks = new_prices['wm_yr_wk'].to_numpy(np.int64)
+
+        # Drop existing rows for the same (item, store, week) so re-sent rows replace rather than duplicate
+        n_stores = len(categories['store_id'])
+        old_codes = [np.asarray(snapshot.open_array(f'prices.{column}', snapshot_dir), dtype=np.int64) for column in snapshot.PRICES_KEYS]
+        old_weeks = np.asarray(snapshot.open_array('prices.wm_yr_wk', snapshot_dir), dtype=np.int64)
+        week_span = int(max(old_weeks.max(initial=0), new_weeks.max())) + 1
+        old_key = (old_codes[0] * n_stores + old_codes[1]) * week_span + old_weeks
+        new_key = (new_codes[0] * n_stores + new_codes[1]) * week_span + new_weeks
+        keep = ~np.isin(old_key, new_key)
+
+        for column, codes, added in zip(snapshot.PRICES_KEYS, old_codes, new_codes):
+            snapshot.save_array(f'prices.{column}', snapshot.smallest_int(np.concatenate([codes[keep], added])), snapshot_dir)
+        snapshot.save_array('prices.wm_yr_wk', np.concatenate([old_weeks[keep], new_weeks]).astype(np.int32), snapshot_dir)
+        snapshot.save_array('prices.sell_price', np.concatenate([
+            np.asarray(snapshot.open_array('prices.sell_price', snapshot_dir))[keep],
+            new_prices['sell_price'].to_numpy(np.float32),
+        ]), snapshot_dir)
+        changed_weeks.update(new_weeks.tolist())
+
+    snapshot.write_meta(meta, snapshot_dir)
+
+    # ------------------------------------ Recompute affected months ------------------------------------ #
+
+    sales, prices, calendar = snapshot.read_snapshot(snapshot_dir)
+    calendar_months = aggregation.calendar_months(calendar)
+
+    # The daily price matrix is rebuilt whole: it's one gather, and a changed week can reach forward-filled days
+    if new_days or changed_weeks:
+        snapshot.save_array('sales.prices', daily_prices.daily_price_matrix(sales, prices, calendar), snapshot_dir)
+    month_of_d = dict(zip(calendar['d'], calendar_months))
+
+    # Sales: every month holding a new day is re-summed from all of its days
+    sales_affected = sorted({month_of_d[d] for d in new_days if d in month_of_d})
+
+    # Prices: every month a new calendar day or a changed price week falls in is re-averaged from all its weeks
+    price_affected = sorted(
+        set(calendar_months[calendar['d'].isin(new_days_in_calendar).to_numpy()])
+        | set(calendar_months[calendar['wm_yr_wk'].isin(changed_weeks).to_numpy()])
+    )
+
+    keys, monthly, month_labels, price_keys, price_sum, price_count, price_months = _load_aggregates(snapshot_dir)
+
+    if sales_affected:
+        day_columns = [d for d in meta['day_columns'] if month_of_d.get(d) in sales_affected]
+        _, part, part_labels = aggregation.monthly_sales_matrix(sales[aggregation.SALES_KEYS + day_columns], calendar)
+        all_months = np.union1d(month_labels, part_labels).astype(object)
+        monthly = _widen(monthly, month_labels, all_months)
+        monthly[:, np.searchsorted(all_months, part_labels)] = part
+        month_labels = all_months
+
+    if price_affected:
+        affected_weeks = np.unique(calendar['wm_yr_wk'].to_numpy()[np.isin(calendar_months, price_affected)])
+        part_prices = prices[prices['wm_yr_wk'].isin(affected_weeks)]
+        part_keys, part_sum, part_count, part_labels = aggregation.monthly_price_sums(part_prices, calendar)
+
+        # A straddling week also touches its other month, which this subset only partly covers -> skip those columns
+        take = np.isin(part_labels, price_affected)
+        part_sum, part_count, part_labels = part_sum[:, take], part_count[:, take], part_labels[take]
+
+        # New (item, store) pairs may have started selling: merge the group lists by their combined codes
+        n_stores = len(categories['store_id'])
+        old_codes = _key_codes(price_keys, aggregation.PRICES_KEYS, categories)
+        part_codes = _key_codes(part_keys, aggregation.PRICES_KEYS, categories)
+        old_combined = old_codes[0] * n_stores + old_codes[1]
+        part_combined = part_codes[0] * n_stores + part_codes[1]
+        all_combined = np.union1d(old_combined, part_combined)
+
+        all_months = np.union1d(price_months, part_labels).astype(object)
+        rows = np.searchsorted(all_combined, old_combined)
+        widened_sum = np.zeros((len(all_combined), len(all_months)))
+        widened_count = np.zeros((len(all_combined), len(all_months)), dtype=np.int64)
+        widened_sum[rows] = _widen(price_sum, price_months, all_months)
+        widened_count[rows] = _widen(price_count, price_months, all_months)
+
+        columns = np.searchsorted(all_months, part_labels)
+        part_rows = np.searchsorted(all_combined, part_combined)
+        widened_sum[:, columns] = 0
+        widened_count[:, columns] = 0
+        widened_sum[np.ix_(part_rows, columns)] = part_sum
+        widened_count[np.ix_(part_rows, columns)] = part_count
+
+        price_keys = _key_frame([all_combined // n_stores, all_combined % n_stores], aggregation.PRICES_KEYS, categories)
+        price_sum, price_count, price_months = widened_sum, widened_count, all_months
+
+    _save_aggregates(snapshot.read_meta(snapshot_dir), snapshot_dir,
+                     keys, monthly, month_labels, price_keys, price_sum, price_count, price_months)
+
+    return {'days_added': len(new_days), 'sales_months': sales_affected, 'price_months': price_affected}
+
+
+
+# Daily refresh: python -m pricing.incremental --sales new_days.csv [--prices new_prices.csv] [--calendar calendar.csv]
+def main():
+    parser = argparse.ArgumentParser(description='Append new sales days and price weeks to the snapshot and update the monthly aggregates.')
+    parser.add_argument('--sales', help="CSV with an 'id' column plus the new d_ columns")
+    parser.add_argument('--prices', help='CSV of new sell_prices rows (item_id, store_id, wm_yr_wk, sell_price)')
+    parser.add_argument('--calendar', help='Calendar CSV (d, date, wm_yr_wk, events, SNAP); only days not yet in the snapshot are added')
+    parser.add_argument('--snapshot', default=snapshot.SNAPSHOT_DIR, help='Snapshot directory to update')
+    args = parser.parse_args()
+
+    summary = append_days(
+        new_sales=pd.read_csv(args.sales) if args.sales else None,
+        new_prices=pd.read_csv(args.prices, usecols=['item_id', 'store_id', 'wm_yr_wk', 'sell_price']) if args.prices else None,
+        new_calendar=pd.read_csv(args.calendar, usecols=lambda column: column in ['d', 'date', 'wm_yr_wk'] + events.CALENDAR_COLUMNS) if args.calendar else None,
+        snapshot_dir=args.snapshot,
+    )
+    print(f"Added {summary['days_added']} days; recomputed sales for {summary['sales_months']} and prices for {summary['price_months']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#------------------------------ Dependencies ------------------------------#
+
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+#--------------------------------------------------------------------------#
+
+
+
+# Stage records go out through this logger; nothing is printed unless a handler is attached
+logger = logging.getLogger('pricing')
+
+# Set PRICING_LOG=json to write every stage record to stderr as one JSON object per line
+LOG_FORMAT = os.environ.get('PRICING_LOG', '')
+
+# Whether the pages' sidebar diagnostics panel starts expanded
+SHOW_DIAGNOSTICS = os.environ.get('PRICING_DIAGNOSTICS', '') not in ('', '0')
+
+# Columns the diagnostics panel shows, in order
+PANEL_COLUMNS = ['stage', 'seconds', 'rows', 'cache', 'rss_mb', 'peak_rss_mb']
+
+
+
+# Formats a log record as one JSON object: its timestamp, level and message plus any stage metrics it carries
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        payload = {'time': round(record.created, 3), 'level': record.levelname, 'message': record.getMessage()}
+        payload.update(getattr(record, 'metrics', {}))
+        return json.dumps(payload, default=str)
+
+
+
+# Attaches a JSON-lines handler to the pricing logger (once), for shipping stage records to a metrics pipeline
+def configure_logging(stream=None):
+    if any(isinstance(handler.formatter, JsonFormatter) for handler in logger.handlers):
+        return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+if LOG_FORMAT == 'json':
+    configure_logging()
+
+
+
+# Resident set size of this process in MB, from /proc (None where that isn't available)
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+
+# Peak resident set size of this process in MB (None on platforms without the resource module)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+
+
+# Each Streamlit script run happens on its own thread, so a run's records are kept per thread
+_local = threading.local()
+
+
+
+# Starts collecting the stage records of the current script run (or CLI invocation), dropping the previous ones
+def start_trace():
+    _local.records = []
+    _local.depth = 0
+    _local.lap = time.perf_counter()
+    return _local.records
+
+
+
+# Records collected since start_trace() on this thread
+def current_trace():
+    return getattr(_local, 'records', [])
+
+
+
+# Adds a stage record to the current trace (if one was started), so stages list in the order they began
+def _keep(record):
+    if hasattr(_local, 'records'):
+        _local.records.append(record)
+    return record
+
+
+
+# Finishes a stage record: adds memory readings and logs it
+def _emit(record):
+    record['rss_mb'] = rss_mb()
+    record['peak_rss_mb'] = peak_rss_mb()
+    logger.info('stage %s', record['stage'], extra={'metrics': record})
+    return record
+
+
+
+# Times the enclosed block as one stage; the caller can fill in rows, cache ('hit'/'miss') and any other field
+#     with stage('aggregate', rows=len(sales)) as record:
+#         ...
+@contextlib.contextmanager
+def stage(name, rows=None, cache=None, **fields):
+    depth = getattr(_local, 'depth', 0)
+    record = _keep({'stage': name, 'seconds': None, 'rows': rows, 'cache': cache, 'depth': depth, **fields})
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        _local.depth = depth
+        _local.lap = time.perf_counter()
+        _emit(record)
+
+
+
+# Records the time since the previous lap (or stage, or start_trace) as a stage, for straight-line page code
+def lap(name, rows=None, cache=None, **fields):
+    now = time.perf_counter()
+    seconds = now - getattr(_local, 'lap', now)
+    _local.lap = now
+    record = _keep({'stage': name, 'seconds': round(seconds, 6), 'rows': rows, 'cache': cache,
+                    'depth': getattr(_local, 'depth', 0), **fields})
+    return _emit(record)
+
+
+
+# Logs a user action or other event as a structured record, without timing anything
+def event(name, **fields):
+    logger.info('event %s', name, extra={'metrics': {'event': name, **fields}})
+
+
+
+# Stage records as a frame, nested stages indented under the stage they ran in
+def trace_frame(records=None):
+    records = current_trace() if records is None else records
+    frame = pd.DataFrame(records, columns=PANEL_COLUMNS + ['depth'])
+    frame['stage'] = ['· ' * int(depth) + name for name, depth in zip(frame['stage'], frame['depth'])]
+    return frame[PANEL_COLUMNS]
+
+
+
+# Optional diagnostics panel for a page's sidebar: pass st.sidebar (this module doesn't import streamlit)
+def diagnostics_panel(container):
+    if container.checkbox('Show diagnostics', value=SHOW_DIAGNOSTICS):
+        records = current_trace()
+        container.caption(f"{sum(record['seconds'] or 0 for record in records if not record['depth']):.3f}s this run, "
+                          f"RSS {rss_mb()} MB (peak {peak_rss_mb()} MB)")
+        container.dataframe(trace_frame(records), hide_index=True)
@@ -0,0 +1,75 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing import snapshot
+from pricing.instrumentation import stage
+
+#--------------------------------------------------------------------------#
+
+
+
+# Key index over a snapshot: only the small id-code arrays and the calendar are read up front,
+# so the selectboxes can be filled in milliseconds; load(item, state) then reads just that series'
+# rows out of the memory-mapped day counts and prices
+class SeriesIndex:
+
+    def __init__(self, snapshot_dir=snapshot.SNAPSHOT_DIR):
+
+        with stage('lazy.index', source=snapshot_dir) as record:
+            self.snapshot_dir = snapshot_dir
+            self.meta = snapshot.read_meta(snapshot_dir)
+            self.categories = self.meta['categories']
+            self.calendar = snapshot.read_calendar(snapshot_dir, self.meta)
+
+            self.codes = {column: np.asarray(snapshot.open_array(f'sales.{column}', snapshot_dir)) for column in snapshot.SALES_KEYS}
+            self.price_codes = {column: snapshot.open_array(f'prices.{column}', snapshot_dir) for column in snapshot.PRICES_KEYS}
+
+            # Selectbox options in the order the full panel lists them: rows sorted by item then store
+            # (categories are sorted, so code order is name order)
+            order = np.lexsort((self.codes['store_id'], self.codes['item_id']))
+            self.items = np.array(self.categories['item_id'], dtype=object)[pd.unique(self.codes['item_id'][order])]
+            self.states = np.array(self.categories['state_id'], dtype=object)[pd.unique(self.codes['state_id'][order])]
+            record['rows'] = len(order)
+
+    # Category code of a name, or -1 if the snapshot has never seen it
+    def _code(self, column, name):
+        values = self.categories[column]
+        position = np.searchsorted(values, name)
+        return int(position) if position < len(values) and values[position] == name else -1
+
+    # Positions of the series of one item in one state, in snapshot (row) order
+    def rows(self, item_id, state_id):
+        item, state = self._code('item_id', item_id), self._code('state_id', state_id)
+        return np.flatnonzero((self.codes['item_id'] == item) & (self.codes['state_id'] == state))
+
+    def __contains__(self, key):
+        return len(self.rows(*key)) > 0
+
+    # Sales, prices and calendar frames holding only one (item, state)'s rows, shaped like read_snapshot's
+    def load(self, item_id, state_id):
+
+        rows = self.rows(item_id, state_id)
+
+        def categorical(codes, column):
+            return pd.Categorical.from_codes(codes, categories=self.categories[column])
+
+        # Fancy-indexing the memory map reads only these series' pages of the count matrix
+        counts = snapshot.open_array('sales.counts', self.snapshot_dir)[rows]
+        sales = pd.DataFrame(counts, columns=self.meta['day_columns'])
+        for position, column in enumerate(snapshot.SALES_KEYS):
+            sales.insert(position, column, categorical(self.codes[column][rows], column))
+
+        # Price rows of the same item in the stores those series sell in
+        item = self._code('item_id', item_id)
+        stores = np.unique(self.codes['store_id'][rows])
+        price_rows = np.flatnonzero((self.price_codes['item_id'] == item) & np.isin(self.price_codes['store_id'], stores))
+        prices = pd.DataFrame({
+            'item_id': categorical(np.asarray(self.price_codes['item_id'][price_rows]), 'item_id'),
+            'store_id': categorical(np.asarray(self.price_codes['store_id'][price_rows]), 'store_id'),
+            'wm_yr_wk': snapshot.open_array('prices.wm_yr_wk', self.snapshot_dir)[price_rows],
+            'sell_price': snapshot.open_array('prices.sell_price', self.snapshot_dir)[price_rows],
+        })
+
+        return sales, prices, self.calendar
@@ -0,0 +1,126 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing.aggregation import group_keys
+from pricing.cube import product_ids
+
+#--------------------------------------------------------------------------#
+
+
+
+# Neighbours returned by default, and the peer groups searched in order: the series' department in its state,
+# then (if the department has no usable series) its category in its state
+NEIGHBOURS = 5
+PEER_LEVELS = ('dept', 'cat')
+
+
+
+# Normalised monthly profile of every (item, state) series, one row each, on a shared month grid:
+#   sales - the series' monthly sales (summed over its stores) as z-scores, so the shape counts and not the volume
+#   price - its mean monthly price relative to its own average price, 0 in months it wasn't on sale
+# Rows are scaled to unit length, so the dot product of two profiles is their cosine similarity
+def series_profiles(data):
+
+    group_ids, keys = group_keys(data, ['item_id', 'state_id'])
+    months, month_codes = np.unique(data['year_month'].astype(str).to_numpy(), return_inverse=True)
+    n_series, n_months = len(keys), len(months)
+
+    valid = group_ids >= 0
+    cell = group_ids[valid] * n_months + month_codes[valid]
+    sales = data['sales'].to_numpy(np.float64)[valid]
+    price = data['sell_price'].to_numpy(np.float64)[valid]
+    priced = ~np.isnan(price)
+
+    def grid(weights):
+        return np.bincount(cell, weights=weights, minlength=n_series * n_months).reshape(n_series, n_months)
+
+    monthly_sales = grid(sales)
+    price_sum, price_count = grid(np.where(priced, price, 0.0)), grid(priced.astype(np.float64))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = monthly_sales.std(axis=1, keepdims=True)
+        sales_profile = np.where(spread > 0, (monthly_sales - monthly_sales.mean(axis=1, keepdims=True)) / spread, 0.0)
+
+        monthly_price = price_sum / price_count
+        average_price = price_sum.sum(axis=1, keepdims=True) / price_count.sum(axis=1, keepdims=True)
+        price_profile = np.where(price_count > 0, monthly_price / average_price - 1.0, 0.0)
+
+    profiles = np.hstack([sales_profile, price_profile])
+    length = np.linalg.norm(profiles, axis=1, keepdims=True)
+    profiles = np.divide(profiles, length, out=np.zeros_like(profiles), where=length > 0).astype(np.float32)
+
+    return keys, profiles
+
+
+
+# Similarity index for borrowing an elasticity from comparable series
+# Built once per Dataset from the monthly panel and the regression table: every series gets a profile, and the
+# series whose regression is usable (enough price variability, finite elasticity) are stored as donors, grouped by
+# department / category and state, so a query is one small matrix-vector product within the series' peer group
+class NeighbourIndex:
+
+    def __init__(self, data, regression_table):
+
+        self.keys, self.profiles = series_profiles(data)
+        self._rows = {key: row for row, key in enumerate(zip(self.keys['item_id'], self.keys['state_id']))}
+
+        elasticity = regression_table['elasticity'].where(regression_table['price_variability'])
+        elasticity = elasticity.reindex(pd.MultiIndex.from_frame(self.keys)).to_numpy(np.float64)
+        donors = np.flatnonzero(np.isfinite(elasticity))
+        self.elasticity = elasticity
+
+        # Donor rows of every (peer, state), per peer level
+        items = self.keys['item_id'].to_numpy(dtype=object)
+        states = self.keys['state_id'].to_numpy(dtype=object)
+        self._peers = {}
+        self._donors = {}
+        for level in PEER_LEVELS:
+            peers = np.asarray(product_ids(items, level), dtype=object)
+            self._peers[level] = peers
+            frame = pd.DataFrame({'peer': peers[donors], 'state': states[donors], 'row': donors})
+            self._donors[level] = {key: group['row'].to_numpy() for key, group in frame.groupby(['peer', 'state'], sort=False)}
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    # The k most similar donor series to (item, state) in its peer group, most similar first, as a frame of
+    # item_id, state_id, peer level, similarity (cosine, -1 to 1) and elasticity; empty if there are none
+    def neighbours(self, item_id, state_id, k=NEIGHBOURS):
+
+        columns = ['item_id', 'state_id', 'peer_level', 'similarity', 'elasticity']
+        row = self._rows.get((item_id, state_id))
+        if row is None:
+            return pd.DataFrame(columns=columns)
+
+        for level in PEER_LEVELS:
+            candidates = self._donors[level].get((self._peers[level][row], state_id), np.zeros(0, dtype=np.int64))
+            candidates = candidates[candidates != row]
+            if len(candidates):
+                break
+        else:
+            return pd.DataFrame(columns=columns)
+
+        similarity = self.profiles[candidates] @ self.profiles[row]
+        top = np.argsort(-similarity, kind='stable')[:k]
+        chosen = candidates[top]
+
+        return pd.DataFrame({
+            'item_id': self.keys['item_id'].to_numpy(dtype=object)[chosen],
+            'state_id': self.keys['state_id'].to_numpy(dtype=object)[chosen],
+            'peer_level': level,
+            'similarity': similarity[top].astype(np.float64),
+            'elasticity': self.elasticity[chosen],
+        })
+
+    # Similarity-weighted mean elasticity of the k nearest neighbours (only positively similar ones count,
+    # all of them equally if none are), with the neighbours it came from; None if there are no neighbours
+    def borrowed_elasticity(self, item_id, state_id, k=NEIGHBOURS):
+        neighbours = self.neighbours(item_id, state_id, k)
+        if neighbours.empty:
+            return None
+        weights = neighbours['similarity'].clip(lower=0).to_numpy()
+        if weights.sum() == 0:
+            weights = np.ones(len(neighbours))
+        return float(np.average(neighbours['elasticity'], weights=weights)), neighbours
@@ -0,0 +1,101 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+
+from pricing.aggregation import group_keys
+
+#--------------------------------------------------------------------------#
+
+
+
+# Key columns a selection is looked up by
+PANEL_KEYS = ['item_id', 'state_id']
+
+# Windows the historic optimal price is precomputed over: the [S] page's last 13 months, and full history (None)
+OPTIMAL_PRICE_WINDOWS = (13, None)
+
+
+
+# Monthly sales merged with monthly prices once, with the row positions of every (item, state) indexed up front
+# series(item, state) then returns exactly the rows `data[(data['item_id'] == item) & (data['state_id'] == state)]`
+# used to, in the same order, without scanning the whole frame on each Streamlit rerun
+class SeriesPanel:
+
+    def __init__(self, monthly_sales, monthly_prices):
+
+        # Merge the monthly-aggregated sales and prices dataframes
+        self.data = monthly_sales.merge(monthly_prices, on=['item_id', 'store_id', 'year_month'], how='left')
+
+        # Group the row positions by (item, state), keeping each group's rows in their original order
+        group_ids, keys = group_keys(self.data, PANEL_KEYS)
+        order = np.argsort(group_ids, kind='stable')
+        order = order[group_ids[order] >= 0]
+        bounds = np.searchsorted(group_ids[order], np.arange(len(keys) + 1))
+
+        self.keys = keys
+        self._group_ids = group_ids[order]
+        self._bounds = bounds
+        self._positions = order
+        self._index = {
+            (item, state): (bounds[g], bounds[g + 1])
+            for g, (item, state) in enumerate(zip(keys['item_id'], keys['state_id']))
+        }
+
+        # Options for the item and state selectboxes, in the order they first appear
+        self.items = monthly_sales['item_id'].unique()
+        self.states = monthly_sales['state_id'].unique()
+
+        # Historic optimal price of every (item, state), one table per window, built alongside the panel
+        self.optimal_prices = {window: self.optimal_price_table(window) for window in OPTIMAL_PRICE_WINDOWS}
+
+    # Rows of the merged panel for one item in one state (empty if the pair doesn't exist)
+    def series(self, item_id, state_id):
+        start, stop = self._index.get((item_id, state_id), (0, 0))
+        return self.data.take(self._positions[start:stop])
+
+    # Price which brought in the most revenue (sales * sell_price summed per price) over each series' last
+    # `window` rows, the same as the [S] page's groupby('sell_price')['monthly_revenue'].sum().idxmax()
+    # on series(item, state).tail(window); window=None uses the full history
+    # A panel built from day-weighted prices carries each row's exact revenue, which is summed instead
+    def optimal_price_table(self, window=13):
+
+        # Keep each group's last `window` rows (rows are grouped and in their original order)
+        group_ids = self._group_ids
+        rows_left = self._bounds[group_ids + 1] - np.arange(len(group_ids)) - 1
+        keep = np.ones(len(group_ids), dtype=bool) if window is None else rows_left < window
+
+        positions = self._positions[keep]
+        g = group_ids[keep]
+        price = self.data['sell_price'].to_numpy(np.float64)[positions]
+        if 'revenue' in self.data:
+            revenue = self.data['revenue'].to_numpy(np.float64)[positions]
+        else:
+            revenue = self.data['sales'].to_numpy(np.float64)[positions] * price
+
+        # Rows without a price aren't a groupby key, so they drop out
+        priced = ~np.isnan(price)
+        g, price, revenue = g[priced], price[priced], revenue[priced]
+
+        # Total revenue per (group, price)
+        order = np.lexsort((price, g))
+        g, price, revenue = g[order], price[order], revenue[order]
+        starts = np.flatnonzero(np.r_[True, (g[1:] != g[:-1]) | (price[1:] != price[:-1])]) if len(g) else np.zeros(0, dtype=np.int64)
+        segment_g, segment_price = g[starts], price[starts]
+        segment_revenue = np.add.reduceat(revenue, starts) if len(g) else np.zeros(0)
+
+        # Highest revenue per group; ties go to the lowest price, as idxmax returns the first one
+        best = np.lexsort((segment_price, -segment_revenue, segment_g))
+        best = best[np.r_[True, segment_g[best][1:] != segment_g[best][:-1]]] if len(best) else best
+
+        table = self.keys.copy()
+        table['optimal_price'] = np.nan
+        table['optimal_revenue'] = np.nan
+        table.loc[segment_g[best], 'optimal_price'] = segment_price[best]
+        table.loc[segment_g[best], 'optimal_revenue'] = segment_revenue[best]
+        return table.set_index(PANEL_KEYS)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
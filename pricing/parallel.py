@@ -0,0 +1,97 @@
+#------------------------------ Dependencies ------------------------------#
+
+import collections
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pricing import aggregation
+from pricing.elasticity import arc_elasticity_table, regression_elasticity_table
+
+#--------------------------------------------------------------------------#
+
+
+
+# Worker processes to use; PRICING_WORKERS overrides, otherwise one per core
+WORKERS = int(os.environ.get('PRICING_WORKERS', 0)) or os.cpu_count() or 1
+
+# The app only fans out when a worker count above one is configured explicitly
+ENABLED = int(os.environ.get('PRICING_WORKERS', 1)) > 1
+
+
+
+# Row positions of every distinct value of `column`, in sorted value order so results merge deterministically
+# Returns the values and one position array per value; shards are taken from these one at a time (see _map), so
+# at no point is the whole frame held twice
+def _shard_rows(frame, column):
+    codes, values = pd.factorize(frame[column], sort=True)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+    return values, [order[bounds[i]:bounds[i + 1]] for i in range(len(values))]
+
+
+
+# Runs fn over the shards in a process pool (or in-process with a single worker) and returns results in shard order
+# shards is a list of functions building each call's arguments; a shard is only built when it's about to be
+# submitted, and at most `workers` are in flight at once
+# Workers are spawned rather than forked, as the app's threads (lazy builds, the API server) can hold locks at fork
+def _map(fn, shards, workers):
+    workers = min(workers or WORKERS, len(shards)) or 1
+    if workers == 1:
+        return [fn(*shard()) for shard in shards]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = collections.deque()
+        for shard in shards:
+            if len(pending) == workers:
+                results.append(pending.popleft().result())
+            pending.append(pool.submit(fn, *shard()))
+        results.extend(future.result() for future in pending)
+    return results
+
+
+
+# The rows of a frame at the given positions, as a function for _map
+def _take(frame, rows):
+    return lambda: (frame.take(rows),)
+
+
+
+# Same output as aggregation.monthly_sales_and_prices, with every store aggregated in its own process
+# No (item, store) group spans two stores, so the shards concatenate and sort back into the serial row order
+def monthly_sales_and_prices(sales, prices, calendar, workers=None):
+
+    stores, sales_rows = _shard_rows(sales, 'store_id')
+    price_rows = dict(zip(*_shard_rows(prices, 'store_id')))
+    no_rows = np.zeros(0, dtype=np.int64)
+    def shard(store, rows):
+        return lambda: (sales.take(rows), prices.take(price_rows.get(store, no_rows)), calendar)
+
+    results = _map(aggregation.monthly_sales_and_prices, [shard(store, rows) for store, rows in zip(stores, sales_rows)], workers)
+
+    monthly_sales = pd.concat([sales_part for sales_part, _ in results], ignore_index=True)
+    monthly_sales = monthly_sales.sort_values(aggregation.SALES_KEYS + ['year_month'], kind='stable', ignore_index=True)
+
+    monthly_prices = pd.concat([prices_part for _, prices_part in results], ignore_index=True)
+    monthly_prices = monthly_prices.sort_values(aggregation.PRICES_KEYS + ['year_month'], kind='stable', ignore_index=True)
+
+    return monthly_sales, monthly_prices
+
+
+
+# Arc elasticity table built one store per process; same rows and order as arc_elasticity_table(data)
+def arc_table(data, workers=None):
+    parts = _map(arc_elasticity_table, [_take(data, rows) for rows in _shard_rows(data, 'store_id')[1]], workers)
+    table = pd.concat(parts, ignore_index=True)
+    return table.sort_values(['item_id', 'store_id', 'start_month'], kind='stable', ignore_index=True)
+
+
+
+# Regression elasticity table built one state per process; same rows and order as regression_elasticity_table(data)
+def regression_table(data, workers=None):
+    parts = _map(regression_elasticity_table, [_take(data, rows) for rows in _shard_rows(data, 'state_id')[1]], workers)
+    return pd.concat(parts).sort_index(kind='stable')
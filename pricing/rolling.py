@@ -0,0 +1,137 @@
+#------------------------------ Dependencies ------------------------------#
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from pricing import batch, parallel, service, snapshot
+from pricing.aggregation import group_keys
+from pricing.elasticity import price_varies
+
+#--------------------------------------------------------------------------#
+
+
+
+# Window lengths the pages offer (in periods of the selected granularity); None is an expanding window
+WINDOWS = (6, 12, 24, None)
+
+# Fewest observations (store-months) a window needs before its elasticity is reported
+MIN_OBS = 3
+
+
+
+# Regression elasticity (the [LRM] page's sales ~ sell_price fit) of every (item, state) over a moving window of
+# `window` periods ending at each period, or over all periods so far when window is None
+# One pass builds the (series x period) sums of n, x, y, x^2 and xy, their running totals along the periods give
+# every window's sums as a difference of two totals, and the closed-form slope follows, so the whole timeline
+# costs O(periods) per series instead of one sm.OLS fit per window
+# Returns a long frame of item_id, state_id, year_month, n_obs and elasticity for the periods each series has
+# rows in; elasticity is NaN where the window holds fewer than min_obs observations or a single price
+def rolling_elasticity_table(data, window=None, keys=('item_id', 'state_id'), min_obs=MIN_OBS):
+
+    if window is not None and window < 1:
+        raise ValueError(f'Window must be at least 1 period, or None for an expanding window; got {window!r}')
+
+    group_ids, table = group_keys(data, list(keys))
+    periods, period_codes = np.unique(data['year_month'].astype(str).to_numpy(), return_inverse=True)
+    n_series, n_periods = len(table), len(periods)
+
+    # Same observations as regression_elasticity_table: months with zero sales or zero (missing) price are dropped
+    sales = data['sales'].to_numpy(np.float64)
+    price = data['sell_price'].to_numpy(np.float64)
+    keep = (sales > 0) & (price > 0) & (group_ids >= 0)
+    g, t, x, y = group_ids[keep], period_codes[keep], price[keep], sales[keep]
+
+    # Centred on each series' mean so the running totals stay well conditioned
+    with np.errstate(invalid='ignore', divide='ignore'):
+        count = np.bincount(g, minlength=n_series)
+        shift_x = np.bincount(g, weights=x, minlength=n_series) / count
+        shift_y = np.bincount(g, weights=y, minlength=n_series) / count
+    cx, cy = x - shift_x[g], y - shift_y[g]
+
+    cell = g * n_periods + t
+    def totals(weights):
+        grid = np.bincount(cell, weights=weights, minlength=n_series * n_periods).reshape(n_series, n_periods)
+        running = np.cumsum(grid, axis=1)
+        if window is None:
+            return running
+        # Window sums as the difference of two running totals
+        lagged = np.zeros_like(running)
+        lagged[:, window:] = running[:, :-window]
+        return running - lagged
+
+    n = totals(None)
+    sum_x, sum_y, sum_xx, sum_xy = totals(cx), totals(cy), totals(cx * cx), totals(cx * cy)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sxx = sum_xx - sum_x * sum_x / n
+        sxy = sum_xy - sum_x * sum_y / n
+        # Raw sum of squared prices in the window, undoing the centring
+        raw_xx = sum_xx + shift_x[:, None] * (2 * sum_x + n * shift_x[:, None])
+        usable = (n >= max(min_obs, 2)) & price_varies(sxx, raw_xx)
+        slope = np.where(usable, sxy / sxx, np.nan)
+        mean_x = shift_x[:, None] + sum_x / n
+        mean_y = shift_y[:, None] + sum_y / n
+        elasticity = slope * (mean_x / mean_y)
+
+    # Back to long form, over the periods each series has panel rows in
+    present = np.zeros((n_series, n_periods), dtype=bool)
+    valid = group_ids >= 0
+    present[group_ids[valid], period_codes[valid]] = True
+    rows, columns = np.nonzero(present)
+
+    timeline = table.iloc[rows].reset_index(drop=True)
+    timeline['year_month'] = periods[columns]
+    timeline['n_obs'] = n[rows, columns].astype(np.int64)
+    timeline['elasticity'] = elasticity[rows, columns]
+    return timeline
+
+
+
+# Rolling elasticity of one series from its panel rows, indexed by period (for a timeline chart)
+def rolling_elasticity(series, window=None, min_obs=MIN_OBS):
+    rows = pd.DataFrame({
+        'key': 0,
+        'year_month': series['year_month'].to_numpy(),
+        'sales': series['sales'].to_numpy(),
+        'sell_price': series['sell_price'].to_numpy(),
+    })
+    timeline = rolling_elasticity_table(rows, window, keys=('key',), min_obs=min_obs)
+    return timeline.set_index('year_month')['elasticity']
+
+
+
+# --window argument: a whole number of periods, at least 1
+def _window(value):
+    window = int(value)
+    if window < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {window}')
+    return window
+
+
+
+# Catalogue-wide timeline: python -m pricing.rolling --window 12 --out elasticity_timeline.parquet
+def main():
+    parser = argparse.ArgumentParser(description='Compute the rolling regression elasticity of every series over time.')
+    parser.add_argument('--source', default=service.DATA_SOURCE, help='Directory or URL prefix holding the M5 CSV files')
+    parser.add_argument('--snapshot', default=snapshot.SNAPSHOT_DIR, help='Snapshot directory to read instead of the CSVs, if it exists')
+    parser.add_argument('--items', nargs='*', help="Item ids or glob patterns to include (e.g. 'FOODS_3_*'); all items by default")
+    parser.add_argument('--states', nargs='*', help='State ids to include; all states by default')
+    parser.add_argument('--level', default='item:store', help="Hierarchy level as PRODUCT:LOCATION, e.g. 'dept:state' or 'cat:all'")
+    parser.add_argument('--window', type=_window, default=None, help='Window length in months; an expanding window by default')
+    parser.add_argument('--min-obs', type=int, default=MIN_OBS, help='Fewest observations a window needs')
+    parser.add_argument('--workers', type=int, default=parallel.WORKERS, help='Worker processes used to load the dataset')
+    parser.add_argument('--out', default='elasticity_timeline.parquet', help='Output file (.parquet, .feather or .csv)')
+    args = parser.parse_args()
+
+    dataset = batch.load_dataset(args.source, args.snapshot, args.workers)
+    product_level, location_level = args.level.split(':')
+    data = batch.select_series(dataset.at_level(product_level, location_level).panel.data, args.items, args.states)
+    timeline = rolling_elasticity_table(data, args.window, min_obs=args.min_obs)
+    batch.write_report(timeline, args.out)
+    print(f"Wrote {len(timeline)} rows ({timeline['elasticity'].notna().sum()} with an elasticity) to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
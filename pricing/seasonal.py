@@ -0,0 +1,82 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing.aggregation import group_keys
+
+#--------------------------------------------------------------------------#
+
+
+
+# First year the pages average base demand from
+FIRST_YEAR = 2011
+
+
+
+# Seasonal base-demand index over (item, state, month of year, year), built once with grouped sums
+# base_demand(item, state, year, month) gives the same value as the pages' loop: the mean over
+# FIRST_YEAR..year of that month's average sales across the state's stores, NaN if any year is missing
+class SeasonalIndex:
+
+    def __init__(self, data, first_year=FIRST_YEAR):
+
+        group_ids, keys = group_keys(data, ['item_id', 'state_id'])
+
+        # Parse the ~65 distinct 'YYYY-MM' labels once, then map every row onto them
+        label_codes, labels = pd.factorize(data['year_month'])
+        label_years = np.array([int(label[:4]) for label in labels], dtype=np.int64)
+        label_months = np.array([int(label[5:7]) for label in labels], dtype=np.int64)
+        years, months = label_years[label_codes], label_months[label_codes]
+
+        self.first_year = first_year
+        self.last_year = max(int(label_years.max()) if len(labels) else first_year, first_year)
+        n_years = self.last_year - first_year + 1
+
+        # Average sales across stores for each (item, state, month, year), NaN where that month has no rows
+        keep = (group_ids >= 0) & (years >= first_year)
+        flat = ((group_ids * 12 + months - 1) * n_years + years - first_year)[keep]
+        size = len(keys) * 12 * n_years
+        total = np.bincount(flat, weights=data['sales'].to_numpy(np.float64)[keep], minlength=size)
+        count = np.bincount(flat, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.values = (total / count).reshape(len(keys), 12, n_years)
+
+        # Expanding mean over the years, so the base demand up to any year is a single lookup
+        # (a NaN year propagates forward, exactly like np.mean over a list containing NaN)
+        self.cumulative_mean = np.cumsum(self.values, axis=2) / np.arange(1, n_years + 1)
+
+        self.keys = keys
+        self._index = {key: g for g, key in enumerate(zip(keys['item_id'], keys['state_id']))}
+
+    # The yearly volumes for one month of the year, from first_year up to and including `year`
+    def volumes(self, item_id, state_id, year, month):
+        g = self._index.get((item_id, state_id))
+        n = int(year) - self.first_year + 1
+        if g is None or n < 1:
+            return np.array([])
+        values = self.values[g, int(month) - 1, :n]
+        # Years after the data ends count as missing, as the page's filter would have found no rows
+        return np.concatenate([values, np.full(max(n - len(values), 0), np.nan)])
+
+    # Average base demand for the month across the years up to `year`
+    def base_demand(self, item_id, state_id, year, month):
+        g = self._index.get((item_id, state_id))
+        n = int(year) - self.first_year + 1
+        if g is None or n < 1 or n > self.values.shape[2]:
+            return np.nan
+        return self.cumulative_mean[g, int(month) - 1, n - 1]
+
+    # Standard deviation of the yearly volumes behind base_demand
+    def spread(self, item_id, state_id, year, month):
+        volumes = self.volumes(item_id, state_id, year, month)
+        return np.std(volumes) if len(volumes) else np.nan
+
+    # Base demand of every (item, state) for one month, as a Series indexed by (item_id, state_id)
+    def base_demand_table(self, year, month):
+        n = int(year) - self.first_year + 1
+        if 1 <= n <= self.values.shape[2]:
+            values = self.cumulative_mean[:, int(month) - 1, n - 1]
+        else:
+            values = np.full(self.values.shape[0], np.nan)
+        return pd.Series(values, index=pd.MultiIndex.from_frame(self.keys), name='base_demand')
@@ -0,0 +1,448 @@
+#------------------------------ Dependencies ------------------------------#
+
+import collections
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from pricing import aggregation, events, granularity, incremental, lazy, parallel, snapshot, streaming
+from pricing.cube import RollupCube
+from pricing.daily_prices import DailyPrices, daily_price_matrix, monthly_day_prices
+from pricing.elasticity import arc_elasticity_table, controlled_regression_table, index_arc_table, regression_elasticity_table
+from pricing.instrumentation import stage
+from pricing.neighbours import NeighbourIndex
+from pricing.panel import SeriesPanel
+from pricing.seasonal import SeasonalIndex
+from pricing.store import PERSISTED_TABLES, TableStore
+
+#--------------------------------------------------------------------------#
+
+
+
+# Bucket holding the original M5 CSVs, used when there's no local copy next to the app
+REMOTE_SOURCE = 'https://storage.googleapis.com/pricing-optimisation-data/original'
+
+# Directory or URL prefix of the raw CSVs, shared by every page
+DATA_SOURCE = os.environ.get('PRICING_DATA_SOURCE') or ('.' if os.path.exists(snapshot.SALES_FILE) else REMOTE_SOURCE)
+
+# Set to a row count to build the monthly aggregates by streaming the sales CSV in chunks of that size
+# (for small containers which can't hold the whole file; only used when there's no snapshot)
+STREAMING_CHUNK_ROWS = int(os.environ.get('PRICING_STREAMING_CHUNK_ROWS', 0))
+
+# Set PRICING_LAZY=1 to serve the pages one series at a time from the snapshot while the full dataset builds
+# in the background, keeping the PRICING_LAZY_CACHE_SIZE most recently viewed series
+LAZY = os.environ.get('PRICING_LAZY', '') not in ('', '0')
+LAZY_CACHE_SIZE = int(os.environ.get('PRICING_LAZY_CACHE_SIZE', 32))
+
+
+
+# Marks a NumPy array read-only and returns it, so shared arrays can't be changed by accident
+def _read_only(values):
+    values.setflags(write=False)
+    return values
+
+
+
+# The same frame over read-only arrays, so writing into it (df.loc[...] = ..., df.values[...] = ...) raises instead
+# of silently changing what every other page and session sees; selections, new columns and the like are new
+# frames and stay writeable
+# Each run of same-dtype numeric columns becomes one read-only view of its data (nothing is copied, and the wide
+# sales matrix stays a single block); key columns are passed through as they are
+def _read_only_frame(frame):
+    if frame is None or not len(frame.columns):
+        return frame
+    dtypes = frame.dtypes.to_numpy()
+    starts = [0] + [i for i in range(1, len(dtypes)) if dtypes[i] != dtypes[i - 1]] + [len(dtypes)]
+    parts = []
+    for start, stop in zip(starts[:-1], starts[1:]):
+        part = frame.iloc[:, start:stop]
+        if isinstance(dtypes[start], np.dtype) and dtypes[start].kind in 'biufcmM':
+            values = _read_only(part.to_numpy().view())
+            part = pd.DataFrame(values, index=frame.index, columns=part.columns, copy=False)
+        parts.append(part)
+    return pd.concat(parts, axis=1) if len(parts) > 1 else parts[0]
+
+
+
+# Makes the frames of a derived table read-only before it's shared (see _read_only_frame)
+def _publish(table):
+    if isinstance(table, pd.DataFrame):
+        return _read_only_frame(table)
+    if isinstance(table, SeriesPanel):
+        table.data = _read_only_frame(table.data)
+    return table
+
+
+
+# Everything the pages read, loaded and aggregated once per server process
+# Derived tables are built the first time any page asks for them, then shared by every session
+# With a TableStore the persisted tables are read back from disk instead, and newly built ones are saved to it
+# price_matrix is the snapshot's memory-mapped (series x day) price matrix; it's built from sales and prices if needed
+# base is the item x store Dataset an item x state level was rolled up from (see at_level); it supplies the daily
+# data behind the other granularities and the shelf prices
+class Dataset:
+
+    def __init__(self, sales, prices, calendar, monthly=None, use_parallel=parallel.ENABLED, store=None, granularity_name='month',
+                 price_matrix=None, base=None):
+        self.sales = _read_only_frame(sales)
+        self.prices = _read_only_frame(prices)
+        self.calendar = _read_only_frame(calendar)
+        self.price_matrix = price_matrix
+        self.base = base
+        self.use_parallel = use_parallel
+        self.store = store
+        # Granularity of the periods in year_month (only at_granularity() builds datasets at another one)
+        self.granularity_name = granularity_name
+
+        # Aggregates the sales and price data at a MONTHLY level (unless persisted aggregates were passed in)
+        if monthly is None and use_parallel:
+            monthly = parallel.monthly_sales_and_prices(sales, prices, calendar)
+        elif monthly is None:
+            monthly = aggregation.monthly_sales_and_prices(sales, prices, calendar)
+        self.monthly_sales, self.monthly_prices = (_read_only_frame(frame) for frame in monthly)
+
+        self._tables = {}
+        self._lock = threading.RLock()
+
+    # Builds a derived table once; concurrent sessions asking at the same time wait for the same build
+    def _table(self, name, build):
+        with self._lock, stage(f'dataset.{name}') as record:
+            record['cache'] = 'hit' if name in self._tables else 'miss'
+            if name not in self._tables:
+                table = self._restore(name, record)
+                if table is None:
+                    table = build()
+                    if self.store is not None and name in PERSISTED_TABLES:
+                        self.store.save(name, table)
+                self._tables[name] = _publish(table)
+            table = self._tables[name]
+            record['rows'] = len(table) if isinstance(table, pd.DataFrame) else len(getattr(table, 'keys', ())) or None
+            return table
+
+    # A persisted copy of a table, if the store has one ('disk' in the stage record)
+    def _restore(self, name, record):
+        if self.store is None or name not in PERSISTED_TABLES:
+            return None
+        table = self.store.load(name)
+        if table is not None:
+            record['cache'] = 'disk'
+        return table
+
+    # Monthly sales merged with prices, indexed by (item, state)
+    # With the daily data at hand the prices are day-weighted and come with the exact revenue (see monthly_day_prices)
+    @property
+    def panel(self):
+        def build():
+            day_prices = self.monthly_day_prices
+            return SeriesPanel(self.monthly_sales, self.monthly_prices if day_prices is None else day_prices)
+        return self._table('panel', build)
+
+    # Price of every series on every day, lined up with the sales matrix (None when the daily sales were streamed)
+    @property
+    def daily_prices(self):
+        if self.sales is None:
+            return None
+        def build():
+            matrix = self.price_matrix if self.price_matrix is not None else daily_price_matrix(self.sales, self.prices, self.calendar)
+            return DailyPrices(self.sales[aggregation.SALES_KEYS], matrix)
+        return self._table('daily_prices', build)
+
+    # Monthly prices averaged over days rather than weeks, with each month's exact revenue (sum of daily sales
+    # times daily price), in the layout of monthly_prices; None when the daily sales were streamed
+    @property
+    def monthly_day_prices(self):
+        if self.sales is None:
+            return None
+        return self._table('monthly_day_prices', lambda: monthly_day_prices(self.sales, self.daily_prices.matrix, self.calendar))
+
+    # Shelf price of an item in a state on the latest day, for the forecasts (None without the daily data)
+    def latest_price(self, item_id, state_id):
+        if self.daily_prices is None:
+            return self.base.latest_price(item_id, state_id) if self.base is not None else None
+        return self.daily_prices.latest_price(item_id, state_id)
+
+    # Arc elasticity of every adjacent month pair, indexed by (item_id, store_id, start_month)
+    @property
+    def arc_table(self):
+        build = parallel.arc_table if self.use_parallel else arc_elasticity_table
+        return self._table('arc_table', lambda: index_arc_table(build(self.panel.data)))
+
+    # Regression elasticity of every (item, state)
+    @property
+    def regression_table(self):
+        build = parallel.regression_table if self.use_parallel else regression_elasticity_table
+        return self._table('regression_table', lambda: build(self.panel.data))
+
+    # Regression elasticity of every (item, state) controlling for the event and SNAP day shares of each period
+    @property
+    def controlled_regression_table(self):
+        def build():
+            data = events.with_controls(self.panel.data, self.calendar, self.granularity_name)
+            return controlled_regression_table(data, events.CONTROLS)
+        return self._table('controlled_regression_table', build)
+
+    # Seasonal base demand per (item, state, month of year, year)
+    @property
+    def seasonal_index(self):
+        index = self._table('seasonal_index', lambda: SeasonalIndex(self.panel.data))
+        # (also covers an index unpickled from the store, which comes back writeable)
+        _read_only(index.values)
+        _read_only(index.cumulative_mean)
+        return index
+
+    # Similarity index over the series' monthly profiles, for borrowing an elasticity where a series has none
+    @property
+    def neighbour_index(self):
+        return self._table('neighbour_index', lambda: NeighbourIndex(self.panel.data, self.regression_table))
+
+    # Monthly sales with the event and SNAP days factored out, in the layout of monthly_sales
+    # (None when the daily sales were streamed, as the adjustment needs them)
+    @property
+    def adjusted_monthly_sales(self):
+        if self.sales is None:
+            return None
+        return self._table('adjusted_monthly_sales', lambda: events.adjusted_monthly_sales(self.sales, self.calendar))
+
+    # The Dataset of the event-adjusted monthly sales, for a base demand (seasonal index) free of holiday and
+    # SNAP spikes; None when there are no adjusted sales
+    # (an item x state level rolls up its base's)
+    @property
+    def event_adjusted(self):
+        if self.base is not None:
+            adjusted = self.base.event_adjusted
+            if adjusted is None:
+                return None
+            return self._table('event_adjusted', lambda: Dataset(None, None, self.calendar, RollupCube(adjusted.panel.data).frames('item', 'state'),
+                                                                 use_parallel=self.use_parallel))
+        if self.adjusted_monthly_sales is None:
+            return None
+        def build():
+            return Dataset(None, None, self.calendar, (self.adjusted_monthly_sales, self.monthly_day_prices), use_parallel=self.use_parallel)
+        return self._table('event_adjusted', build)
+
+    # Daily sales and weekly price matrices, re-bucketed on demand by at_granularity()
+    @property
+    def matrices(self):
+        return self._table('matrices', lambda: granularity.SeriesMatrices(self.sales, self.prices, self.calendar, self.daily_prices.matrix))
+
+    # Granularities this dataset can serve; only the monthly aggregates exist when the daily data was streamed
+    @property
+    def granularities(self):
+        if self.base is not None:
+            return self.base.granularities
+        return granularity.GRANULARITIES if self.sales is not None else ('month',)
+
+    # A small Dataset holding one (item, state) aggregated to another granularity (this one at 'month')
+    # Its panel, arc and regression tables work as usual; base demand still comes from this dataset's monthly
+    # seasonal index, via granularity.period_base_demand()
+    # An item x state level re-buckets its base's stores and rolls them up to the state the same way
+    def at_granularity(self, item_id, state_id, granularity_name='month'):
+        if granularity_name == 'month':
+            return self
+        with stage('dataset.at_granularity', granularity=granularity_name) as record:
+            if self.base is not None:
+                stores = self.base.at_granularity(item_id, state_id, granularity_name)
+                frames = RollupCube(stores.panel.data).frames('item', 'state')
+            else:
+                frames = self.matrices.series_frames(item_id, state_id, granularity_name)
+            record['rows'] = len(frames[0])
+        return Dataset(None, None, self.calendar, frames, use_parallel=False, granularity_name=granularity_name)
+
+    # Monthly sales and prices rolled up the item/dept/cat x store/state/all hierarchy
+    @property
+    def cube(self):
+        return self._table('cube', lambda: RollupCube(self.panel.data))
+
+    # The Dataset of one level of the hierarchy, built once: its 'items' are departments or categories and its
+    # 'stores' states or 'all' as the level asks (this dataset itself at item x store)
+    # Item x state keeps this dataset as its base, so it offers every granularity and the shelf prices too
+    def at_level(self, product_level='item', location_level='store'):
+        if (product_level, location_level) == ('item', 'store'):
+            return self
+        def build():
+            base = self if (product_level, location_level) == ('item', 'state') else None
+            return Dataset(None, None, self.calendar, self.cube.frames(product_level, location_level), use_parallel=self.use_parallel,
+                           base=base)
+        return self._table(f'level.{product_level}.{location_level}', build)
+
+    # Options for the item and state selectboxes
+    @property
+    def items(self):
+        return self.panel.items
+
+    @property
+    def states(self):
+        return self.panel.states
+
+    # The dataset to read one series from: every series is already here
+    def for_series(self, item_id, state_id):
+        return self
+
+
+
+# Lazy stand-in for the full Dataset (PRICING_LAZY=1, snapshot required)
+# The selectboxes are filled from the snapshot's key index straight away; for_series() then aggregates only the
+# selected series into a small Dataset of its own (kept in an LRU of recently viewed series) until the full
+# Dataset, built on a background thread, is ready and takes over
+class LazyDataset:
+
+    def __init__(self, source, snapshot_dir, cache_size=LAZY_CACHE_SIZE, background=True):
+        self.source = source
+        self.snapshot_dir = snapshot_dir
+        self.index = lazy.SeriesIndex(snapshot_dir)
+        self.items = self.index.items
+        self.states = self.index.states
+
+        self.cache_size = cache_size
+        self._series = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._full = None
+
+        if background:
+            threading.Thread(target=self._build_full, name='pricing-full-build', daemon=True).start()
+
+    # Loads the full Dataset and builds every derived table, then switches for_series() over to it
+    def _build_full(self):
+        with stage('lazy.full_build'):
+            dataset = get_dataset(self.source, self.snapshot_dir)
+            for table in PERSISTED_TABLES:
+                getattr(dataset, table)
+        self._full = dataset
+
+    # True once the full Dataset has been built
+    @property
+    def ready(self):
+        return self._full is not None
+
+    # An item's stores roll up to its state one series at a time (see LazyItemStates); other levels need the whole
+    # catalogue, so they wait for the full Dataset
+    def at_level(self, product_level='item', location_level='store'):
+        if (product_level, location_level) == ('item', 'store'):
+            return self
+        if (product_level, location_level) == ('item', 'state'):
+            return LazyItemStates(self)
+        return get_dataset(self.source, self.snapshot_dir).at_level(product_level, location_level)
+
+    # Neighbours need every series' profile, so the index is only offered once the full Dataset is ready (else None)
+    @property
+    def neighbour_index(self):
+        return self._full.neighbour_index if self._full is not None else None
+
+    # A Dataset holding the series of one item in one state (the full one, once it's ready)
+    def for_series(self, item_id, state_id):
+        if self._full is not None:
+            return self._full
+
+        key = (item_id, state_id)
+        with self._lock, stage('lazy.series') as record:
+            record['cache'] = 'hit' if key in self._series else 'miss'
+            if key in self._series:
+                self._series.move_to_end(key)
+                return self._series[key]
+
+            if key not in self.index:
+                raise KeyError(key)
+            sales, prices, calendar = self.index.load(item_id, state_id)
+            monthly = aggregation.monthly_sales_and_prices(sales, prices, calendar)
+            # The same rows of the snapshot's daily price matrix, read from the memory map
+            price_matrix = snapshot.open_array('sales.prices', self.snapshot_dir)[self.index.rows(item_id, state_id)]
+            dataset = Dataset(sales, prices, calendar, monthly, use_parallel=False, price_matrix=price_matrix)
+            record['rows'] = len(sales)
+
+            self._series[key] = dataset
+            while len(self._series) > self.cache_size:
+                self._series.popitem(last=False)
+            return dataset
+
+
+
+# The item x state level of a LazyDataset: each series is its lazily loaded stores rolled up to the state
+class LazyItemStates:
+
+    def __init__(self, lazy_dataset):
+        self.lazy_dataset = lazy_dataset
+        self.items = lazy_dataset.items
+        self.states = lazy_dataset.states
+
+    # The item x state level of the Dataset holding the series (the full one's, once it's ready)
+    def for_series(self, item_id, state_id):
+        return self.lazy_dataset.for_series(item_id, state_id).at_level('item', 'state')
+
+    # Offered once the full Dataset is ready, as at item x store (else None)
+    @property
+    def neighbour_index(self):
+        full = self.lazy_dataset._full
+        return full.at_level('item', 'state').neighbour_index if full is not None else None
+
+
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+_generation = 0
+
+# Lazy datasets have their own lock, as the background build holds _datasets_lock while it loads
+_catalogues = {}
+_catalogues_lock = threading.Lock()
+
+
+
+# Loads a Dataset, reading the monthly aggregates persisted in the snapshot (building them on first use)
+def _load_dataset(source, snapshot_dir):
+    if not snapshot.snapshot_exists(snapshot_dir):
+        if STREAMING_CHUNK_ROWS:
+            # The raw daily sales are never held in memory, so only the monthly aggregates are available
+            calendar = snapshot.read_calendar_csv(source)
+            return Dataset(None, None, calendar, streaming.monthly_sales_and_prices(source, STREAMING_CHUNK_ROWS))
+        return Dataset(*snapshot.read_csvs(source))
+
+    sales, prices, calendar = snapshot.read_snapshot(snapshot_dir)
+    if not incremental.aggregates_exist(snapshot_dir):
+        incremental.write_aggregates(sales, prices, calendar, snapshot_dir)
+    return Dataset(sales, prices, calendar, incremental.read_aggregates(snapshot_dir), store=TableStore.for_snapshot(snapshot_dir),
+                   price_matrix=snapshot.open_array('sales.prices', snapshot_dir))
+
+
+
+# Returns the process-wide Dataset, loading it on first use
+# Unlike st.cache_data nothing is hashed or pickled per call: every page and session gets the same object
+def get_dataset(source=None, snapshot_dir=snapshot.SNAPSHOT_DIR):
+    key = (source or DATA_SOURCE, snapshot_dir)
+    with _datasets_lock, stage('get_dataset') as record:
+        record['cache'] = 'hit' if key in _datasets else 'miss'
+        if key not in _datasets:
+            _datasets[key] = _load_dataset(key[0], snapshot_dir)
+        return _datasets[key]
+
+
+
+# What the pages read series from: a LazyDataset in lazy mode when there's a snapshot, otherwise the full Dataset
+def get_catalogue(source=None, snapshot_dir=snapshot.SNAPSHOT_DIR):
+    if not (LAZY and snapshot.snapshot_exists(snapshot_dir)):
+        return get_dataset(source, snapshot_dir)
+
+    key = (source or DATA_SOURCE, snapshot_dir)
+    with _catalogues_lock:
+        if key not in _catalogues:
+            _catalogues[key] = LazyDataset(key[0], snapshot_dir)
+        return _catalogues[key]
+
+
+
+# Forgets the loaded datasets, so the next get_dataset() picks up a refreshed snapshot
+# (sessions still holding the old Dataset keep using it until their next rerun)
+def reload():
+    global _generation
+    with _catalogues_lock:
+        _catalogues.clear()
+    with _datasets_lock:
+        _datasets.clear()
+        _generation += 1
+
+
+
+# Number of reload()s so far: anything cached from the data (e.g. the API's answers) is only valid for the
+# generation it was computed in
+def generation():
+    return _generation
@@ -0,0 +1,272 @@
+#------------------------------ Dependencies ------------------------------#
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from pricing import daily_prices, events
+from pricing.instrumentation import stage
+
+#--------------------------------------------------------------------------#
+
+
+
+# Raw M5 file names, resolved against a local directory or a bucket URL
+SALES_FILE = 'sales_train_evaluation.csv'
+PRICES_FILE = 'sell_prices.csv'
+CALENDAR_FILE = 'calendar.csv'
+
+# Number of wide-format 'd' (day) columns in the sales CSV
+N_DAYS = 1941
+
+# Where the typed snapshot lives, relative to the app's working directory
+SNAPSHOT_DIR = os.environ.get('PRICING_SNAPSHOT_DIR', './snapshot')
+
+# Bump whenever the on-disk layout changes, so stale snapshots are rebuilt instead of misread
+SNAPSHOT_VERSION = 3
+
+# Columns of each table which are stored as integer codes into a shared category list
+SALES_KEYS = ['id', 'item_id', 'store_id', 'state_id']
+PRICES_KEYS = ['item_id', 'store_id']
+
+
+
+# Reads calendar.csv: d, date and wm_yr_wk, with the event and SNAP columns turned into int8 day features
+def read_calendar_csv(source):
+    calendar_columns = ['d', 'date', 'wm_yr_wk'] + events.CALENDAR_COLUMNS
+    calendar = pd.read_csv(f"{source.rstrip('/')}/{CALENDAR_FILE}", usecols=lambda column: column in calendar_columns)
+    return events.with_features(calendar)
+
+
+
+# Reads the raw M5 CSVs from a directory or URL prefix, loading only the columns the app uses
+def read_csvs(source):
+
+    source = source.rstrip('/')
+
+    with stage('load.csv', source=source) as record:
+        # Sales CSV (in wide format), contains each items' sales record at each day
+        # Take all the wide-format 'd' aka. day columns
+        sales_columns = ['id', 'item_id', 'store_id', 'state_id'] + [f'd_{i}' for i in range(1, N_DAYS + 1)]
+        sales = pd.read_csv(f'{source}/{SALES_FILE}', usecols=sales_columns)
+
+        # Prices CSV -> Contains an item's Price, at a specific wm_yr_wk (the week)
+        prices_columns = ['item_id', 'store_id', 'wm_yr_wk', 'sell_price']
+        prices = pd.read_csv(f'{source}/{PRICES_FILE}', usecols=prices_columns)
+
+        # Events CSV -> the calendar, with event and SNAP days as int8 features (see pricing/events.py)
+        calendar = read_calendar_csv(source)
+        record['rows'] = len(sales)
+
+    return sales, prices, calendar
+
+
+
+# Fingerprint of the raw CSVs a snapshot is built from: the size and modification time of local files, or the
+# ETag / Last-Modified / Content-Length the bucket reports for remote ones (None if a file can't be reached)
+# Stored in the snapshot's metadata, so a changed input is noticed without reading it
+def input_fingerprint(source):
+
+    source = source.rstrip('/')
+    parts = {}
+
+    for name in (SALES_FILE, PRICES_FILE, CALENDAR_FILE):
+        path = f'{source}/{name}'
+        try:
+            if '://' in source:
+                with urllib.request.urlopen(urllib.request.Request(path, method='HEAD'), timeout=10) as response:
+                    parts[name] = [response.headers.get(header) for header in ('ETag', 'Last-Modified', 'Content-Length')]
+            else:
+                stat = os.stat(path)
+                parts[name] = [stat.st_size, stat.st_mtime_ns]
+        except (OSError, ValueError):
+            return None
+
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+
+# Picks the narrowest signed integer type (no narrower than `floor`) which can hold every value in the array
+def smallest_int(values, floor=np.int8):
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).max < np.iinfo(floor).max:
+            continue
+        info = np.iinfo(dtype)
+        if values.size == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+
+# Writes the three tables as a directory of .npy files which can later be memory-mapped
+# Day counts are stored as one (series x day) int16 matrix, ids as integer codes, and prices as float32;
+# the calendar's event / SNAP features as one (day x feature) int8 matrix
+# `fingerprint` is the input_fingerprint() of the CSVs the tables were read from, if known
+def write_snapshot(sales, prices, calendar, snapshot_dir=SNAPSHOT_DIR, fingerprint=None):
+
+    day_columns = [c for c in sales.columns if c.startswith('d_')]
+
+    # Item and store categories are shared by sales and prices so their codes line up
+    categories = {
+        'id': sorted(sales['id'].unique().tolist()),
+        'item_id': sorted(set(sales['item_id']).union(prices['item_id'])),
+        'store_id': sorted(set(sales['store_id']).union(prices['store_id'])),
+        'state_id': sorted(sales['state_id'].unique().tolist()),
+    }
+
+    arrays = {}
+
+    counts = sales[day_columns].to_numpy()
+    arrays['sales.counts'] = smallest_int(counts, floor=np.int16) if counts.dtype.kind == 'i' else counts.astype(np.float32)
+    for column in SALES_KEYS:
+        arrays[f'sales.{column}'] = smallest_int(pd.Categorical(sales[column], categories=categories[column]).codes)
+
+    for column in PRICES_KEYS:
+        arrays[f'prices.{column}'] = smallest_int(pd.Categorical(prices[column], categories=categories[column]).codes)
+    arrays['prices.wm_yr_wk'] = prices['wm_yr_wk'].to_numpy(np.int32)
+    arrays['prices.sell_price'] = prices['sell_price'].to_numpy(np.float32)
+
+    # Dense (series x day) forward-filled prices lined up with sales.counts, memory-mapped by the app
+    arrays['sales.prices'] = daily_prices.daily_price_matrix(sales, prices, calendar)
+
+    arrays['calendar.date'] = pd.to_datetime(calendar['date']).to_numpy().astype('datetime64[D]')
+    arrays['calendar.wm_yr_wk'] = calendar['wm_yr_wk'].to_numpy(np.int32)
+    arrays['calendar.features'] = events.feature_matrix(calendar)
+
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'day_columns': day_columns,
+        'calendar_d': calendar['d'].tolist(),
+        'calendar_features': events.FEATURES,
+        'categories': categories,
+        'fingerprint': fingerprint,
+    }
+
+    # Write into a scratch directory first, then swap it in, so readers never see half a snapshot
+    tmp_dir = snapshot_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(values))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(tmp_dir, snapshot_dir)
+
+
+
+# True if a snapshot of the current layout exists at the given directory
+def snapshot_exists(snapshot_dir=SNAPSHOT_DIR):
+    meta_path = os.path.join(snapshot_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f).get('version') == SNAPSHOT_VERSION
+
+
+
+# Reads the snapshot's metadata (day columns, calendar day labels and category lists)
+def read_meta(snapshot_dir=SNAPSHOT_DIR):
+    with open(os.path.join(snapshot_dir, 'meta.json')) as f:
+        return json.load(f)
+
+
+
+# Rewrites the snapshot's metadata in place
+def write_meta(meta, snapshot_dir=SNAPSHOT_DIR):
+    tmp_path = os.path.join(snapshot_dir, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(snapshot_dir, 'meta.json'))
+
+
+
+# Replaces (or adds) a single stored array; processes still mapping the old file keep reading the old copy
+def save_array(name, values, snapshot_dir=SNAPSHOT_DIR):
+    tmp_path = os.path.join(snapshot_dir, f'{name}.tmp.npy')
+    np.save(tmp_path, np.ascontiguousarray(values))
+    os.replace(tmp_path, os.path.join(snapshot_dir, f'{name}.npy'))
+
+
+
+# Memory-maps a single stored array, e.g. open_array('sales.counts')
+def open_array(name, snapshot_dir=SNAPSHOT_DIR, mmap_mode='r'):
+    return np.load(os.path.join(snapshot_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+
+
+
+# Reads the snapshot's calendar (d, date as 'YYYY-MM-DD', wm_yr_wk and the int8 event / SNAP features)
+def read_calendar(snapshot_dir=SNAPSHOT_DIR, meta=None):
+    meta = meta or read_meta(snapshot_dir)
+    calendar = pd.DataFrame({
+        'd': meta['calendar_d'],
+        'date': pd.Series(np.asarray(open_array('calendar.date', snapshot_dir))).dt.strftime('%Y-%m-%d'),
+        'wm_yr_wk': open_array('calendar.wm_yr_wk', snapshot_dir),
+    })
+    features = pd.DataFrame(np.asarray(open_array('calendar.features', snapshot_dir)), columns=meta['calendar_features'])
+    return pd.concat([calendar, features], axis=1)
+
+
+
+# Opens the snapshot as the same three DataFrames load_data has always returned
+# The day counts stay memory-mapped and the id columns come back as categoricals, so nothing is parsed
+def read_snapshot(snapshot_dir=SNAPSHOT_DIR):
+
+    with stage('load.snapshot', source=snapshot_dir) as record:
+
+        meta = read_meta(snapshot_dir)
+        categories = meta['categories']
+
+        def categorical(table, column):
+            codes = open_array(f'{table}.{column}', snapshot_dir)
+            return pd.Categorical.from_codes(codes, categories=categories[column])
+
+        # Wrap the (series x day) matrix without copying, then put the id columns back in front
+        sales = pd.DataFrame(open_array('sales.counts', snapshot_dir), columns=meta['day_columns'], copy=False)
+        for position, column in enumerate(SALES_KEYS):
+            sales.insert(position, column, categorical('sales', column))
+
+        prices = pd.DataFrame({
+            'item_id': categorical('prices', 'item_id'),
+            'store_id': categorical('prices', 'store_id'),
+            'wm_yr_wk': open_array('prices.wm_yr_wk', snapshot_dir),
+            'sell_price': open_array('prices.sell_price', snapshot_dir),
+        })
+
+        calendar = read_calendar(snapshot_dir, meta)
+        record['rows'] = len(sales)
+
+    return sales, prices, calendar
+
+
+
+# Loads sales, prices and calendar, preferring the snapshot and falling back to the raw CSVs
+def load_data(source, snapshot_dir=SNAPSHOT_DIR):
+    if snapshot_exists(snapshot_dir):
+        return read_snapshot(snapshot_dir)
+    return read_csvs(source)
+
+
+
+# One-time conversion: python -m pricing.snapshot --source <dir or url> --out ./snapshot
+def main():
+    parser = argparse.ArgumentParser(description='Convert the raw M5 CSVs into a typed, memory-mappable snapshot.')
+    parser.add_argument('--source', default='.', help='Directory or URL prefix holding the M5 CSV files')
+    parser.add_argument('--out', default=SNAPSHOT_DIR, help='Snapshot directory to (re)write')
+    args = parser.parse_args()
+
+    fingerprint = input_fingerprint(args.source)
+    sales, prices, calendar = read_csvs(args.source)
+    write_snapshot(sales, prices, calendar, args.out, fingerprint)
+    print(f'Wrote snapshot of {len(sales)} series x {sales.shape[1] - len(SALES_KEYS)} days and {len(prices)} price rows to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
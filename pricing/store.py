@@ -0,0 +1,75 @@
+#------------------------------ Dependencies ------------------------------#
+
+import json
+import os
+import pickle
+import shutil
+import threading
+
+from pricing import snapshot
+
+#--------------------------------------------------------------------------#
+
+
+
+# Bump whenever a persisted table's layout or the code building it changes, so old copies are rebuilt
+TABLES_VERSION = 5
+
+# Derived tables a snapshot-backed Dataset persists, in the order the pre-warm builds them
+PERSISTED_TABLES = (
+    'monthly_day_prices', 'panel', 'arc_table', 'regression_table', 'seasonal_index', 'neighbour_index',
+    'adjusted_monthly_sales', 'controlled_regression_table',
+)
+
+
+
+# Key the persisted tables are stored under: the layout version, input fingerprint and aggregates revision of the
+# snapshot they were derived from, so they are dropped when the snapshot is rebuilt, the CSVs change or new days
+# are appended
+def table_key(meta):
+    return json.dumps([TABLES_VERSION, meta.get('version'), meta.get('fingerprint'), meta.get('aggregates', {}).get('revision')])
+
+
+
+# Derived tables (day-weighted prices, panel, elasticity tables, seasonal index, neighbour index, ...) pickled into <snapshot>/tables
+# load() returns None for a table that isn't stored, or was stored under another key
+class TableStore:
+
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.key = key
+        self._lock = threading.Lock()
+
+    # The store of a snapshot, keyed by its current metadata
+    @classmethod
+    def for_snapshot(cls, snapshot_dir=snapshot.SNAPSHOT_DIR):
+        return cls(os.path.join(snapshot_dir, 'tables'), table_key(snapshot.read_meta(snapshot_dir)))
+
+    def _stored_key(self):
+        try:
+            with open(os.path.join(self.directory, 'key.json')) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def load(self, name):
+        path = os.path.join(self.directory, f'{name}.pkl')
+        if self._stored_key() != self.key or not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    # Writes one table, first clearing out tables stored under an older key
+    def save(self, name, table):
+        with self._lock:
+            if self._stored_key() != self.key:
+                shutil.rmtree(self.directory, ignore_errors=True)
+                os.makedirs(self.directory)
+                with open(os.path.join(self.directory, 'key.json'), 'w') as f:
+                    f.write(self.key)
+
+            # Written to a scratch file and swapped in, so a reader never unpickles half a table
+            tmp_path = os.path.join(self.directory, f'{name}.pkl.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, os.path.join(self.directory, f'{name}.pkl'))
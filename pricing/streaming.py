@@ -0,0 +1,91 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing import aggregation, snapshot
+from pricing.instrumentation import stage
+
+#--------------------------------------------------------------------------#
+
+
+
+# Rows of the sales CSV parsed at a time; each chunk holds rows x 1,941 day counts in memory
+CHUNK_ROWS = 2000
+
+# Price rows parsed at a time
+PRICE_CHUNK_ROWS = 1_000_000
+
+
+
+# Sums the 'd' columns of each chunk straight into months and throws the raw days away
+# Peak memory is bounded by one chunk plus the (series x month) result, never the whole wide or long table
+def stream_monthly_sales(sales_path, calendar, chunk_rows=CHUNK_ROWS):
+
+    sales_columns = ['item_id', 'store_id', 'state_id'] + [f'd_{i}' for i in range(1, snapshot.N_DAYS + 1)]
+    dtypes = {f'd_{i}': np.int16 for i in range(1, snapshot.N_DAYS + 1)}
+
+    key_chunks, month_chunks = [], []
+    day_index = month_labels = None
+    for chunk in pd.read_csv(sales_path, usecols=sales_columns, dtype=dtypes, chunksize=chunk_rows):
+        day_columns = [c for c in chunk.columns if c.startswith('d_')]
+        if day_index is None:
+            day_index, month_labels = aggregation.day_month_index(day_columns, calendar)
+        key_chunks.append(chunk[aggregation.SALES_KEYS])
+        month_chunks.append(aggregation.sum_by_month(chunk[day_columns].to_numpy(), day_index, len(month_labels)))
+        del chunk
+
+    series = pd.concat(key_chunks, ignore_index=True)
+    monthly = np.concatenate(month_chunks)
+
+    # Keep only the months which actually have sales days, then group exactly as the in-memory engine does
+    observed = np.unique(day_index[day_index >= 0])
+    monthly, month_labels = monthly[:, observed], month_labels[observed]
+
+    keys, grouped = aggregation.group_series(series, monthly)
+    return keys, grouped, month_labels
+
+
+
+# Reads the price rows in chunks, keeping only per-(item, store, month) sums and counts between chunks
+def stream_monthly_prices(prices_path, calendar, chunk_rows=PRICE_CHUNK_ROWS):
+
+    prices_columns = ['item_id', 'store_id', 'wm_yr_wk', 'sell_price']
+
+    partials = []
+    for chunk in pd.read_csv(prices_path, usecols=prices_columns, chunksize=chunk_rows):
+        keys, price_sum, price_count, month_labels = aggregation.monthly_price_sums(chunk, calendar)
+        rows, columns = np.nonzero(price_count)
+        part = keys.iloc[rows].reset_index(drop=True)
+        part['year_month'] = month_labels[columns]
+        part['price_sum'] = price_sum[rows, columns]
+        part['price_count'] = price_count[rows, columns]
+        partials.append(part)
+        del chunk
+
+    # The same (item, store, month) can show up in several chunks, so combine the partial sums
+    combined = pd.concat(partials, ignore_index=True)
+    group_ids, keys = aggregation.group_keys(combined, aggregation.PRICES_KEYS)
+    month_labels = np.unique(aggregation.calendar_months(calendar))
+    flat = group_ids * len(month_labels) + np.searchsorted(month_labels, combined['year_month'].to_numpy())
+    size = len(keys) * len(month_labels)
+    price_sum = np.bincount(flat, weights=combined['price_sum'].to_numpy(), minlength=size).reshape(len(keys), -1)
+    price_count = np.bincount(flat, weights=combined['price_count'].to_numpy(), minlength=size).reshape(len(keys), -1).astype(np.int64)
+
+    return keys, price_sum, price_count, month_labels
+
+
+
+# Streaming version of calculate_monthly_sales_and_prices_optimized for small containers
+# Produces identical monthly_sales / monthly_prices while holding at most `chunk_rows` raw sales rows in memory
+def monthly_sales_and_prices(source, chunk_rows=CHUNK_ROWS, price_chunk_rows=PRICE_CHUNK_ROWS):
+
+    source = source.rstrip('/')
+    calendar = snapshot.read_calendar_csv(source)
+
+    with stage('aggregate.streaming', source=source, chunk_rows=chunk_rows) as record:
+        keys, monthly, month_labels = stream_monthly_sales(f'{source}/{snapshot.SALES_FILE}', calendar, chunk_rows)
+        price_keys, price_sum, price_count, price_months = stream_monthly_prices(f'{source}/{snapshot.PRICES_FILE}', calendar, price_chunk_rows)
+        record['rows'] = len(keys)
+
+    return aggregation.monthly_frames(keys, monthly, month_labels, price_keys, price_sum, price_count, price_months)
@@ -0,0 +1,145 @@
+#------------------------------ Dependencies ------------------------------#
+
+import argparse
+import threading
+
+from pricing import incremental, service, snapshot
+from pricing.instrumentation import event, logger, stage
+from pricing.store import PERSISTED_TABLES
+
+#--------------------------------------------------------------------------#
+
+
+
+# Builds everything the pages need on a background thread as soon as the server starts:
+#   1. fingerprints the raw CSVs and (re)writes the snapshot and its monthly aggregates only if they changed
+#   2. loads the process-wide Dataset from the snapshot
+#   3. reads the panel, elasticity tables, seasonal index and neighbour index back from the snapshot's table store,
+#      building (and persisting) only the ones it doesn't hold yet
+# fraction / status report progress for the pages to show; wait() blocks until it's done
+class Warmup:
+
+    def __init__(self, source, snapshot_dir):
+        self.source = source
+        self.snapshot_dir = snapshot_dir
+        self.fraction = 0.0
+        self.status = 'Waiting to start'
+        self.error = None
+        self.dataset = None
+        self._snapshot_ready = threading.Event()
+        self._done = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name='pricing-warmup', daemon=True).start()
+        return self
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    # True once the snapshot is current (what lazy mode needs before it can open it)
+    @property
+    def snapshot_ready(self):
+        return self._snapshot_ready.is_set()
+
+    # Blocks until the warm-up has finished (or, with snapshot_only, until the snapshot is current),
+    # calling progress(fraction, status) every `interval` seconds meanwhile
+    def wait(self, progress=None, snapshot_only=False, interval=0.5):
+        finished = self._snapshot_ready if snapshot_only else self._done
+        while not finished.wait(interval):
+            if progress is not None:
+                progress(self.fraction, self.status)
+
+    def _step(self, fraction, status):
+        self.fraction = fraction
+        self.status = status
+        event('warmup', fraction=fraction, status=status)
+
+    def _run(self):
+        try:
+            with stage('warmup', source=self.source):
+                self._prepare_snapshot()
+                self._snapshot_ready.set()
+
+                self._step(0.5, 'Loading the monthly aggregates')
+                self.dataset = service.get_dataset(self.source, self.snapshot_dir)
+
+                for position, table in enumerate(PERSISTED_TABLES):
+                    self._step(0.6 + 0.4 * position / len(PERSISTED_TABLES), f"Preparing the {table.replace('_', ' ')}")
+                    getattr(self.dataset, table)
+
+            self._step(1.0, 'Ready')
+        except Exception as error:
+            # The pages fall back to loading on demand, which reports the same error where it happens
+            self.error = error
+            self.status = f'Warm-up failed: {error}'
+            logger.exception('warmup failed')
+        finally:
+            self._snapshot_ready.set()
+            self._done.set()
+
+    # Rewrites the snapshot (and its aggregates) from the CSVs unless it was built from the same input files
+    # Without a reachable source (fingerprint None) an existing snapshot is kept as it is
+    def _prepare_snapshot(self):
+
+        # Streaming mode never holds the raw data, so there is no snapshot to build
+        if service.STREAMING_CHUNK_ROWS and not snapshot.snapshot_exists(self.snapshot_dir):
+            return
+
+        self._step(0.0, 'Checking the input files')
+        fingerprint = snapshot.input_fingerprint(self.source)
+        if snapshot.snapshot_exists(self.snapshot_dir):
+            stored = snapshot.read_meta(self.snapshot_dir).get('fingerprint')
+            if fingerprint is None or fingerprint == stored:
+                return
+
+        self._step(0.05, 'Reading the raw CSVs')
+        sales, prices, calendar = snapshot.read_csvs(self.source)
+
+        self._step(0.3, 'Writing the snapshot')
+        snapshot.write_snapshot(sales, prices, calendar, self.snapshot_dir, fingerprint)
+        incremental.write_aggregates(sales, prices, calendar, self.snapshot_dir)
+        del sales, prices, calendar
+
+        # Anything already loaded came from the old snapshot (or the CSVs)
+        service.reload()
+
+
+
+_warmups = {}
+_warmups_lock = threading.Lock()
+
+
+
+# Starts the process-wide warm-up on first call and returns it; later calls (any page, any session) get the same one
+def start_warmup(source=None, snapshot_dir=snapshot.SNAPSHOT_DIR):
+    key = (source or service.DATA_SOURCE, snapshot_dir)
+    with _warmups_lock:
+        if key not in _warmups:
+            _warmups[key] = Warmup(*key).start()
+        return _warmups[key]
+
+
+
+# Builds (or refreshes) the snapshot and persisted tables ahead of a deploy: python -m pricing.warmup --source <dir or url>
+def main():
+    parser = argparse.ArgumentParser(description='Build the snapshot, monthly aggregates and derived tables the app starts from.')
+    parser.add_argument('--source', default=None, help='Directory or URL prefix holding the M5 CSV files')
+    parser.add_argument('--snapshot', default=snapshot.SNAPSHOT_DIR, help='Snapshot directory to (re)write')
+    args = parser.parse_args()
+
+    shown = []
+    def report(fraction, status):
+        if status not in shown:
+            shown.append(status)
+            print(f'{fraction:4.0%} {status}')
+
+    warmup = start_warmup(args.source, args.snapshot)
+    warmup.wait(report)
+    if warmup.error is not None:
+        raise SystemExit(f'Warm-up failed: {warmup.error}')
+    print(f'Ready: {len(warmup.dataset.panel.keys)} series in {args.snapshot}')
+
+
+if __name__ == '__main__':
+    main()
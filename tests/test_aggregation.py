@@ -0,0 +1,86 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing import aggregation
+
+#--------------------------------------------------------------------------#
+
+
+
+# Two stores of two items over ~3 months, with cent prices that change every few weeks and a week that
+# straddles each month boundary
+def make_data(seed=0):
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-29', '2015-04-30')
+    calendar = pd.DataFrame({
+        'd': [f'd_{i + 1}' for i in range(len(dates))],
+        'date': dates.strftime('%Y-%m-%d'),
+        'wm_yr_wk': 11500 + np.arange(len(dates)) // 7,
+    })
+
+    series = [(item, store, store[:2]) for item in ('FOODS_1_001', 'FOODS_1_002') for store in ('CA_1', 'TX_1')]
+    sales = pd.DataFrame(series, columns=['item_id', 'store_id', 'state_id'])
+    counts = pd.DataFrame(rng.integers(0, 5, (len(series), len(dates))), columns=calendar['d'])
+    sales = pd.concat([sales, counts], axis=1)
+
+    weeks = np.unique(calendar['wm_yr_wk'])
+    prices = pd.DataFrame([
+        (store, item, week, round(float(rng.choice([0.1, 0.2, 0.7, 2.97, 3.33])), 2))
+        for item, store, _ in series for week in weeks
+    ], columns=['store_id', 'item_id', 'wm_yr_wk', 'sell_price'])
+
+    return sales, prices, calendar
+
+
+
+# The melt + merge + groupby the pages used before the matrix aggregation
+def groupby_monthly(sales, prices, calendar):
+
+    calendar = calendar.copy()
+    calendar['year_month'] = pd.to_datetime(calendar['date']).dt.to_period('M').astype(str)
+
+    sales_long = pd.melt(sales, id_vars=['item_id', 'store_id', 'state_id'], var_name='d', value_name='sales')
+    sales_long = sales_long.merge(calendar[['d', 'year_month']], on='d', how='left')
+    monthly_sales = sales_long.groupby(['item_id', 'store_id', 'state_id', 'year_month'], as_index=False, observed=True)['sales'].sum()
+
+    prices = prices.merge(calendar[['wm_yr_wk', 'year_month']].drop_duplicates(), on='wm_yr_wk', how='left')
+    monthly_prices = prices.groupby(['item_id', 'store_id', 'year_month'], as_index=False, observed=True)['sell_price'].mean()
+
+    return monthly_sales, monthly_prices
+
+
+
+def test_monthly_sales_match_groupby():
+    sales, prices, calendar = make_data()
+    monthly_sales, _ = aggregation.monthly_sales_and_prices(sales, prices, calendar)
+    expected, _ = groupby_monthly(sales, prices, calendar)
+    pd.testing.assert_frame_equal(monthly_sales, expected.astype({'sales': np.int64}))
+
+
+
+# The bincount sums round off differently from the groupby's compensated sums; once both are rounded to
+# PRICE_DECIMALS they are identical, and so is every series' number of distinct prices
+def test_monthly_prices_match_groupby():
+    for seed in range(5):
+        sales, prices, calendar = make_data(seed)
+        _, monthly_prices = aggregation.monthly_sales_and_prices(sales, prices, calendar)
+        _, expected = groupby_monthly(sales, prices, calendar)
+
+        expected['sell_price'] = expected['sell_price'].round(aggregation.PRICE_DECIMALS)
+        pd.testing.assert_frame_equal(monthly_prices, expected)
+
+        keys = ['item_id', 'store_id']
+        pd.testing.assert_series_equal(
+            monthly_prices.groupby(keys)['sell_price'].nunique(), expected.groupby(keys)['sell_price'].nunique()
+        )
+
+
+
+def test_constant_price_stays_constant():
+    sales, prices, calendar = make_data()
+    prices['sell_price'] = 0.7
+    _, monthly_prices = aggregation.monthly_sales_and_prices(sales, prices, calendar)
+    assert (monthly_prices['sell_price'] == 0.7).all()
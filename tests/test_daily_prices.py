@@ -0,0 +1,45 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing.daily_prices import daily_price_matrix, monthly_day_prices
+from pricing.elasticity import regression_elasticity_table
+from pricing.panel import SeriesPanel
+
+#--------------------------------------------------------------------------#
+
+
+
+# Two stores of one item over ~16 months at a constant shelf price, with the daily sales a snapshot would hold
+def make_data(price):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2011-01-29', '2012-05-31')
+    calendar = pd.DataFrame({
+        'd': [f'd_{i + 1}' for i in range(len(dates))],
+        'date': dates.strftime('%Y-%m-%d'),
+        'wm_yr_wk': 11101 + np.arange(len(dates)) // 7,
+    })
+    sales = pd.DataFrame({'item_id': 'FOODS_1_001', 'store_id': ['CA_1', 'CA_2'], 'state_id': 'CA'})
+    sales = pd.concat([sales, pd.DataFrame(rng.integers(1, 9, (2, len(dates))), columns=calendar['d'])], axis=1)
+    prices = pd.DataFrame([
+        (store, 'FOODS_1_001', week, price) for store in ('CA_1', 'CA_2') for week in np.unique(calendar['wm_yr_wk'])
+    ], columns=['store_id', 'item_id', 'wm_yr_wk', 'sell_price'])
+    return sales, prices, calendar
+
+
+
+# The day-weighted mean of a constant price is that price, not a few ulps either side of it, so the series has
+# no price variability and no (1e12-sized) elasticity
+def test_constant_price_has_no_price_variability():
+    for price in (0.7, 2.97, 3.33, 9.99):
+        sales, prices, calendar = make_data(price)
+        # float32, as the snapshot stores the matrix
+        matrix = daily_price_matrix(sales, prices, calendar).astype(np.float32)
+        day_prices = monthly_day_prices(sales, matrix, calendar)
+        assert (day_prices['sell_price'] == price).all()
+
+        monthly_sales = day_prices[['item_id', 'store_id', 'year_month']].assign(state_id='CA', sales=10)
+        table = regression_elasticity_table(SeriesPanel(monthly_sales, day_prices).data)
+        assert not table['price_variability'].any()
+        assert table['elasticity'].isna().all()
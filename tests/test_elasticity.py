@@ -0,0 +1,65 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pricing import bootstrap, elasticity, rolling
+
+#--------------------------------------------------------------------------#
+
+
+
+# One (item, state) panel of n months with the given prices and rising sales
+def make_panel(prices):
+    n = len(prices)
+    return pd.DataFrame({
+        'item_id': 'FOODS_1_001',
+        'store_id': 'CA_1',
+        'state_id': 'CA',
+        'year_month': [f'{2011 + i // 12}-{i % 12 + 1:02d}' for i in range(n)],
+        'sales': np.arange(1, n + 1, dtype=np.float64),
+        'sell_price': prices,
+        'event_share': np.linspace(0, 1, n),
+    })
+
+
+
+# A price that differs only in its last bit between months is one price: no estimator fits a slope to it
+def test_rounding_noise_is_not_price_variability():
+    price = 0.71
+    panel = make_panel(np.where(np.arange(12) % 2, price, np.nextafter(price, 1)))
+
+    regression = elasticity.regression_elasticity_table(panel)
+    assert not regression['price_variability'].iloc[0]
+    assert np.isnan(regression['elasticity'].iloc[0])
+
+    controlled = elasticity.controlled_regression_table(panel, ['event_share'])
+    assert not controlled['price_variability'].iloc[0]
+
+    assert rolling.rolling_elasticity_table(panel)['elasticity'].isna().all()
+    assert bootstrap.bootstrap_elasticity_table(panel, resamples=50)['ci_low'].isna().all()
+
+
+
+# A real price change passes the guard, and every estimator agrees with a plain least-squares fit
+def test_price_change_is_price_variability():
+    prices = np.array([2.97, 2.97, 3.33, 3.33, 2.5, 2.97, 3.33, 2.5, 2.5, 2.97, 3.33, 2.97])
+    panel = make_panel(prices)
+    slope, _ = np.polyfit(prices, panel['sales'], 1)
+    expected = slope * prices.mean() / panel['sales'].mean()
+
+    regression = elasticity.regression_elasticity_table(panel)
+    assert regression['price_variability'].iloc[0]
+    assert np.isclose(regression['elasticity'].iloc[0], expected)
+    assert np.isclose(rolling.rolling_elasticity_table(panel)['elasticity'].iloc[-1], expected)
+    assert elasticity.controlled_regression_table(panel, ['event_share'])['price_variability'].iloc[0]
+
+
+
+def test_rolling_window_must_be_positive():
+    panel = make_panel(np.full(12, 2.97))
+    for window in (0, -3):
+        with pytest.raises(ValueError):
+            rolling.rolling_elasticity_table(panel, window)
+    assert len(rolling.rolling_elasticity_table(panel, 1)) == 12
@@ -0,0 +1,44 @@
+#------------------------------ Dependencies ------------------------------#
+
+import numpy as np
+import pandas as pd
+
+from pricing import granularity
+from pricing.seasonal import SeasonalIndex
+
+#--------------------------------------------------------------------------#
+
+
+
+# A calendar over 2011 with Walmart-style weeks starting on the Saturday of 2011-01-29, and a series selling
+# 10 units a day, so each month's base demand is 10 x its days
+def make_index():
+    dates = pd.date_range('2011-01-29', '2011-12-31')
+    calendar = pd.DataFrame({
+        'd': [f'd_{i + 1}' for i in range(len(dates))],
+        'date': dates.strftime('%Y-%m-%d'),
+        'wm_yr_wk': 11101 + np.arange(len(dates)) // 7,
+    })
+    months = pd.period_range('2011-01', '2011-12', freq='M')
+    panel = pd.DataFrame({
+        'item_id': 'FOODS_1_001', 'state_id': 'CA', 'store_id': 'CA_1',
+        'year_month': months.astype(str), 'sales': 10.0 * months.days_in_month,
+    })
+    return SeasonalIndex(panel), calendar
+
+
+
+def test_month_is_the_seasonal_base_demand():
+    index, calendar = make_index()
+    assert granularity.period_base_demand(index, 'FOODS_1_001', 'CA', '2011-03', 'month', calendar) == 310
+
+
+
+# A day, a week (including one straddling February and March) and a quarter are in the same units as their sales
+def test_other_granularities_take_their_days():
+    index, calendar = make_index()
+    assert np.isclose(granularity.period_base_demand(index, 'FOODS_1_001', 'CA', '2011-03-15', 'day', calendar), 10)
+    for week in ('11101', '11105'):
+        assert np.isclose(granularity.period_base_demand(index, 'FOODS_1_001', 'CA', week, 'week', calendar), 70)
+    assert np.isclose(granularity.period_base_demand(index, 'FOODS_1_001', 'CA', '2011Q2', 'quarter', calendar), 910)
+    assert np.isnan(granularity.period_base_demand(index, 'FOODS_1_001', 'CA', '9999', 'week', calendar))